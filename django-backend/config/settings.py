@@ -63,6 +63,18 @@ CELERY_TIMEZONE = 'America/Regina'
 CELERY_ENABLE_UTC = True
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+CELERY_TASK_ROUTES = {
+    'note.tasks.embed_note': {'queue': 'embeddings'},
+    'note.tasks.train_ivf_index': {'queue': 'embeddings'},
+    'note.tasks.refresh_note_neighbors': {'queue': 'embeddings'},
+    'note.tasks.rebuild_note_neighbors': {'queue': 'embeddings'},
+    'note.tasks.reindex_embeddings': {'queue': 'embeddings'},
+    'note.tasks.build_shadow_index': {'queue': 'embeddings'},
+    'note.tasks.sweep_stale_embeddings': {'queue': 'embeddings'},
+    'note.tasks.cluster_note_topics': {'queue': 'embeddings'},
+    'note.tasks.build_note_maps': {'queue': 'embeddings'},
+    'note.tasks.build_user_note_map': {'queue': 'embeddings'},
+}
 
 # Celery Beat schedule
 from celery.schedules import crontab
@@ -72,6 +84,26 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'account.tasks.check_and_send_reminders',
         'schedule': crontab(minute='*/1'),  # Every minute
     },
+    'train-ivf-index-nightly': {
+        'task': 'note.tasks.train_ivf_index',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    'sweep-stale-embeddings': {
+        'task': 'note.tasks.sweep_stale_embeddings',
+        'schedule': crontab(minute='*/15'),
+    },
+    'cluster-note-topics-nightly': {
+        'task': 'note.tasks.cluster_note_topics',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'build-note-maps-nightly': {
+        'task': 'note.tasks.build_note_maps',
+        'schedule': crontab(hour=4, minute=30),
+    },
+    'reindex-embeddings': {
+        'task': 'note.tasks.reindex_embeddings',
+        'schedule': crontab(minute='*/10'),
+    },
 }
 
 CACHES = {
@@ -167,6 +199,9 @@ DATABASES = {
     "embeddings": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "data/embeddings.sqlite3",
+        # A file rather than Django's shared-cache memory database, so the sqlite-vec connections of
+        # note.embedding_utils.connection can open the test database too
+        "TEST": {"NAME": BASE_DIR / "data/test_embeddings.sqlite3"},
     }
 }
 DATABASE_ROUTERS = [
@@ -285,11 +320,88 @@ REST_FRAMEWORK = {
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 SESSION_COOKIE_AGE = 60 * 60 * 24 * 30 # 1 month
 
+# Embedding backend: ollama (HTTP), onnx (in-process CPU, needs onnxruntime and tokenizers) or hashing (tests/benchmarks)
+EMBEDDING_PROVIDER = os.environ.get("EMBEDDING_PROVIDER", "ollama")
 OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "granite-embedding:30m")
+# Pooled keep-alive client for OLLAMA_URL: timeouts in seconds, retries cover connection errors and 502/503/504.
+# After OLLAMA_BREAKER_FAILURES failures in a row calls fail fast for OLLAMA_BREAKER_RESET_SECONDS
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "2"))
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "30"))
+# Read timeout of embeddings a web request waits on (search queries, similar-text lookups); jobs use the one above
+OLLAMA_REQUEST_READ_TIMEOUT = float(os.environ.get("OLLAMA_REQUEST_READ_TIMEOUT", "5"))
+OLLAMA_RETRIES = int(os.environ.get("OLLAMA_RETRIES", "2"))
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", "10"))
+OLLAMA_BREAKER_FAILURES = int(os.environ.get("OLLAMA_BREAKER_FAILURES", "5"))
+OLLAMA_BREAKER_RESET_SECONDS = int(os.environ.get("OLLAMA_BREAKER_RESET_SECONDS", "30"))
+# Vector size of the configured model, whichever provider serves it
 OLLAMA_EMBEDDING_SIZE = int(os.environ.get("OLLAMA_EMBEDDING_SIZE", "384"))
+# EMBEDDING_ONNX_MODEL_ROOT/<EMBEDDING_ONNX_MODEL>/ holds model.onnx and tokenizer.json
+EMBEDDING_ONNX_MODEL_ROOT = os.environ.get("EMBEDDING_ONNX_MODEL_ROOT", str(BASE_DIR / "data/onnx-models"))
+EMBEDDING_ONNX_MODEL = os.environ.get("EMBEDDING_ONNX_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_ONNX_THREADS = int(os.environ.get("EMBEDDING_ONNX_THREADS", "2"))
+EMBEDDING_ONNX_BATCH_SIZE = int(os.environ.get("EMBEDDING_ONNX_BATCH_SIZE", "32"))
+EMBEDDING_ONNX_MAX_LENGTH = int(os.environ.get("EMBEDDING_ONNX_MAX_LENGTH", "256"))
+# Bump to re-embed everything with the same model; changing any of these three starts a shadow re-index
+EMBEDDING_MODEL_VERSION = os.environ.get("EMBEDDING_MODEL_VERSION", "1")
+# Preprocessed text is cut to this many characters (~4 per token) to fit the model's context window
+EMBEDDING_MAX_INPUT_CHARS = int(os.environ.get("EMBEDDING_MAX_INPUT_CHARS", "2000"))
+EMBEDDING_REINDEX_BATCH_SIZE = int(os.environ.get("EMBEDDING_REINDEX_BATCH_SIZE", "64"))
+EMBEDDING_REINDEX_THROTTLE_SECONDS = int(os.environ.get("EMBEDDING_REINDEX_THROTTLE_SECONDS", "2"))
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_BATCH_WAIT_MS = int(os.environ.get("EMBEDDING_BATCH_WAIT_MS", "10"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+# A cache hit only rewrites the entry's last_used (its LRU position) when it is older than this
+EMBEDDING_CACHE_TOUCH_SECONDS = int(os.environ.get("EMBEDDING_CACHE_TOUCH_SECONDS", "3600"))
+EMBEDDING_CHUNK_SIZE = int(os.environ.get("EMBEDDING_CHUNK_SIZE", "1000"))
+EMBEDDING_CHUNK_OVERLAP = int(os.environ.get("EMBEDDING_CHUNK_OVERLAP", "100"))
+EMBEDDING_CHUNK_OVERFETCH = 4
+EMBEDDING_DEBOUNCE_SECONDS = int(os.environ.get("EMBEDDING_DEBOUNCE_SECONDS", "5"))
+EMBEDDING_RETRY_BACKOFF_SECONDS = int(os.environ.get("EMBEDDING_RETRY_BACKOFF_SECONDS", "30"))
+# Edits changing fewer than this share of distinct words keep their vector until the note is idle or the vector stale
+EMBEDDING_CHANGE_THRESHOLD = float(os.environ.get("EMBEDDING_CHANGE_THRESHOLD", "0.2"))
+EMBEDDING_IDLE_REFRESH_SECONDS = int(os.environ.get("EMBEDDING_IDLE_REFRESH_SECONDS", "600"))
+EMBEDDING_MAX_STALENESS_SECONDS = int(os.environ.get("EMBEDDING_MAX_STALENESS_SECONDS", "86400"))
+# note.tasks.sweep_stale_embeddings re-queues at most this many missing/stale notes per run, this many per second
+EMBEDDING_SWEEP_MAX_JOBS = int(os.environ.get("EMBEDDING_SWEEP_MAX_JOBS", "500"))
+EMBEDDING_SWEEP_RATE = float(os.environ.get("EMBEDDING_SWEEP_RATE", "2"))
+# The sweep also caches each user's coverage summary for /api/note/stats/embeddings/; a few sweep intervals
+EMBEDDING_FRESHNESS_CACHE_SECONDS = 60 * 60
+# Store an int8 or binary copy of each vector for the KNN scan and re-rank candidates on the float vectors: none | int8 | binary.
+# The copy is kept next to the float vector, so the vector tables grow (by 1/4 for int8, 1/32 for binary) rather than
+# shrink; what gets smaller is the column the KNN scan reads
+EMBEDDING_QUANTIZATION = os.environ.get("EMBEDDING_QUANTIZATION", "none")
+EMBEDDING_RERANK_FACTOR = int(os.environ.get("EMBEDDING_RERANK_FACTOR", "4"))
+EMBEDDING_NEIGHBOR_COUNT = int(os.environ.get("EMBEDDING_NEIGHBOR_COUNT", "20"))
+# IVF index over note vectors, retrained periodically by note.tasks.train_ivf_index; 0 lists = sqrt(number of vectors).
+# The inverted lists are vec0 partitions holding a second float copy of each note vector while the index is trained
+EMBEDDING_IVF_ENABLED = int(os.environ.get("EMBEDDING_IVF_ENABLED", "0"))
+EMBEDDING_IVF_LISTS = int(os.environ.get("EMBEDDING_IVF_LISTS", "0"))
+EMBEDDING_IVF_NPROBE = int(os.environ.get("EMBEDDING_IVF_NPROBE", "8"))
+EMBEDDING_IVF_MIN_VECTORS = int(os.environ.get("EMBEDDING_IVF_MIN_VECTORS", "10000"))
+EMBEDDING_IVF_TRAIN_SAMPLE = int(os.environ.get("EMBEDDING_IVF_TRAIN_SAMPLE", "50000"))
+
+# Memory-mapped float32 export of all note vectors, refreshed by note.tasks.cluster_note_topics
+EMBEDDING_MATRIX_DIR = os.environ.get("EMBEDDING_MATRIX_DIR", str(BASE_DIR / "data/embedding-matrix"))
+EMBEDDING_TOPIC_MIN_NOTES = int(os.environ.get("EMBEDDING_TOPIC_MIN_NOTES", "20"))
+EMBEDDING_TOPIC_MAX_CLUSTERS = int(os.environ.get("EMBEDDING_TOPIC_MAX_CLUSTERS", "30"))
+NOTE_MAP_CACHE_SECONDS = 60 * 60 * 24
+
+# Near-duplicate detection: MinHash over word 3-grams, LSH with bands of PERMUTATIONS / BANDS rows.
+# Changing either needs `manage.py find_duplicates --rebuild`
+DUPLICATE_MINHASH_PERMUTATIONS = 128
+DUPLICATE_LSH_BANDS = 16
+DUPLICATE_SIMILARITY_THRESHOLD = float(os.environ.get("DUPLICATE_SIMILARITY_THRESHOLD", "0.8"))
 
 NOTES_PAGE_SIZE = 20
+SEARCH_HYBRID_CANDIDATES = int(os.environ.get("SEARCH_HYBRID_CANDIDATES", "100"))
+SEARCH_RRF_K = 60
+# Similar-text results are kept this long and served while the embedding service is unavailable
+SIMILAR_RESULTS_CACHE_SECONDS = 60 * 60
+# Same cut-off as the 0.65 similarity score used by the similar-notes endpoint
+SEARCH_HYBRID_MAX_DISTANCE = 1.4
+# Words of context in each search result snippet
+SEARCH_SNIPPET_WORDS = 24
 
 TIME_ZONE = "America/Regina"
 
@@ -9,6 +9,8 @@ python manage.py migrate --database=revisions
 
 python manage.py migrate --database=embeddings
 
+python manage.py setup_vector_tables
+
 
 
 # python manage.py check_email
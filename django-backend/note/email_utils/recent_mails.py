@@ -4,7 +4,7 @@ from email.header import decode_header
 import time
 import os
 from datetime import datetime
-from note.models import LocalMessage, LocalMessageList
+from note.models import LocalMessage, LocalMessageList, NoteSignature
 from django.conf import settings
 
 
@@ -70,7 +70,10 @@ def process_email(email_message):
     print("=" * 50)
 
     # Placeholder for database insertion
-    LocalMessage.objects.create(text=body, list=LocalMessageList.objects.get(slug="default"))
+    note = LocalMessage.objects.create(text=body, list=LocalMessageList.objects.get(slug="default"))
+    duplicate_ids = NoteSignature.update_for_note(note)
+    if duplicate_ids:
+        print(f"Note {note.id} looks like a duplicate of notes {duplicate_ids}")
 
 def check_for_new_emails(username, password, interval_seconds=60, reconnect_interval=3600):
     imap = None
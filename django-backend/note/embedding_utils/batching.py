@@ -0,0 +1,91 @@
+import functools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """
+    Collects single-text embedding requests for a few milliseconds and
+    sends them to the model as one batched call.
+
+    Callers block on embed() until their vector is ready, so the batcher is
+    a drop-in replacement for a direct per-text request.
+    """
+
+    def __init__(self, embed_batch, max_batch_size=32, max_wait_ms=10):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = os.getpid()
+
+    def embed(self, text, timeout=None):
+        future = Future()
+        self._queue.put((text, future))
+        self._ensure_worker()
+        return future.result(timeout=timeout)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._worker = None
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+                self._worker.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            unique_texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = self.embed_batch(unique_texts)
+                by_text = dict(zip(unique_texts, vectors))
+                for text, future in batch:
+                    future.set_result(by_text[text])
+            except Exception as e:
+                logger.error(f"Batched embedding request for {len(unique_texts)} texts failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                from ..models import NoteEmbedding
+                # Only web requests embed through the batcher, so it uses the short request-path timeout
+                _batcher = EmbeddingBatcher(
+                    functools.partial(NoteEmbedding.get_embeddings, read_timeout=settings.OLLAMA_REQUEST_READ_TIMEOUT),
+                    max_batch_size=settings.EMBEDDING_BATCH_SIZE,
+                    max_wait_ms=settings.EMBEDDING_BATCH_WAIT_MS,
+                )
+    return _batcher
@@ -0,0 +1,103 @@
+import os
+import sqlite3
+import struct
+import threading
+from contextlib import contextmanager
+
+import sqlite_vec
+from django.conf import settings
+
+
+def serialize_vector(vector):
+    """Pack a vector into the raw float32 blob format sqlite-vec expects"""
+    return sqlite_vec.serialize_float32(vector)
+
+
+def deserialize_vector(blob):
+    """Unpack a float32 blob produced by serialize_vector"""
+    return list(struct.unpack(f"{len(blob) // 4}f", blob))
+
+
+class EmbeddingConnectionManager:
+    """
+    Long-lived sqlite-vec connections for the embeddings database.
+
+    Every thread gets its own warm read connection, while all writes go
+    through a single writer connection guarded by a lock so concurrent
+    writers queue up instead of failing with "database is locked".
+    """
+    BUSY_TIMEOUT_MS = 30000
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._writer = None
+        self._pid = os.getpid()
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=self.BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        db.enable_load_extension(True)
+        sqlite_vec.load(db)
+        db.enable_load_extension(False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(f"PRAGMA busy_timeout={self.BUSY_TIMEOUT_MS}")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _reset_after_fork(self):
+        # Connections must never be shared across processes (celery prefork, runserver reload)
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._local = threading.local()
+            self._write_lock = threading.RLock()
+            self._writer = None
+
+    def reader(self):
+        """Return this thread's read connection, opening it on first use"""
+        self._reset_after_fork()
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._connect()
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def writer(self):
+        """Serialize a write transaction through the shared writer connection"""
+        self._reset_after_fork()
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            db = self._writer
+            try:
+                yield db
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_embedding_db():
+    """Return the per-process connection manager for settings.DATABASES['embeddings']"""
+    global _manager
+    db_path = str(settings.DATABASES['embeddings']['NAME'])
+    if _manager is None or _manager.db_path != db_path:
+        with _manager_lock:
+            if _manager is None or _manager.db_path != db_path:
+                _manager = EmbeddingConnectionManager(db_path)
+    return _manager
@@ -0,0 +1,202 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingServiceUnavailable(Exception):
+    """The circuit breaker is open, so the embedding server is not being called"""
+
+
+class CircuitBreaker:
+    """
+    Fails fast after repeated failures instead of letting every caller wait on a dead server.
+
+    After failure_threshold consecutive failures the breaker opens and
+    rejects calls for reset_seconds. It then lets a single trial call
+    through: success closes it, failure opens it for another period.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                return
+            raise EmbeddingServiceUnavailable(
+                f"Embedding service circuit is {self.state} after {self.failures} failures"
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Opening embedding service circuit after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class LatencyStats:
+    """Request counters and latency percentiles over the most recent calls of this process"""
+
+    def __init__(self, window=500):
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, failed=False):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.requests += 1
+            self.failures += failed
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            requests_, failures, rejected = self.requests, self.failures, self.rejected
+
+        def percentile(fraction):
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 1)
+
+        return {
+            'requests': requests_,
+            'failures': failures,
+            'rejected': rejected,
+            'latency_ms': {
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': round(latencies[-1] * 1000, 1),
+                'mean': round(sum(latencies) / len(latencies) * 1000, 1),
+            } if latencies else None,
+        }
+
+
+class ResilientClient:
+    """
+    Keep-alive JSON client for one HTTP service.
+
+    A pooled requests.Session with connect/read timeouts and bounded
+    retries of connection errors and 502/503/504 responses, behind a
+    circuit breaker. Read timeouts are not retried, so a stalled server
+    costs a caller at most one read timeout.
+    """
+
+    def __init__(self, base_url, connect_timeout=2, read_timeout=30, retries=2, backoff=0.5, pool_size=10,
+                 failure_threshold=5, reset_seconds=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self.stats = LatencyStats()
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        # Pooled sockets must not be shared with a forked worker process
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                retry = Retry(
+                    total=self.retries, connect=self.retries, read=0, status=self.retries,
+                    status_forcelist=(502, 503, 504), allowed_methods=frozenset({'POST'}),
+                    backoff_factor=self.backoff, raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session, self._pid = session, os.getpid()
+            return self._session
+
+    def post_json(self, path, payload, read_timeout=None):
+        """POST payload as JSON and return the decoded response; read_timeout overrides the client's for this call"""
+        timeout = self.timeout if read_timeout is None else (self.timeout[0], read_timeout)
+        try:
+            self.breaker.before_call()
+        except EmbeddingServiceUnavailable:
+            self.stats.record_rejected()
+            raise
+
+        start = time.monotonic()
+        try:
+            response = self._get_session().post(f"{self.base_url}{path}", json=payload, timeout=timeout)
+        except requests.RequestException:
+            self.breaker.record_failure()
+            self.stats.record(time.monotonic() - start, failed=True)
+            raise
+
+        elapsed = time.monotonic() - start
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            self.stats.record(elapsed, failed=True)
+            raise requests.HTTPError(f"{response.status_code} from {path}: {response.text[:200]}", response=response)
+
+        # A 4xx is a bad request, not a sick server, so it does not count against the breaker
+        self.breaker.record_success()
+        self.stats.record(elapsed, failed=response.status_code != 200)
+        if response.status_code != 200:
+            raise requests.HTTPError(f"{response.status_code} from {path}: {response.text[:200]}", response=response)
+        return response.json()
+
+    def metrics(self):
+        return {
+            'circuit': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            **self.stats.snapshot(),
+        }
+
+
+_ollama_client = None
+_ollama_client_lock = threading.Lock()
+
+
+def get_ollama_client():
+    """The process-wide client for OLLAMA_URL"""
+    global _ollama_client
+    if _ollama_client is None:
+        with _ollama_client_lock:
+            if _ollama_client is None:
+                _ollama_client = ResilientClient(
+                    settings.OLLAMA_URL,
+                    connect_timeout=settings.OLLAMA_CONNECT_TIMEOUT,
+                    read_timeout=settings.OLLAMA_READ_TIMEOUT,
+                    retries=settings.OLLAMA_RETRIES,
+                    pool_size=settings.OLLAMA_POOL_SIZE,
+                    failure_threshold=settings.OLLAMA_BREAKER_FAILURES,
+                    reset_seconds=settings.OLLAMA_BREAKER_RESET_SECONDS,
+                )
+    return _ollama_client
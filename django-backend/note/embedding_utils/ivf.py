@@ -0,0 +1,168 @@
+import json
+import math
+
+import numpy as np
+
+from .connection import serialize_vector
+from .kmeans import kmeans, nearest_centroids
+from .vector_tables import NOTE_VECTOR_TABLE, REBUILD_BATCH_SIZE, table_columns
+
+CENTROID_TABLE = 'note_ivf_centroids'
+LIST_TABLE = 'note_ivf_lists'
+LIST_COLUMNS = {'rowid', 'user_id', 'centroid_id', 'embedding', 'list_id', 'archived'}
+
+
+def _list_table_sql(dimensions):
+    return f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {LIST_TABLE}
+        USING vec0(
+            user_id integer partition key,
+            centroid_id integer partition key,
+            embedding float[{dimensions}],
+            list_id integer,
+            archived boolean
+        )
+    """
+
+
+def ensure_ivf_tables(db, dimensions):
+    """
+    IVF index over note vectors: k-means centroids in a vec0 table and the
+    inverted lists as a second vec0 table partitioned by (user_id, centroid_id).
+
+    Each probed list is its own vec0 partition, so a probe only reads the
+    chunks of that list. The cost is a second float copy of every note
+    vector while the index is trained. A list table from the older
+    rowid-mapping layout is dropped, leaving the index untrained until
+    the next training run.
+    """
+    columns = table_columns(db, LIST_TABLE)
+    if columns and set(columns) != LIST_COLUMNS:
+        db.execute(f"DROP TABLE {LIST_TABLE}")
+        db.execute(f"DROP TABLE IF EXISTS {CENTROID_TABLE}")
+    db.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {CENTROID_TABLE} USING vec0(embedding float[{dimensions}])")
+    db.execute(_list_table_sql(dimensions))
+
+
+def is_trained(db):
+    return db.execute(f"SELECT 1 FROM {CENTROID_TABLE} LIMIT 1").fetchone() is not None
+
+
+def _insert(db, rows):
+    db.executemany(
+        f"INSERT INTO {LIST_TABLE}(rowid, user_id, centroid_id, list_id, archived, embedding) VALUES (?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+
+def assign(db, rows):
+    """Add (note_id, user_id, list_id, archived, float32 blob) rows to the list of their nearest centroid"""
+    if not is_trained(db):
+        return
+    remove(db, [row[0] for row in rows])
+    assignments = []
+    for note_id, user_id, list_id, archived, embedding in rows:
+        centroid = db.execute(
+            f"SELECT rowid FROM {CENTROID_TABLE} WHERE embedding MATCH ? AND k = 1",
+            [embedding]
+        ).fetchone()
+        assignments.append([note_id, user_id, centroid[0], list_id, archived, embedding])
+    _insert(db, assignments)
+
+
+def remove(db, note_ids):
+    db.execute(f"DELETE FROM {LIST_TABLE} WHERE rowid IN (SELECT value FROM json_each(?))", [json.dumps(list(note_ids))])
+
+
+def update_metadata(db, note):
+    db.execute(
+        f"UPDATE {LIST_TABLE} SET list_id = ?, archived = ? WHERE rowid = ?",
+        [note.list_id, note.archived, note.id]
+    )
+
+
+def probe(db, embedding_blob, k, clause, params, nprobe):
+    """
+    Return up to k (rowid, distance) pairs from the lists of the nprobe nearest centroids.
+
+    clause/params are the filter_clause constraints of the exact scan; each
+    list is searched as one (user_id, centroid_id) partition and the
+    per-list results are merged by distance.
+    """
+    centroid_ids = [row[0] for row in db.execute(
+        f"SELECT rowid FROM {CENTROID_TABLE} WHERE embedding MATCH ? AND k = ?",
+        [embedding_blob, nprobe]
+    )]
+    rows = []
+    for centroid_id in centroid_ids:
+        rows.extend(db.execute(
+            f"""
+            SELECT rowid, distance
+            FROM {LIST_TABLE}
+            WHERE embedding MATCH ?
+                AND k = ?
+                AND centroid_id = ?
+                {clause}
+            """,
+            [embedding_blob, k, centroid_id, *params]
+        ).fetchall())
+    return sorted(rows, key=lambda row: row[1])[:k]
+
+
+def _load_vectors(db, dimensions):
+    rows = db.execute(f"SELECT rowid, user_id, list_id, archived, embedding FROM {NOTE_VECTOR_TABLE}").fetchall()
+    metadata = [row[:4] for row in rows]
+    vectors = np.frombuffer(b''.join(row[4] for row in rows), dtype=np.float32).reshape(-1, dimensions)
+    return metadata, vectors
+
+
+def train(manager, dimensions, n_lists=0, sample_size=50000, iterations=20, seed=0):
+    """
+    Retrain centroids on a sample of the stored vectors and rebuild the inverted lists.
+
+    n_lists defaults to sqrt(N). Centroids and lists are swapped in one
+    write transaction, and vectors written while k-means was running are
+    assigned against the new centroids before it commits.
+    """
+    metadata, vectors = _load_vectors(manager.reader(), dimensions)
+    if not len(vectors):
+        return 0
+
+    n_lists = n_lists or max(1, int(math.sqrt(len(vectors))))
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False)]
+    centroids = kmeans(sample, n_lists, iterations=iterations, seed=seed)
+    labels = nearest_centroids(vectors, centroids)
+
+    with manager.writer() as db:
+        db.execute(f"DELETE FROM {CENTROID_TABLE}")
+        db.executemany(
+            f"INSERT INTO {CENTROID_TABLE}(rowid, embedding) VALUES (?, ?)",
+            [[index + 1, serialize_vector(centroid.tolist())] for index, centroid in enumerate(centroids)]
+        )
+        # Recreating the list table also drops the slots of vectors deleted since the last run
+        db.execute(f"DROP TABLE {LIST_TABLE}")
+        db.execute(_list_table_sql(dimensions))
+        for start in range(0, len(metadata), REBUILD_BATCH_SIZE):
+            _insert(db, [
+                [note_id, user_id, int(label) + 1, list_id, archived, vector.tobytes()]
+                for (note_id, user_id, list_id, archived), label, vector in zip(
+                    metadata[start:start + REBUILD_BATCH_SIZE],
+                    labels[start:start + REBUILD_BATCH_SIZE],
+                    vectors[start:start + REBUILD_BATCH_SIZE],
+                )
+            ])
+        missing = db.execute(f"""
+            SELECT rowid, user_id, list_id, archived, embedding FROM {NOTE_VECTOR_TABLE}
+            WHERE rowid NOT IN (SELECT rowid FROM {LIST_TABLE})
+        """).fetchall()
+        assign(db, missing)
+        # Notes deleted while k-means was running
+        db.execute(f"DELETE FROM {LIST_TABLE} WHERE rowid NOT IN (SELECT rowid FROM {NOTE_VECTOR_TABLE})")
+    return len(centroids)
+
+
+def clear(manager):
+    with manager.writer() as db:
+        db.execute(f"DELETE FROM {CENTROID_TABLE}")
+        db.execute(f"DELETE FROM {LIST_TABLE}")
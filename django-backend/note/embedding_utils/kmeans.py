@@ -0,0 +1,63 @@
+import numpy as np
+
+
+def squared_distances(vectors, centroids):
+    """Pairwise squared L2 distances between the rows of two float32 matrices"""
+    return (
+        (vectors ** 2).sum(axis=1)[:, None]
+        - 2 * vectors @ centroids.T
+        + (centroids ** 2).sum(axis=1)[None, :]
+    )
+
+
+def nearest_centroids(vectors, centroids, batch_size=4096):
+    """Index of the closest centroid for each vector, computed in batches to bound memory"""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        labels[start:start + batch_size] = squared_distances(batch, centroids).argmin(axis=1)
+    return labels
+
+
+def kmeans(vectors, k, iterations=20, seed=0):
+    """
+    Lloyd's k-means with k-means++ seeding.
+
+    Returns a (k, dims) float32 centroid matrix; k is capped at the number
+    of vectors. Empty clusters are re-seeded from the points farthest from
+    their current centroid.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    k = min(k, len(vectors))
+    rng = np.random.default_rng(seed)
+
+    centroids = np.empty((k, vectors.shape[1]), dtype=np.float32)
+    centroids[0] = vectors[rng.integers(len(vectors))]
+    closest = squared_distances(vectors, centroids[:1]).ravel()
+    for i in range(1, k):
+        weights = np.clip(closest, 0, None)
+        total = weights.sum()
+        index = rng.choice(len(vectors), p=weights / total) if total > 0 else rng.integers(len(vectors))
+        centroids[i] = vectors[index]
+        closest = np.minimum(closest, squared_distances(vectors, centroids[i:i + 1]).ravel())
+
+    for _ in range(iterations):
+        distances = squared_distances(vectors, centroids)
+        labels = distances.argmin(axis=1)
+        counts = np.bincount(labels, minlength=k)
+        updated = np.zeros_like(centroids)
+        np.add.at(updated, labels, vectors)
+
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            farthest = distances[np.arange(len(vectors)), labels].argsort()[::-1][:len(empty)]
+            updated[empty] = vectors[farthest]
+            counts[empty] = 1
+
+        updated /= counts[:, None]
+        if np.allclose(updated, centroids, atol=1e-6):
+            centroids = updated
+            break
+        centroids = updated
+
+    return centroids.astype(np.float32)
@@ -0,0 +1,192 @@
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+from .vector_tables import NOTE_VECTOR_TABLE
+
+VECTORS_FILE = 'vectors.f32'
+IDS_FILE = 'ids.npy'
+USERS_FILE = 'users.npy'
+META_FILE = 'meta.json'
+LOCK_FILE = '.lock'
+FREE_ROW = -1
+READ_BATCH_SIZE = 2000
+
+
+def _path(directory, name):
+    return os.path.join(directory, name)
+
+
+def _replace(directory, name, write):
+    # Write to a temporary file first so readers never see a half-written file
+    temp_path = _path(directory, f"{name}.tmp")
+    write(temp_path)
+    os.replace(temp_path, _path(directory, name))
+
+
+def _save_array(directory, name, array):
+    def write(path):
+        with open(path, 'wb') as f:
+            np.save(f, array)
+    _replace(directory, name, write)
+
+
+@contextmanager
+def locked(directory, shared=False):
+    """
+    Hold an flock on the export directory.
+
+    Syncs hold it exclusively around their whole read-modify-write and
+    readers hold it shared while copying rows out, so concurrent syncs
+    cannot interleave and a reader never sees a half-updated vectors file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(_path(directory, LOCK_FILE), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_meta(directory):
+    try:
+        with open(_path(directory, META_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_meta(directory, meta):
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump(meta, f)
+    _replace(directory, META_FILE, write)
+
+
+def is_current(meta, dimensions, model_key):
+    return meta is not None and meta['dimensions'] == dimensions and meta['model'] == model_key
+
+
+def load(directory, mode='r'):
+    """
+    Open the export as (vectors, note_ids, user_ids).
+
+    vectors is a (capacity, dims) float32 memmap; rows whose note id is
+    FREE_ROW belong to deleted notes and are reused by later updates.
+    Callers hold locked(directory, shared=True) while reading from it.
+    """
+    meta = read_meta(directory)
+    note_ids = np.load(_path(directory, IDS_FILE))
+    user_ids = np.load(_path(directory, USERS_FILE))
+    vectors = np.memmap(
+        _path(directory, VECTORS_FILE), dtype=np.float32, mode=mode, shape=(len(note_ids), meta['dimensions'])
+    )
+    return vectors, note_ids, user_ids
+
+
+def user_rows(directory, user_id):
+    """A user's note ids and an in-memory copy of their vectors"""
+    with locked(directory, shared=True):
+        vectors, note_ids, user_ids = load(directory)
+        rows = np.flatnonzero((user_ids == user_id) & (note_ids != FREE_ROW))
+        return note_ids[rows], np.array(vectors[rows])
+
+
+def _read_vectors(cursor, dimensions):
+    while True:
+        rows = cursor.fetchmany(READ_BATCH_SIZE)
+        if not rows:
+            break
+        yield (
+            np.array([row[0] for row in rows], dtype=np.int64),
+            np.array([row[1] for row in rows], dtype=np.int64),
+            np.frombuffer(b''.join(row[2] for row in rows), dtype=np.float32).reshape(len(rows), dimensions),
+        )
+
+
+def rebuild(directory, db, dimensions, model_key, synced_at):
+    """Export every note vector from scratch, streaming the float32 blobs straight into the memmap"""
+    os.makedirs(directory, exist_ok=True)
+    count = db.execute(f"SELECT COUNT(*) FROM {NOTE_VECTOR_TABLE}").fetchone()[0]
+    # A memmap cannot be empty, so an export without vectors keeps one free row
+    note_ids = np.full(max(count, 1), FREE_ROW, dtype=np.int64)
+    user_ids = np.full(max(count, 1), FREE_ROW, dtype=np.int64)
+
+    def write_vectors(path):
+        vectors = np.memmap(path, dtype=np.float32, mode='w+', shape=(len(note_ids), dimensions))
+        position = 0
+        cursor = db.execute(f"SELECT rowid, user_id, embedding FROM {NOTE_VECTOR_TABLE} ORDER BY rowid")
+        for batch_ids, batch_users, batch_vectors in _read_vectors(cursor, dimensions):
+            end = min(position + len(batch_ids), count)
+            vectors[position:end] = batch_vectors[:end - position]
+            note_ids[position:end] = batch_ids[:end - position]
+            user_ids[position:end] = batch_users[:end - position]
+            position = end
+        vectors.flush()
+        del vectors
+
+    _replace(directory, VECTORS_FILE, write_vectors)
+    _save_array(directory, IDS_FILE, note_ids)
+    _save_array(directory, USERS_FILE, user_ids)
+    _write_meta(directory, {'dimensions': dimensions, 'model': model_key, 'synced_at': synced_at})
+    return {'rebuilt': True, 'rows': int((note_ids != FREE_ROW).sum()), 'updated': count, 'removed': 0}
+
+
+def update(directory, db, changed_note_ids, live_note_ids, synced_at):
+    """
+    Apply embeddings written since the last sync and free the rows of deleted notes.
+
+    Changed notes overwrite their row or take a free one; the vector file
+    is doubled in place when it runs out of rows. Callers hold
+    locked(directory) for the whole update.
+    """
+    meta = read_meta(directory)
+    dimensions = meta['dimensions']
+    note_ids = np.load(_path(directory, IDS_FILE))
+    user_ids = np.load(_path(directory, USERS_FILE))
+
+    removed = (note_ids != FREE_ROW) & ~np.isin(note_ids, np.fromiter(live_note_ids, dtype=np.int64))
+    note_ids[removed] = FREE_ROW
+    user_ids[removed] = FREE_ROW
+
+    changed = sorted(set(changed_note_ids))
+    cursor = db.execute(
+        f"SELECT rowid, user_id, embedding FROM {NOTE_VECTOR_TABLE} WHERE rowid IN (SELECT value FROM json_each(?))",
+        [json.dumps(changed)]
+    )
+    updates = list(_read_vectors(cursor, dimensions))
+
+    row_of = {note_id: row for row, note_id in enumerate(note_ids.tolist()) if note_id != FREE_ROW}
+    new_count = sum(1 for batch_ids, _, _ in updates for note_id in batch_ids.tolist() if note_id not in row_of)
+    free_rows = np.flatnonzero(note_ids == FREE_ROW).tolist()
+    if new_count > len(free_rows):
+        capacity = len(note_ids)
+        grown = max(capacity * 2, capacity + new_count - len(free_rows))
+        with open(_path(directory, VECTORS_FILE), 'r+b') as f:
+            f.truncate(grown * dimensions * 4)
+        free_rows.extend(range(capacity, grown))
+        note_ids = np.concatenate([note_ids, np.full(grown - capacity, FREE_ROW, dtype=np.int64)])
+        user_ids = np.concatenate([user_ids, np.full(grown - capacity, FREE_ROW, dtype=np.int64)])
+
+    vectors = np.memmap(_path(directory, VECTORS_FILE), dtype=np.float32, mode='r+', shape=(len(note_ids), dimensions))
+    free_rows.reverse()
+    updated = 0
+    for batch_ids, batch_users, batch_vectors in updates:
+        rows = np.array([
+            row_of[note_id] if note_id in row_of else free_rows.pop() for note_id in batch_ids.tolist()
+        ], dtype=np.int64)
+        vectors[rows] = batch_vectors
+        note_ids[rows] = batch_ids
+        user_ids[rows] = batch_users
+        updated += len(rows)
+    vectors.flush()
+    del vectors
+
+    _save_array(directory, IDS_FILE, note_ids)
+    _save_array(directory, USERS_FILE, user_ids)
+    _write_meta(directory, {**meta, 'synced_at': synced_at})
+    return {'rebuilt': False, 'rows': int((note_ids != FREE_ROW).sum()), 'updated': updated, 'removed': int(removed.sum())}
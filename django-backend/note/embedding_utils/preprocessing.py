@@ -0,0 +1,62 @@
+import re
+
+from ..text_utils import TOKEN_RE
+
+# Bump whenever preprocess() changes output; it is part of the embedding model version, so a bump re-embeds every note
+PREPROCESSING_VERSION = 1
+
+FENCED_CODE_RE = re.compile(r'^[ \t]*(```|~~~)[ \t]*([\w+#.-]*)[^\n]*\n.*?(?:^[ \t]*\1[ \t]*$|\Z)', re.DOTALL | re.MULTILINE)
+IMAGE_RE = re.compile(r'!\[([^\]]*)\]\([^)]*\)')
+LINK_RE = re.compile(r'\[([^\]]*)\]\([^)]*\)')
+FILE_LINK_RE = re.compile(r'/api/note/files/[^\s)"\']+')
+URL_RE = re.compile(r'\b(?:https?://|www\.)[^\s)>\]]+')
+INLINE_CODE_RE = re.compile(r'`([^`\n]+)`')
+LINE_MARKER_RE = re.compile(r'^[ \t]*(?:#{1,6}|>+|[-*+]\s+\[[ xX]\]|[-*+]|\d+[.)])[ \t]+', re.MULTILINE)
+EMPHASIS_RE = re.compile(r'(?<![\w*~])(\*\*|__|~~|\*|_)(?=\S)(.+?)(?<=\S)\1(?![\w*~])')
+HORIZONTAL_SPACE_RE = re.compile(r'[ \t\u00a0]+')
+BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+
+
+def _collapse_code(match):
+    language = match.group(2)
+    return f"[{language} code]" if language else "[code]"
+
+
+def preprocess(text, max_chars):
+    """
+    Reduce markdown to the words worth embedding.
+
+    Fenced code becomes a short placeholder, images and links keep only
+    their text, URLs and uploaded file links are dropped, markdown markup
+    is stripped and whitespace is normalized. The result is cut at a word
+    boundary to max_chars so it fits the model's context. Text that is
+    nothing but noise falls back to its whitespace-normalized original.
+    """
+    cleaned = FENCED_CODE_RE.sub(_collapse_code, text)
+    cleaned = IMAGE_RE.sub(r'\1', cleaned)
+    cleaned = LINK_RE.sub(r'\1', cleaned)
+    cleaned = FILE_LINK_RE.sub('', cleaned)
+    cleaned = URL_RE.sub('', cleaned)
+    cleaned = INLINE_CODE_RE.sub(r'\1', cleaned)
+    cleaned = LINE_MARKER_RE.sub('', cleaned)
+    cleaned = EMPHASIS_RE.sub(r'\2', cleaned)
+    cleaned = HORIZONTAL_SPACE_RE.sub(' ', cleaned)
+    cleaned = BLANK_LINES_RE.sub('\n\n', cleaned)
+    cleaned = '\n'.join(line.strip() for line in cleaned.split('\n')).strip()
+
+    if not cleaned:
+        cleaned = ' '.join(text.split())
+    if len(cleaned) > max_chars:
+        cut = cleaned.rfind(' ', 0, max_chars + 1)
+        cleaned = cleaned[:cut if cut > max_chars // 2 else max_chars]
+    return cleaned
+
+
+def token_change_ratio(old_text, new_text):
+    """Share of distinct lowercase word tokens present in only one of the texts: 0 for the same words, 1 for none shared"""
+    old_tokens = set(TOKEN_RE.findall(old_text.lower()))
+    new_tokens = set(TOKEN_RE.findall(new_text.lower()))
+    union = old_tokens | new_tokens
+    if not union:
+        return 0.0
+    return len(old_tokens ^ new_tokens) / len(union)
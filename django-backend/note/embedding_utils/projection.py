@@ -0,0 +1,37 @@
+import numpy as np
+
+MAP_DIMENSIONS = 2
+
+
+def pca_basis(vectors):
+    """
+    Mean and top-2 principal axes of a (n, dims) matrix.
+
+    Uses the dims x dims covariance rather than an SVD of the data, so the
+    cost is one matrix product no matter how many notes there are. Each
+    axis is flipped so its largest coefficient is positive, which keeps
+    the map from mirroring between rebuilds.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    mean = vectors.mean(axis=0)
+    centered = vectors - mean
+    covariance = centered.T @ centered / max(len(vectors) - 1, 1)
+    _, eigenvectors = np.linalg.eigh(covariance)
+    components = eigenvectors[:, ::-1][:, :MAP_DIMENSIONS].T
+    signs = np.sign(components[np.arange(MAP_DIMENSIONS), np.abs(components).argmax(axis=1)])
+    components *= np.where(signs == 0, 1, signs)[:, None]
+    return mean.astype(np.float32), components.astype(np.float32)
+
+
+def project(vectors, mean, components):
+    """Coordinates of vectors on a saved basis, shape (n, 2)"""
+    return (np.asarray(vectors, dtype=np.float32) - mean) @ components.T
+
+
+def to_bytes(array):
+    return np.asarray(array, dtype=np.float32).tobytes()
+
+
+def from_bytes(blob, shape=None):
+    array = np.frombuffer(bytes(blob), dtype=np.float32)
+    return array.reshape(shape) if shape else array
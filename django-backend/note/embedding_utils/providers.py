@@ -0,0 +1,165 @@
+import hashlib
+import os
+import re
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .http_client import get_ollama_client
+from .preprocessing import PREPROCESSING_VERSION
+
+ONNX_PREFIX = 'onnx:'
+HASHING_PREFIX = 'hashing:'
+
+
+class EmbeddingProvider:
+    """
+    Turns a batch of texts into one vector per text.
+
+    read_timeout bounds the wait on a remote model server; in-process
+    providers ignore it.
+    """
+
+    def embed(self, texts, read_timeout=None):
+        raise NotImplementedError
+
+
+class OllamaProvider(EmbeddingProvider):
+    """Embeddings from an Ollama server's multi-input /api/embed endpoint"""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def embed(self, texts, read_timeout=None):
+        return get_ollama_client().post_json('/api/embed', {
+            "model": self.model_name,
+            "input": list(texts)
+        }, read_timeout=read_timeout)['embeddings']
+
+
+class OnnxProvider(EmbeddingProvider):
+    """
+    A sentence-embedding model run in-process with onnxruntime on CPU.
+
+    model_dir holds model.onnx and the Hugging Face tokenizer.json. Texts
+    are tokenized and run through the model batch_size at a time, then
+    mean-pooled over the attention mask and L2-normalized.
+    """
+
+    def __init__(self, model_dir, threads=2, batch_size=32, max_length=256):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImproperlyConfigured(
+                "The onnx embedding provider needs the onnxruntime and tokenizers packages"
+            ) from e
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, 'model.onnx'), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+    def embed(self, texts, read_timeout=None):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self.tokenizer.encode_batch(list(texts[start:start + self.batch_size]))
+            input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+            if 'token_type_ids' in self.input_names:
+                feeds['token_type_ids'] = np.zeros_like(input_ids)
+
+            hidden = self.session.run(None, feeds)[0]
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            vectors.extend(pooled.tolist())
+        return vectors
+
+
+class HashingProvider(EmbeddingProvider):
+    """
+    Deterministic signed feature hashing of lowercase word tokens.
+
+    Needs no model or network, so tests and benchmarks get stable vectors
+    where texts sharing words land close together.
+    """
+    TOKEN_RE = re.compile(r'\w+')
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+
+    def embed(self, texts, read_timeout=None):
+        vectors = []
+        for text in texts:
+            vector = np.zeros(self.dimensions, dtype=np.float32)
+            for token in self.TOKEN_RE.findall(text.lower()):
+                digest = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+                vector[digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector /= norm
+            else:
+                vector[0] = 1.0
+            vectors.append(vector.tolist())
+        return vectors
+
+
+def configured_model_name():
+    """
+    Model identity for EMBEDDING_PROVIDER, as stored on EmbeddingIndex and used as the cache key.
+
+    Ollama models keep their plain name; other providers are prefixed so
+    get_provider can tell which one produced an index.
+    """
+    provider = settings.EMBEDDING_PROVIDER
+    if provider == 'ollama':
+        return settings.OLLAMA_MODEL
+    if provider == 'onnx':
+        return f"{ONNX_PREFIX}{settings.EMBEDDING_ONNX_MODEL}"
+    if provider == 'hashing':
+        return f"{HASHING_PREFIX}{settings.OLLAMA_EMBEDDING_SIZE}"
+    raise ImproperlyConfigured(f"Unknown EMBEDDING_PROVIDER '{provider}', expected ollama, onnx or hashing")
+
+
+def configured_model_version():
+    """EMBEDDING_MODEL_VERSION combined with the preprocessing version, so either change re-embeds every note"""
+    return f"{settings.EMBEDDING_MODEL_VERSION}+pre{PREPROCESSING_VERSION}"
+
+
+def _create_provider(model_name):
+    if model_name.startswith(ONNX_PREFIX):
+        return OnnxProvider(
+            os.path.join(settings.EMBEDDING_ONNX_MODEL_ROOT, model_name[len(ONNX_PREFIX):]),
+            threads=settings.EMBEDDING_ONNX_THREADS,
+            batch_size=settings.EMBEDDING_ONNX_BATCH_SIZE,
+            max_length=settings.EMBEDDING_ONNX_MAX_LENGTH,
+        )
+    if model_name.startswith(HASHING_PREFIX):
+        return HashingProvider(int(model_name[len(HASHING_PREFIX):]))
+    return OllamaProvider(model_name)
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(model_name):
+    """Return the provider for a model name, loading in-process models once per process"""
+    provider = _providers.get(model_name)
+    if provider is None:
+        with _providers_lock:
+            provider = _providers.get(model_name)
+            if provider is None:
+                provider = _providers[model_name] = _create_provider(model_name)
+    return provider
@@ -0,0 +1,56 @@
+import math
+from collections import Counter
+
+import numpy as np
+
+from .kmeans import kmeans, squared_distances
+from ..text_utils import TOKEN_RE
+
+MIN_TERM_LENGTH = 3
+
+
+def cluster_count(n_vectors, max_clusters):
+    """sqrt(n / 2) clusters, the usual rule of thumb, between 2 and max_clusters"""
+    return max(2, min(max_clusters, round(math.sqrt(n_vectors / 2))))
+
+
+def assign_clusters(vectors, k, seed=0):
+    """Run k-means over a (n, dims) matrix and return each row's cluster and L2 distance to its centroid"""
+    centroids = kmeans(vectors, k, seed=seed)
+    distances = squared_distances(vectors, centroids)
+    labels = distances.argmin(axis=1)
+    return labels, np.sqrt(np.clip(distances[np.arange(len(vectors)), labels], 0, None))
+
+
+def _terms(text):
+    return {
+        token for token in TOKEN_RE.findall(text.lower())
+        if len(token) >= MIN_TERM_LENGTH and not token.isdigit()
+    }
+
+
+def label_clusters(texts, labels, n_terms=3):
+    """
+    Name each cluster by its most distinctive words.
+
+    A word scores its share of the cluster's notes times its inverse
+    document frequency over all notes, so words common everywhere rank
+    low. Returns {cluster: "word, word, word"}.
+    """
+    note_terms = [_terms(text) for text in texts]
+    document_frequency = Counter(term for terms in note_terms for term in terms)
+    total = len(texts)
+
+    cluster_frequency = {}
+    cluster_sizes = Counter(labels)
+    for terms, label in zip(note_terms, labels):
+        cluster_frequency.setdefault(label, Counter()).update(terms)
+
+    names = {}
+    for label, counts in cluster_frequency.items():
+        scored = sorted(
+            counts,
+            key=lambda term: (-counts[term] / cluster_sizes[label] * math.log(total / document_frequency[term]), term)
+        )
+        names[label] = ', '.join(scored[:n_terms])
+    return names
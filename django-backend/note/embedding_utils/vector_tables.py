@@ -0,0 +1,191 @@
+import json
+
+NOTE_VECTOR_TABLE = 'note_embeddings_vec'
+CHUNK_VECTOR_TABLE = 'note_chunks_vec'
+
+REBUILD_BATCH_SIZE = 500
+
+# quantization mode -> (column name, vec0 column type, SQL that quantizes a float32 blob parameter)
+QUANTIZED_COLUMNS = {
+    'int8': ('embedding_int8', 'int8', "vec_quantize_int8(?, 'unit')"),
+    'binary': ('embedding_bit', 'bit', "vec_quantize_binary(vec_f32(?))"),
+}
+
+
+def vector_table_sql(table_name, dimensions, quantization='none'):
+    """
+    vec0 layout shared by note and chunk vectors.
+
+    user_id is a partition key so a KNN query only scans the caller's
+    vectors, and list_id/archived are metadata columns that sqlite-vec
+    filters on inside the scan. With quantization enabled, a compact copy
+    of each vector is stored next to the float one for the coarse scan:
+    vec0 keeps each vector column in its own chunks, so the scan reads only
+    the compact copy, but the table is larger than with float vectors alone.
+    """
+    quantized_column = ''
+    if quantization in QUANTIZED_COLUMNS:
+        column, column_type, _ = QUANTIZED_COLUMNS[quantization]
+        quantized_column = f"\n            {column} {column_type}[{dimensions}],"
+    return f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {table_name}
+        USING vec0(
+            user_id integer partition key,
+            embedding float[{dimensions}],{quantized_column}
+            list_id integer,
+            archived boolean
+        );
+    """
+
+
+def expected_columns(quantization='none'):
+    columns = {'rowid', 'user_id', 'embedding', 'list_id', 'archived'}
+    if quantization in QUANTIZED_COLUMNS:
+        columns.add(QUANTIZED_COLUMNS[quantization][0])
+    return columns
+
+
+def table_columns(db, table_name):
+    return [row[1] for row in db.execute(f"PRAGMA table_info({table_name})")]
+
+
+def insert_vectors(db, table_name, rows, quantization='none'):
+    """Insert (rowid, user_id, list_id, archived, float32 blob) rows, filling the quantized column if enabled"""
+    columns = "rowid, user_id, list_id, archived, embedding"
+    values = "?, ?, ?, ?, ?"
+    quantize = quantization in QUANTIZED_COLUMNS
+    if quantize:
+        column, _, expression = QUANTIZED_COLUMNS[quantization]
+        columns += f", {column}"
+        values += f", {expression}"
+    db.executemany(
+        f"INSERT INTO {table_name}({columns}) VALUES ({values})",
+        [[*row, row[4]] if quantize else row for row in rows]
+    )
+
+
+def ensure_vector_table(db, table_name, dimensions, metadata_for_rowids, quantization='none'):
+    """
+    Create the vector table, rebuilding it in place if its layout is out of date.
+
+    vec0 tables cannot be altered or renamed, so old rows are copied to a
+    plain backup table, the vec0 table is recreated and the rows are
+    reinserted with the metadata returned by metadata_for_rowids(rowids),
+    a {rowid: (user_id, list_id, archived)} mapping. Rows without
+    metadata belong to deleted notes and are dropped.
+    """
+    columns = table_columns(db, table_name)
+    if columns and set(columns) != expected_columns(quantization):
+        rebuild_vector_table(db, table_name, dimensions, metadata_for_rowids, quantization)
+    else:
+        db.execute(vector_table_sql(table_name, dimensions, quantization))
+
+
+def rebuild_vector_table(db, table_name, dimensions, metadata_for_rowids, quantization='none'):
+    """
+    Recreate a vec0 table from its own rows through a plain backup table.
+
+    Also compacts it: vec0 only marks deleted rows invalid in their chunk,
+    so a table with many deletes keeps scanning their slots until rebuilt.
+    """
+    backup_table = f"{table_name}_backup"
+    db.execute(f"DROP TABLE IF EXISTS {backup_table}")
+    db.execute(f"CREATE TABLE {backup_table} (id INTEGER PRIMARY KEY, embedding BLOB)")
+    db.execute(f"INSERT INTO {backup_table}(id, embedding) SELECT rowid, embedding FROM {table_name}")
+    db.execute(f"DROP TABLE {table_name}")
+    db.execute(vector_table_sql(table_name, dimensions, quantization))
+    copy_vectors(db, backup_table, table_name, metadata_for_rowids, quantization)
+    db.execute(f"DROP TABLE {backup_table}")
+
+
+def delete_vectors(db, table_name, rowids):
+    """Delete many rows with a single statement instead of one per rowid"""
+    db.execute(f"DELETE FROM {table_name} WHERE rowid IN (SELECT value FROM json_each(?))", [json.dumps(list(rowids))])
+
+
+def shadow_table_name(table_name):
+    """vec0 table a new embedding model's vectors are built in before they replace table_name"""
+    return f"{table_name}_shadow"
+
+
+def copy_vectors(db, source_table, target_table, metadata_for_rowids, quantization='none'):
+    """Copy (rowid, embedding) rows between tables, taking partition/filter columns from metadata_for_rowids"""
+    cursor = db.execute(f"SELECT rowid, embedding FROM {source_table}")
+    while True:
+        rows = cursor.fetchmany(REBUILD_BATCH_SIZE)
+        if not rows:
+            break
+        metadata = metadata_for_rowids([row[0] for row in rows])
+        insert_vectors(
+            db, target_table,
+            [[rowid, *metadata[rowid], embedding] for rowid, embedding in rows if rowid in metadata],
+            quantization
+        )
+
+
+def filter_clause(user_id, list_ids=None, archived=None, rowids=None):
+    """
+    Build the partition/metadata constraints for a KNN query.
+
+    Id lists are bound as one JSON array each, so a long list neither
+    hits SQLITE_MAX_VARIABLE_NUMBER nor makes every query text unique.
+    """
+    clause = " AND user_id = ?"
+    params = [user_id]
+    if rowids is not None:
+        clause += " AND rowid IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(list(rowids)))
+    if list_ids is not None:
+        clause += " AND list_id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(list(list_ids)))
+    if archived is not None:
+        clause += " AND archived = ?"
+        params.append(archived)
+    return clause, params
+
+
+def knn(db, table_name, embedding_blob, k, clause='', params=(), quantization='none', rerank_factor=4):
+    """
+    Return up to k (rowid, distance) pairs nearest to a float32 query blob.
+
+    Without quantization this is sqlite-vec's exact scan. With it, the scan
+    runs over the quantized column for k * rerank_factor candidates, which
+    are then re-ranked by exact L2 distance on the float vectors.
+    """
+    if quantization not in QUANTIZED_COLUMNS:
+        return db.execute(
+            f"""
+            SELECT rowid, distance
+            FROM {table_name}
+            WHERE embedding MATCH ?
+                AND k = ?
+                {clause}
+            """,
+            [embedding_blob, k, *params]
+        ).fetchall()
+
+    column, _, expression = QUANTIZED_COLUMNS[quantization]
+    candidates = db.execute(
+        f"""
+        SELECT rowid
+        FROM {table_name}
+        WHERE {column} MATCH {expression}
+            AND k = ?
+            {clause}
+        """,
+        [embedding_blob, k * rerank_factor, *params]
+    ).fetchall()
+    if not candidates:
+        return []
+
+    # Driving the join from json_each makes each candidate a rowid lookup; rowid IN (...) scans the table
+    return db.execute(
+        f"""
+        SELECT vectors.rowid, vec_distance_l2(vectors.embedding, ?) AS distance
+        FROM json_each(?) AS candidates
+            CROSS JOIN {table_name} AS vectors ON vectors.rowid = candidates.value
+        ORDER BY distance
+        LIMIT ?
+        """,
+        [embedding_blob, json.dumps([row[0] for row in candidates]), k]
+    ).fetchall()
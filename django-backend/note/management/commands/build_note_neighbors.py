@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from note.models import NoteEmbedding, NoteNeighbor
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized similar-notes table for every embedded note'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Number of notes recomputed per transaction (default: 200)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        note_ids = list(NoteEmbedding.objects.order_by('note_id').values_list('note_id', flat=True))
+        self.stdout.write(f"Rebuilding neighbours for {len(note_ids)} notes...")
+
+        for start in range(0, len(note_ids), batch_size):
+            NoteNeighbor.recompute(note_ids[start:start + batch_size])
+            self.stdout.write(f"  {min(start + batch_size, len(note_ids))}/{len(note_ids)}")
+
+        self.stdout.write(self.style.SUCCESS("Neighbour table rebuilt"))
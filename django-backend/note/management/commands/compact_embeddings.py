@@ -0,0 +1,86 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from note.embedding_utils import ivf
+from note.embedding_utils.connection import get_embedding_db
+from note.embedding_utils.vector_tables import (
+    CHUNK_VECTOR_TABLE,
+    NOTE_VECTOR_TABLE,
+    delete_vectors,
+    rebuild_vector_table,
+)
+from note.models import EmbeddingIndex, LocalMessage, NoteChunk, NoteEmbedding, NoteNeighbor
+from note.tasks import refresh_note_neighbors
+
+PURGE_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Purge vectors, chunks and neighbour entries left behind by deleted notes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be purged'
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Also rebuild the vector tables and VACUUM the embeddings database to reclaim deleted slots'
+        )
+
+    def handle(self, *args, **options):
+        live_ids = set(LocalMessage.objects.values_list('id', flat=True))
+        reader = get_embedding_db().reader()
+
+        referenced = set(NoteEmbedding.objects.values_list('note_id', flat=True))
+        referenced.update(NoteChunk.objects.values_list('note_id', flat=True))
+        referenced.update(NoteNeighbor.objects.values_list('note_id', flat=True))
+        referenced.update(NoteNeighbor.objects.values_list('neighbor_id', flat=True))
+        referenced.update(row[0] for row in reader.execute(f"SELECT rowid FROM {NOTE_VECTOR_TABLE}"))
+        referenced.update(row[0] for row in reader.execute(f"SELECT rowid FROM {ivf.LIST_TABLE}"))
+        orphan_ids = sorted(referenced - live_ids)
+
+        chunk_ids = set(NoteChunk.objects.values_list('id', flat=True))
+        orphan_chunk_vectors = [
+            row[0] for row in reader.execute(f"SELECT rowid FROM {CHUNK_VECTOR_TABLE}") if row[0] not in chunk_ids
+        ]
+
+        self.stdout.write(f"Live notes: {len(live_ids)}")
+        self.stdout.write(f"Deleted notes with leftover embedding data: {len(orphan_ids)}")
+        self.stdout.write(f"Chunk vectors without a chunk: {len(orphan_chunk_vectors)}")
+        if options['dry_run']:
+            return
+
+        holder_ids = set()
+        for start in range(0, len(orphan_ids), PURGE_BATCH_SIZE):
+            holder_ids |= NoteEmbedding.delete_for_notes(orphan_ids[start:start + PURGE_BATCH_SIZE])
+        with get_embedding_db().writer() as db:
+            delete_vectors(db, CHUNK_VECTOR_TABLE, orphan_chunk_vectors)
+        holder_ids -= set(orphan_ids)
+        if holder_ids:
+            refresh_note_neighbors.delay(sorted(holder_ids))
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {len(orphan_ids)} deleted notes and {len(orphan_chunk_vectors)} chunk vectors"
+        ))
+
+        if options['rebuild']:
+            self.rebuild()
+
+    def rebuild(self):
+        manager = get_embedding_db()
+        dimensions = EmbeddingIndex.active().dimensions
+        start = time.monotonic()
+        with manager.writer() as db:
+            rebuild_vector_table(
+                db, NOTE_VECTOR_TABLE, dimensions, LocalMessage.vector_metadata, settings.EMBEDDING_QUANTIZATION
+            )
+            rebuild_vector_table(
+                db, CHUNK_VECTOR_TABLE, dimensions, NoteChunk.vector_metadata, settings.EMBEDDING_QUANTIZATION
+            )
+        with manager.writer() as db:
+            db.execute("VACUUM")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt vector tables and vacuumed in {time.monotonic() - start:.1f}s"))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from note.models import NoteEmbedding
+from note.tasks import enqueue_note_embedding
+
+
+class Command(BaseCommand):
+    help = 'Report embedding coverage and staleness, optionally re-queueing missing and stale notes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user-id',
+            type=int,
+            help='Only check notes of this user',
+        )
+        parser.add_argument(
+            '--requeue',
+            action='store_true',
+            help='Queue an embedding job for every missing and stale note',
+        )
+        parser.add_argument(
+            '--show-ids',
+            action='store_true',
+            help='List the ids of missing, stale and outdated notes',
+        )
+
+    def handle(self, *args, **options):
+        report = NoteEmbedding.freshness(user_id=options['user_id'])
+        summary = NoteEmbedding.freshness_summary(report)
+
+        self.stdout.write(f"Notes: {summary['notes']} (plus {summary['skipped_rtl']} RTL notes that are not embedded)")
+        self.stdout.write(f"Embedded: {summary['embedded']} ({summary['coverage_pct']}% coverage)")
+        self.stdout.write(f"Missing: {summary['missing']}")
+        self.stdout.write(f"Stale: {summary['stale']} text changed, {summary['outdated']} older model ({summary['stale_pct']}%)")
+        if options['user_id'] is None:
+            self.stdout.write(f"Orphaned embeddings: {summary['orphaned']}")
+
+        if options['show_ids']:
+            for key in ('missing', 'stale', 'outdated'):
+                if report[key]:
+                    self.stdout.write(f"  {key}: {', '.join(map(str, report[key]))}")
+
+        if options['requeue']:
+            note_ids = report['missing'] + report['stale']
+            for note_id in note_ids:
+                enqueue_note_embedding(note_id, force=True)
+            self.stdout.write(self.style.SUCCESS(f"Queued {len(note_ids)} embedding jobs"))
+        elif summary['missing'] or summary['stale']:
+            self.stdout.write(self.style.WARNING("Run with --requeue to re-embed missing and stale notes"))
+        else:
+            self.stdout.write(self.style.SUCCESS("All embeddings are current"))
@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from note.models import LocalMessage, NoteEmbedding, NoteTopic
+
+
+class Command(BaseCommand):
+    help = 'Export note vectors to the memory-mapped matrix in EMBEDDING_MATRIX_DIR and optionally re-cluster topics'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Re-export every vector instead of only those written since the last sync'
+        )
+        parser.add_argument(
+            '--cluster',
+            action='store_true',
+            help='Re-cluster notes into suggested topics after exporting'
+        )
+        parser.add_argument(
+            '--user-id',
+            type=int,
+            help='Only re-cluster this user'
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        sync = NoteEmbedding.sync_matrix(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Exported' if sync['rebuilt'] else 'Updated'} {sync['updated']} vectors, freed {sync['removed']} rows; "
+            f"{sync['rows']} notes in {settings.EMBEDDING_MATRIX_DIR} ({time.monotonic() - start:.2f}s)"
+        ))
+        if not options['cluster']:
+            return
+
+        if options['user_id']:
+            user_ids = [options['user_id']]
+        else:
+            user_ids = LocalMessage.objects.order_by('user_id').values_list('user_id', flat=True).distinct()
+        for user_id in user_ids:
+            start = time.monotonic()
+            count = NoteTopic.cluster_user(user_id)
+            self.stdout.write(f"User {user_id}: {count} topics ({time.monotonic() - start:.2f}s)")
+            for topic in NoteTopic.objects.filter(user_id=user_id):
+                self.stdout.write(f"  [{topic.size}] {topic.label}")
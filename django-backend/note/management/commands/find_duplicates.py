@@ -0,0 +1,50 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from note.models import LocalMessage, NoteSignature
+
+INDEX_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Index MinHash signatures for near-duplicate detection and list duplicate clusters per user'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user-id',
+            type=int,
+            help='Only index and report notes of this user',
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Recompute every signature, e.g. after changing DUPLICATE_MINHASH_PERMUTATIONS or DUPLICATE_LSH_BANDS',
+        )
+
+    def handle(self, *args, **options):
+        notes = LocalMessage.objects.all()
+        if options['user_id']:
+            notes = notes.filter(user_id=options['user_id'])
+        if not options['rebuild']:
+            notes = notes.filter(signature__isnull=True)
+
+        note_ids = list(notes.order_by('id').values_list('id', flat=True))
+        start = time.monotonic()
+        for batch_start in range(0, len(note_ids), INDEX_BATCH_SIZE):
+            batch = LocalMessage.objects.filter(id__in=note_ids[batch_start:batch_start + INDEX_BATCH_SIZE])
+            NoteSignature.index_notes(list(batch.only('id', 'user_id', 'text')))
+        self.stdout.write(f"Indexed {len(note_ids)} notes in {time.monotonic() - start:.1f}s")
+
+        users = User.objects.filter(id=options['user_id']) if options['user_id'] else User.objects.all()
+        for user in users:
+            start = time.monotonic()
+            clusters = NoteSignature.duplicate_clusters(user.id)
+            if not clusters:
+                continue
+            self.stdout.write(self.style.WARNING(
+                f"{user.username}: {len(clusters)} duplicate clusters ({time.monotonic() - start:.2f}s)"
+            ))
+            for cluster in clusters:
+                self.stdout.write(f"  {', '.join(map(str, cluster))}")
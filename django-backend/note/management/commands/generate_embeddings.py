@@ -1,8 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from note.models import LocalMessage, NoteEmbedding
+from note.models import EmbeddingIndex, LocalMessage, NoteChunk, NoteEmbedding
 import traceback
-import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
@@ -24,7 +23,7 @@ class Command(BaseCommand):
             '--batch-size',
             type=int,
             default=50,
-            help='Number of notes to process in each transaction batch',
+            help='Number of notes sent to the embedding service in each request',
         )
         parser.add_argument(
             '--max-workers',
@@ -32,6 +31,11 @@ class Command(BaseCommand):
             default=5,
             help='Max worker threads for parallel processing of batches',
         )
+        parser.add_argument(
+            '--chunks-only',
+            action='store_true',
+            help='Only split and embed the chunks of embedded notes that have none yet; with --force, re-split every embedded note',
+        )
         
     def handle(self, *args, **kwargs):
         # Process args
@@ -43,6 +47,10 @@ class Command(BaseCommand):
         # Setup vector tables
         self.stdout.write("Setting up note embedding vector table...")
         NoteEmbedding.setup_vector_table()
+
+        if kwargs.get('chunks_only'):
+            self._backfill_chunks(force, batch_size)
+            return
         
         # Initialize aggregate counters
         total_processed_embeddings = 0
@@ -122,6 +130,37 @@ class Command(BaseCommand):
             f"- Failed: {total_failed_embeddings}"
         ))
 
+    def _backfill_chunks(self, force, batch_size):
+        """Split and embed the chunks of notes embedded before chunk search existed"""
+        note_ids = set(NoteEmbedding.objects.values_list('note_id', flat=True))
+        if not force:
+            note_ids -= set(NoteChunk.objects.values_list('note_id', flat=True))
+        note_ids = sorted(note_ids)
+        self.stdout.write(f"Found {len(note_ids)} embedded notes to chunk")
+
+        index = EmbeddingIndex.active()
+        chunked_notes = 0
+        failed_notes = 0
+        for start in range(0, len(note_ids), batch_size):
+            batch_ids = note_ids[start:start + batch_size]
+            notes = list(LocalMessage.objects.filter(id__in=batch_ids))
+            try:
+                # Unchanged chunk texts keep their vectors, so only new chunks are sent to the embedding service
+                NoteChunk.sync_for_notes(notes, index)
+                chunked_notes += len(notes)
+            except Exception as e:
+                failed_notes += len(notes)
+                self.stdout.write(self.style.ERROR(
+                    f"  Failed to chunk notes {batch_ids[0]} to {batch_ids[-1]}: {str(e)}\n"
+                    f"    Traceback: {traceback.format_exc()}"
+                ))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\nNote Chunks:\n"
+            f"- Chunked notes: {chunked_notes}\n"
+            f"- Failed: {failed_notes}"
+        ))
+
     def _process_single_note_logic(self, note, force,
                                    has_embedding, note_has_rtl,
                                    current_index_display, total_display): # For logging
@@ -168,26 +207,6 @@ class Command(BaseCommand):
                 f"  {log_prefix} Failed to process embedding: {str(e)}\n"
                 f"    Traceback: {traceback.format_exc()}"
             ))
-                        self.stdout.write(f"  {log_prefix} Created embeddings for all {len(chunk_instances)} chunks")
-                    elif len(chunk_instances) == 1:
-                        # If there's only one chunk, it might not need its own embedding if it's same as note.
-                        # Original code skipped embedding for single chunk notes.
-                        # We still save the chunk itself if split_into_chunks does so.
-                        # Let's assume split_into_chunks saves the chunk text, and create_embedding adds vector.
-                        # This matches original logic.
-                        if chunk_instances[0].pk is None : # If split_into_chunks returns unsaved objects
-                             chunk_instances[0].save()
-                        self.stdout.write(f"  {log_prefix} Skipping chunk embeddings (single chunk note)")
-                    else: # No chunks generated
-                        self.stdout.write(f"  {log_prefix} No chunks generated")
-
-                    single_note_counters['processed_chunks'] += 1 # Count if chunking process was run
-            except Exception as e:
-                single_note_counters['failed_chunks'] += 1
-                self.stdout.write(self.style.ERROR(
-                    f"  {log_prefix} Failed to process chunks for note: {str(e)}\n"
-                    f"    Traceback: {traceback.format_exc()}"
-                ))
         
         return single_note_counters
 
@@ -203,38 +222,34 @@ class Command(BaseCommand):
         
         self.stdout.write(f"Processing batch {batch_num}/{total_batches} (Notes {overall_start_index + 1} to {overall_start_index + len(batch_ids)} of {total_notes_count})")
         
-        # Load the batch of notes
-        batch_notes = LocalMessage.objects.filter(id__in=batch_ids).order_by('id') # Order for consistent logging if desired
-        
-        with transaction.atomic():
-            # Pre-fetch existing embeddings for this batch to reduce queries inside loop
-            existing_embedding_ids_batch = set(NoteEmbedding.objects.filter(
-                note_id__in=batch_ids
-            ).values_list('note_id', flat=True))
-            
-            # Pre-calculate RTL status for notes in the batch
-            # This avoids calling NoteEmbedding.hasRTL repeatedly for the same text
-            note_rtl_status_map = {note.id: NoteEmbedding.hasRTL(note.text) for note in batch_notes}
-            
-            for i, note in enumerate(batch_notes):
-                current_overall_index = overall_start_index + i + 1 # 1-indexed for display
-
-                has_embedding_for_note = note.id in existing_embedding_ids_batch
-                current_note_has_rtl = note_rtl_status_map[note.id]
-                
-                note_counters = self._process_single_note_logic(
-                    note, 
-                    force,
-                    has_embedding_for_note,
-                    current_note_has_rtl,
-                    current_overall_index, # Pass overall index for logging
-                    total_notes_count      # Pass total notes for logging
-                )
-                
-                # Aggregate counters from this note
-                for key in batch_counters:
-                    batch_counters[key] += note_counters.get(key, 0)
-        
-        # Optional: short delay after a batch if needed, though ThreadPoolExecutor manages concurrency
-        # time.sleep(0.1) 
-        return batch_counters
\ No newline at end of file
+        batch_notes = list(LocalMessage.objects.filter(id__in=batch_ids).order_by('id'))
+
+        existing_embedding_ids_batch = set(NoteEmbedding.objects.filter(
+            note_id__in=batch_ids
+        ).values_list('note_id', flat=True))
+
+        notes_to_embed = []
+        for note in batch_notes:
+            if NoteEmbedding.hasRTL(note.text):
+                batch_counters['skipped_rtl'] += 1
+            elif note.id in existing_embedding_ids_batch and not force:
+                batch_counters['skipped_existing_embeddings'] += 1
+            else:
+                notes_to_embed.append(note)
+
+        if not notes_to_embed:
+            return batch_counters
+
+        # One request to the embedding service for the whole batch
+        try:
+            embedded_ids = NoteEmbedding.create_for_notes(notes_to_embed)
+            batch_counters['processed_embeddings'] += len(embedded_ids)
+            self.stdout.write(f"  Batch {batch_num}: created {len(embedded_ids)} embeddings")
+        except Exception as e:
+            batch_counters['failed_embeddings'] += len(notes_to_embed)
+            self.stdout.write(self.style.ERROR(
+                f"  Batch {batch_num}: failed to embed {len(notes_to_embed)} notes: {str(e)}\n"
+                f"    Traceback: {traceback.format_exc()}"
+            ))
+
+        return batch_counters
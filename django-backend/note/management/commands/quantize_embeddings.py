@@ -0,0 +1,88 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from note.embedding_utils.connection import get_embedding_db
+from note.embedding_utils.vector_tables import NOTE_VECTOR_TABLE, QUANTIZED_COLUMNS
+from note.models import EmbeddingIndex, NoteEmbedding
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the vector tables for EMBEDDING_QUANTIZATION and optionally benchmark recall against exact search'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--benchmark',
+            action='store_true',
+            help='Compare quantized search with exact search on sampled notes'
+        )
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=100,
+            help='Number of notes to use as benchmark queries (default: 100)'
+        )
+        parser.add_argument(
+            '--k',
+            type=int,
+            default=10,
+            help='Number of neighbours to compare per query (default: 10)'
+        )
+
+    def handle(self, *args, **options):
+        quantization = settings.EMBEDDING_QUANTIZATION
+        if quantization != 'none' and quantization not in QUANTIZED_COLUMNS:
+            self.stdout.write(self.style.ERROR(
+                f"Unknown EMBEDDING_QUANTIZATION '{quantization}', expected none, {' or '.join(QUANTIZED_COLUMNS)}"
+            ))
+            return
+
+        self.stdout.write(f"Converting vector tables to '{quantization}' layout...")
+        start = time.monotonic()
+        NoteEmbedding.setup_vector_table()
+        self.stdout.write(self.style.SUCCESS(f"Vector tables converted in {time.monotonic() - start:.1f}s"))
+
+        dims = EmbeddingIndex.active().dimensions
+        scan_bytes = {'none': dims * 4, 'int8': dims, 'binary': dims // 8}[quantization]
+        self.stdout.write(f"Bytes scanned per vector: {scan_bytes} (float32: {dims * 4})")
+
+        if options['benchmark']:
+            if quantization == 'none':
+                self.stdout.write(self.style.WARNING("Quantization is disabled, nothing to benchmark"))
+                return
+            self.benchmark(options['samples'], options['k'])
+
+    def benchmark(self, samples, k):
+        db = get_embedding_db().reader()
+        rows = db.execute(f"SELECT rowid, user_id, embedding FROM {NOTE_VECTOR_TABLE}").fetchall()
+        if not rows:
+            self.stdout.write(self.style.WARNING("No embeddings to benchmark"))
+            return
+
+        queries = random.sample(rows, min(samples, len(rows)))
+        recall_total = 0.0
+        exact_time = quantized_time = 0.0
+        for note_id, user_id, embedding in queries:
+            start = time.monotonic()
+            exact = NoteEmbedding._knn(embedding, k, user_id, None, None, {note_id}, exact=True)
+            exact_time += time.monotonic() - start
+
+            start = time.monotonic()
+            approx = NoteEmbedding._knn(embedding, k, user_id, None, None, {note_id})
+            quantized_time += time.monotonic() - start
+
+            expected = {result['note_id'] for result in exact}
+            if expected:
+                recall_total += len(expected & {result['note_id'] for result in approx}) / len(expected)
+            else:
+                recall_total += 1.0
+
+        count = len(queries)
+        self.stdout.write(f"Queries: {count}, k={k}, rerank factor={settings.EMBEDDING_RERANK_FACTOR}")
+        self.stdout.write(f"Recall@{k}: {recall_total / count:.3f}")
+        self.stdout.write(
+            f"Mean latency: exact {exact_time / count * 1000:.2f}ms, "
+            f"quantized {quantized_time / count * 1000:.2f}ms"
+        )
@@ -0,0 +1,76 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+
+from note.search_utils.backends import FTS_TABLE, fts5_available, postgres_search_available
+
+POSTGRES_INDEXES = ['note_localmessage_search_vector_gin', 'note_localmessage_text_trgm']
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the note search index: FTS5 on SQLite, the tsvector and trigram GIN indexes on PostgreSQL'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only run the FTS5 integrity check against the note table'
+        )
+
+    def handle(self, *args, **options):
+        connection = connections['default']
+        if connection.vendor == 'postgresql' and postgres_search_available(connection):
+            self.rebuild_postgres(connection, options)
+            return
+        if connection.vendor != 'sqlite' or not fts5_available(connection):
+            self.stdout.write(self.style.WARNING("No search index on the default database; run migrate first"))
+            return
+
+        start = time.monotonic()
+        with connection.cursor() as cursor:
+            if options['check']:
+                try:
+                    cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('integrity-check', 1)")
+                except DatabaseError as e:
+                    self.stdout.write(self.style.ERROR(f"Search index is out of sync, run without --check: {e}"))
+                    return
+                self.stdout.write(self.style.SUCCESS("Search index matches the notes"))
+                return
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+            cursor.execute("SELECT COUNT(*) FROM note_localmessage")
+            count = cursor.fetchone()[0]
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt search index over {count} notes in {time.monotonic() - start:.1f}s"))
+
+    def rebuild_postgres(self, connection, options):
+        stale_sql = (
+            "FROM note_localmessage "
+            "WHERE search_vector IS DISTINCT FROM to_tsvector('simple', coalesce(text, ''))"
+        )
+        start = time.monotonic()
+        with connection.cursor() as cursor:
+            if options['check']:
+                cursor.execute(f"SELECT COUNT(*) {stale_sql}")
+                stale = cursor.fetchone()[0]
+                if stale:
+                    self.stdout.write(self.style.ERROR(
+                        f"search_vector is out of date on {stale} notes, run without --check"
+                    ))
+                else:
+                    self.stdout.write(self.style.SUCCESS("Search index matches the notes"))
+                return
+
+            # The trigger from migration 0039 keeps the column current; this repairs rows written around it
+            cursor.execute(
+                f"UPDATE note_localmessage SET search_vector = to_tsvector('simple', coalesce(text, '')) "
+                f"WHERE id IN (SELECT id {stale_sql})"
+            )
+            repaired = cursor.rowcount
+            for index in POSTGRES_INDEXES:
+                cursor.execute(f"REINDEX INDEX CONCURRENTLY {index}")
+            cursor.execute("ANALYZE note_localmessage")
+        self.stdout.write(self.style.SUCCESS(
+            f"Repaired {repaired} search vectors and reindexed {', '.join(POSTGRES_INDEXES)} "
+            f"in {time.monotonic() - start:.1f}s"
+        ))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from note.models import SearchTerm
+
+
+class Command(BaseCommand):
+    help = 'Recount the per-user search autocomplete vocabulary from the notes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user-id',
+            type=int,
+            help='Only recount the vocabulary of this user',
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        stored = SearchTerm.rebuild(user_id=options['user_id'])
+        self.stdout.write(self.style.SUCCESS(f"Stored {stored} search terms in {time.monotonic() - start:.1f}s"))
@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from note.embedding_utils.connection import get_embedding_db
+from note.models import EmbeddingIndex
+from note.tasks import rebuild_note_neighbors, train_ivf_index
+
+
+class Command(BaseCommand):
+    help = 'Show the live and building embedding indexes, or build and swap in the configured model in-process'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--run',
+            action='store_true',
+            help='Build the shadow index in this process instead of waiting for the Celery beat job'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.EMBEDDING_REINDEX_BATCH_SIZE,
+            help='Notes and chunks embedded per batch'
+        )
+        parser.add_argument(
+            '--throttle',
+            type=float,
+            default=0,
+            help='Seconds to sleep between batches (default: 0)'
+        )
+
+    def handle(self, *args, **options):
+        active = EmbeddingIndex.active()
+        self.stdout.write(f"Live index: {active} ({active.dimensions} dims)")
+
+        index = EmbeddingIndex.start_build() if options['run'] else EmbeddingIndex.building()
+        if index is None:
+            if active.matches_settings():
+                self.stdout.write(self.style.SUCCESS("Live index matches the configured model"))
+            else:
+                self.stdout.write(self.style.WARNING("Configured model differs from the live index; no re-index started yet"))
+            return
+
+        notes, chunks = index.missing_counts(get_embedding_db().reader())
+        self.stdout.write(f"Building index: {index} ({index.dimensions} dims), {notes} notes and {chunks} chunks left")
+        if not options['run']:
+            return
+
+        while True:
+            remaining = index.build_batch(options['batch_size'])
+            self.stdout.write(f"  {remaining} left")
+            if remaining == 0 and index.swap():
+                break
+            time.sleep(options['throttle'])
+
+        self.stdout.write(self.style.SUCCESS(f"Swapped in {index}"))
+        rebuild_note_neighbors()
+        train_ivf_index()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from note.models import NoteEmbedding
+
+
+class Command(BaseCommand):
+    help = 'Create the sqlite-vec tables in the embeddings database, upgrading older layouts in place'
+
+    def handle(self, *args, **options):
+        self.stdout.write("Setting up vector tables...")
+        NoteEmbedding.setup_vector_table()
+        self.stdout.write(self.style.SUCCESS("Vector tables are up to date"))
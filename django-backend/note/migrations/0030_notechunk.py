@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0029_embeddingcacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('note_id', models.IntegerField(db_index=True)),
+                ('chunk_index', models.IntegerField()),
+                ('start_offset', models.IntegerField()),
+                ('end_offset', models.IntegerField()),
+                ('text_hash', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'note_chunks',
+                'ordering': ['note_id', 'chunk_index'],
+            },
+        ),
+    ]
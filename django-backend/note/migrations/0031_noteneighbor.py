@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0030_notechunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('note_id', models.IntegerField()),
+                ('neighbor_id', models.IntegerField(db_index=True)),
+                ('distance', models.FloatField()),
+                ('rank', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'note_neighbors',
+                'ordering': ['note_id', 'rank'],
+                'indexes': [models.Index(fields=['note_id', 'rank'], name='note_neighb_note_id_68cd5b_idx')],
+                'unique_together': {('note_id', 'neighbor_id')},
+            },
+        ),
+    ]
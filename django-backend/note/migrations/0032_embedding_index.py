@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0031_noteneighbor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmbeddingIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=255)),
+                ('model_version', models.CharField(max_length=50)),
+                ('dimensions', models.IntegerField()),
+                ('status', models.CharField(choices=[('building', 'Building'), ('active', 'Active'), ('retired', 'Retired')], db_index=True, max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('activated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'embedding_index',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='noteembedding',
+            name='model_name',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='noteembedding',
+            name='model_version',
+            field=models.CharField(default='', max_length=50),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0032_embedding_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='noteembedding',
+            name='embedded_text',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0033_noteembedding_embedded_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='noteembedding',
+            name='text_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
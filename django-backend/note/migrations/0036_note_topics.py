@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0035_note_signatures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteTopic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(db_index=True)),
+                ('label', models.CharField(max_length=255)),
+                ('size', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'note_topics',
+                'ordering': ['user_id', '-size'],
+            },
+        ),
+        migrations.CreateModel(
+            name='NoteTopicMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('note_id', models.IntegerField(db_index=True)),
+                ('distance', models.FloatField()),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='note.notetopic')),
+            ],
+            options={
+                'db_table': 'note_topic_members',
+                'ordering': ['topic', 'distance'],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0036_note_topics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteMapBasis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(unique=True)),
+                ('mean', models.BinaryField()),
+                ('components', models.BinaryField()),
+                ('note_count', models.IntegerField()),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'note_map_bases',
+            },
+        ),
+        migrations.CreateModel(
+            name='NoteMapPoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('note_id', models.IntegerField(unique=True)),
+                ('user_id', models.IntegerField(db_index=True)),
+                ('x', models.FloatField()),
+                ('y', models.FloatField()),
+            ],
+            options={
+                'db_table': 'note_map_points',
+            },
+        ),
+    ]
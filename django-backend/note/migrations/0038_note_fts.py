@@ -0,0 +1,61 @@
+from django.db import migrations
+
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5(
+        text, content='note_localmessage', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS note_fts_insert AFTER INSERT ON note_localmessage BEGIN
+        INSERT INTO note_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS note_fts_delete AFTER DELETE ON note_localmessage BEGIN
+        INSERT INTO note_fts(note_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS note_fts_update AFTER UPDATE OF text ON note_localmessage
+    WHEN old.text IS NOT new.text BEGIN
+        INSERT INTO note_fts(note_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO note_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    "INSERT INTO note_fts(note_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS note_fts_insert",
+    "DROP TRIGGER IF EXISTS note_fts_delete",
+    "DROP TRIGGER IF EXISTS note_fts_update",
+    "DROP TABLE IF EXISTS note_fts",
+]
+
+
+def _run(schema_editor, statements):
+    # Only the notes database on SQLite gets the FTS5 index; other engines keep their own search backend
+    if schema_editor.connection.alias != 'default' or schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_fts(apps, schema_editor):
+    _run(schema_editor, CREATE_SQL)
+
+
+def drop_fts(apps, schema_editor):
+    _run(schema_editor, DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0037_note_map'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
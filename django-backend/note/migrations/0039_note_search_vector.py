@@ -0,0 +1,90 @@
+from django.db import migrations
+
+BACKFILL_BATCH_SIZE = 5000
+TEXT_VECTOR = "to_tsvector('simple', coalesce(text, ''))"
+
+# A plain nullable column is a catalog-only change; a GENERATED ... STORED column would rewrite
+# the whole table under an ACCESS EXCLUSIVE lock. The trigger keeps it current from here on.
+COLUMN_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE note_localmessage ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    """
+    CREATE OR REPLACE FUNCTION note_localmessage_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := to_tsvector('simple', coalesce(NEW.text, ''));
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS note_localmessage_search_vector ON note_localmessage",
+    """
+    CREATE TRIGGER note_localmessage_search_vector BEFORE INSERT OR UPDATE OF text ON note_localmessage
+    FOR EACH ROW EXECUTE FUNCTION note_localmessage_search_vector()
+    """,
+]
+
+BACKFILL_SQL = f"""
+    UPDATE note_localmessage SET search_vector = {TEXT_VECTOR}
+    WHERE id IN (SELECT id FROM note_localmessage WHERE search_vector IS NULL LIMIT {BACKFILL_BATCH_SIZE})
+"""
+
+INDEXES = {
+    'note_localmessage_search_vector_gin': "ON note_localmessage USING GIN (search_vector)",
+    'note_localmessage_text_trgm': "ON note_localmessage USING GIN (text gin_trgm_ops)",
+}
+
+DROP_SQL = [
+    "DROP INDEX CONCURRENTLY IF EXISTS note_localmessage_text_trgm",
+    "DROP INDEX CONCURRENTLY IF EXISTS note_localmessage_search_vector_gin",
+    "DROP TRIGGER IF EXISTS note_localmessage_search_vector ON note_localmessage",
+    "DROP FUNCTION IF EXISTS note_localmessage_search_vector()",
+    "ALTER TABLE note_localmessage DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _is_search_database(schema_editor):
+    # The tsvector column and GIN indexes are PostgreSQL only; SQLite uses the FTS5 table from 0038
+    return schema_editor.connection.alias == 'default' and schema_editor.connection.vendor == 'postgresql'
+
+
+def create_search_vector(apps, schema_editor):
+    if not _is_search_database(schema_editor):
+        return
+    for statement in COLUMN_SQL:
+        schema_editor.execute(statement)
+
+    # Outside a transaction every batch commits on its own, so each one only briefly locks its rows
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(BACKFILL_SQL)
+            if cursor.rowcount < BACKFILL_BATCH_SIZE:
+                break
+
+        for name, definition in INDEXES.items():
+            # A CONCURRENTLY build that failed leaves an invalid index behind for IF NOT EXISTS to skip
+            cursor.execute(
+                "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(%s) AND NOT indisvalid", [name]
+            )
+            if cursor.fetchone():
+                cursor.execute(f"DROP INDEX CONCURRENTLY {name}")
+            cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}")
+
+
+def drop_search_vector(apps, schema_editor):
+    if not _is_search_database(schema_editor):
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('note', '0038_note_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
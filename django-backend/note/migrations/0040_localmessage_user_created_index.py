@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0039_note_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='localmessage',
+            index=models.Index(fields=['user', '-created_at'], name='note_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:03
+
+import re
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# A frozen copy of note.search_utils.vocabulary.note_terms as of this migration, so later changes to the
+# app's tokenizer cannot change what it does; manage.py rebuild_search_vocabulary recounts with the current one
+TOKEN_RE = re.compile(r'\w+')
+HASHTAG_RE = re.compile(r'(?:^|(?<=\s))#(\w+)', re.UNICODE | re.MULTILINE)
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+
+
+def note_terms(text):
+    text = (text or '').lower()
+    terms = {
+        word for word in TOKEN_RE.findall(text)
+        if MIN_TERM_LENGTH <= len(word) <= MAX_TERM_LENGTH and not word.isdigit()
+    }
+    terms.update(f'#{tag}' for tag in HASHTAG_RE.findall(text) if len(tag) < MAX_TERM_LENGTH)
+    return terms
+
+
+def count_terms(apps, schema_editor):
+    if schema_editor.connection.alias != 'default':
+        return
+    LocalMessage = apps.get_model('note', 'LocalMessage')
+    SearchTerm = apps.get_model('note', 'SearchTerm')
+    counts = {}
+    for user_id, text in LocalMessage.objects.values_list('user_id', 'text').iterator(chunk_size=1000):
+        for term in note_terms(text):
+            counts[(user_id, term)] = counts.get((user_id, term), 0) + 1
+    SearchTerm.objects.bulk_create(
+        [SearchTerm(user_id=user_id, term=term, note_count=count) for (user_id, term), count in counts.items()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('note', '0040_localmessage_user_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=65)),
+                ('note_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'note_search_terms',
+                'constraints': [models.UniqueConstraint(fields=('user', 'term'), name='note_search_term_unique')],
+            },
+        ),
+        migrations.RunPython(count_terms, migrations.RunPython.noop),
+    ]
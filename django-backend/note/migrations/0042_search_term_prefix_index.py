@@ -0,0 +1,36 @@
+from django.db import migrations
+
+INDEX_NAME = 'note_search_terms_prefix'
+
+
+def _is_postgres(schema_editor):
+    # SQLite serves completions from a range on the (user, term) unique index, which compares bytes
+    return schema_editor.connection.alias == 'default' and schema_editor.connection.vendor == 'postgresql'
+
+
+def create_prefix_index(apps, schema_editor):
+    if not _is_postgres(schema_editor):
+        return
+    # text_pattern_ops compares characters, not collation order, so LIKE 'prefix%' can use the index
+    schema_editor.execute(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME} ON note_search_terms (user_id, term text_pattern_ops)"
+    )
+
+
+def drop_prefix_index(apps, schema_editor):
+    if not _is_postgres(schema_editor):
+        return
+    schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('note', '0041_search_terms'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_index, drop_prefix_index),
+    ]
@@ -1,7 +1,7 @@
 import string
 import random
 
-from django.db import models
+from django.db import connections, models, router, transaction
 from django.db.models import Q
 from django.template.defaultfilters import slugify
 from django.contrib.auth.models import User
@@ -10,11 +10,27 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 
 import difflib
-import json
-import sqlite3
-import sqlite_vec
-import requests
+import hashlib
 from django.conf import settings
+from django.core.cache import cache
+
+from .embedding_utils import ivf, matrix, projection, topics
+from .embedding_utils.connection import get_embedding_db, serialize_vector, deserialize_vector
+from .embedding_utils.preprocessing import preprocess, token_change_ratio
+from .embedding_utils.providers import configured_model_name, configured_model_version, get_provider
+from .embedding_utils.vector_tables import (
+    NOTE_VECTOR_TABLE,
+    CHUNK_VECTOR_TABLE,
+    ensure_vector_table,
+    copy_vectors,
+    delete_vectors,
+    filter_clause,
+    insert_vectors,
+    knn,
+    shadow_table_name,
+    vector_table_sql,
+)
+from .search_utils import minhash, vocabulary
 
 # Import the LangChain markdown text splitter
 from langchain_text_splitters import (
@@ -125,42 +141,22 @@ class LocalMessage(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='messages')
     files = models.ManyToManyField('File', related_name='notes', blank=True)
-    
 
-    def delete(self, *args, **kwargs):
-        note_id_to_delete = self.id
+    class Meta:
+        indexes = [
+            # Serves the newest-first listing and the before:/after: search filters
+            models.Index(fields=['user', '-created_at'], name='note_user_created_idx'),
+        ]
 
-        # Get database path for vector embeddings
-        db_path = NoteEmbedding.get_embedding_db_path()
-        
-        try:
-            db = sqlite3.connect(db_path)
-            db.enable_load_extension(True)
-            sqlite_vec.load(db)
-            cursor = db.cursor()
-
-            # 1. Delete main note's embedding from note_embeddings_vec
-            cursor.execute(
-                "DELETE FROM note_embeddings_vec WHERE rowid = ?",
-                [note_id_to_delete]
+    @classmethod
+    def vector_metadata(cls, note_ids):
+        """Partition and filter columns stored alongside each note's vectors"""
+        return {
+            note_id: (user_id, list_id, archived)
+            for note_id, user_id, list_id, archived in cls.objects.filter(id__in=note_ids).values_list(
+                'id', 'user_id', 'list_id', 'archived'
             )
-
-            db.commit()
-        except sqlite3.Error as e:
-            # Log error or handle as needed
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error deleting embeddings from vector DB for note {note_id_to_delete}: {e}")
-            # Depending on policy, you might re-raise or allow deletion of Django objects to proceed
-        finally:
-            if 'db' in locals() and db:
-                db.close()
-
-        # 2. Delete NoteEmbedding Django model instance
-        NoteEmbedding.objects.filter(note_id=note_id_to_delete).delete()
-        
-        # 3. Call the superclass's delete method
-        super(LocalMessage, self).delete(*args, **kwargs)
+        }
 
 
 class Link(models.Model):
@@ -207,7 +203,14 @@ class File(models.Model):
 
 
 class NoteEmbedding(models.Model):
+    FRESHNESS_CACHE_KEY = 'embedding_freshness:{user_id}'
+
     note_id = models.IntegerField(unique=True)  # Add unique constraint
+    model_name = models.CharField(max_length=255, default='')
+    model_version = models.CharField(max_length=50, default='')
+    # sha256 of the preprocessed text the vector was computed from; blank on rows embedded before it was tracked
+    text_hash = models.CharField(max_length=64, blank=True, default='')
+    embedded_text = models.TextField(blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -223,22 +226,22 @@ class NoteEmbedding(models.Model):
 
     @staticmethod
     def setup_vector_table():
-        """Setup the vector table in the embeddings database"""
-        db_path = NoteEmbedding.get_embedding_db_path()
-        db = sqlite3.connect(db_path)
-        db.enable_load_extension(True)
-        sqlite_vec.load(db)
-        
-        # Create the vector table with explicit rowid primary key
-        db.execute(f"""
-            CREATE VIRTUAL TABLE IF NOT EXISTS note_embeddings_vec 
-            USING vec0(
-                embedding float[{settings.OLLAMA_EMBEDDING_SIZE}]
-            );
-        """)
-        
-        db.commit()
-        db.close()
+        """Setup the vector tables in the embeddings database, upgrading older layouts in place"""
+        index = EmbeddingIndex.active()
+        NoteEmbedding.objects.filter(model_name='').update(
+            model_name=index.model_name, model_version=index.model_version
+        )
+        with get_embedding_db().writer() as db:
+            ensure_vector_table(
+                db, NOTE_VECTOR_TABLE, index.dimensions,
+                LocalMessage.vector_metadata, settings.EMBEDDING_QUANTIZATION
+            )
+            ensure_vector_table(
+                db, CHUNK_VECTOR_TABLE, index.dimensions,
+                NoteChunk.vector_metadata, settings.EMBEDDING_QUANTIZATION
+            )
+            ivf.ensure_ivf_tables(db, index.dimensions)
+
     @staticmethod
     def hasRTL(text):
         """Check if text contains any Arabic RTL characters"""
@@ -246,153 +249,369 @@ class NoteEmbedding(models.Model):
         return bool(re.compile(r'[\u0600-\u06FF]').search(text))
 
     @staticmethod
-    def get_embedding(text):
-        response = requests.post(
-            f'{settings.OLLAMA_URL}/api/embed',
-            json={
-                "model": settings.OLLAMA_MODEL,    
-                "input": text
-            }
+    def _request_embeddings(texts, model_name, read_timeout=None):
+        return get_provider(model_name).embed(texts, read_timeout=read_timeout)
+
+    @staticmethod
+    def prepare_text(text):
+        """The preprocessed form of a text that is actually embedded and cached"""
+        return preprocess(text, settings.EMBEDDING_MAX_INPUT_CHARS)
+
+    @classmethod
+    def get_embeddings(cls, texts, model_name=None, read_timeout=None):
+        """
+        Embed a list of texts, sending only cache misses to the embedding service in one request.
+
+        Texts are preprocessed first, and the live index's model is used
+        unless model_name is given. read_timeout replaces
+        OLLAMA_READ_TIMEOUT for callers that cannot wait that long.
+        """
+        if not texts:
+            return []
+        model_name = model_name or EmbeddingIndex.active().model_name
+        texts = [cls.prepare_text(text) for text in texts]
+        vectors = EmbeddingCacheEntry.get_many(model_name, texts)
+        missing = list(dict.fromkeys(text for text in texts if text not in vectors))
+        if missing:
+            fetched = dict(zip(missing, cls._request_embeddings(missing, model_name, read_timeout)))
+            EmbeddingCacheEntry.set_many(model_name, fetched)
+            vectors.update(fetched)
+        return [vectors[text] for text in texts]
+
+    @classmethod
+    def get_embedding(cls, text):
+        prepared = cls.prepare_text(text)
+        cached = EmbeddingCacheEntry.get_many(EmbeddingIndex.active().model_name, [prepared])
+        if prepared in cached:
+            return cached[prepared]
+        from .embedding_utils.batching import get_batcher
+        return get_batcher().embed(text)
+
+    @classmethod
+    def _write_vectors(cls, notes, vectors, index):
+        with transaction.atomic(using='embeddings'):
+            cls.objects.filter(note_id__in=[note.id for note in notes]).delete()
+            cls.objects.bulk_create([
+                cls(
+                    note_id=note.id, model_name=index.model_name, model_version=index.model_version,
+                    text_hash=NoteChunk.hash_text(prepared), embedded_text=prepared,
+                )
+                for note, prepared in zip(notes, [cls.prepare_text(note.text) for note in notes])
+            ])
+
+        blobs = [serialize_vector(vector) for vector in vectors]
+        with get_embedding_db().writer() as db:
+            EmbeddingIndex.check_active(db, index)
+            # A re-embedded note's shadow vector is stale; dropping it makes the re-index redo the note
+            building = EmbeddingIndex.building()
+            if building is not None:
+                db.executemany(
+                    f"DELETE FROM {shadow_table_name(NOTE_VECTOR_TABLE)} WHERE rowid = ?",
+                    [[note.id] for note in notes]
+                )
+            db.executemany(
+                f"DELETE FROM {NOTE_VECTOR_TABLE} WHERE rowid = ?",
+                [[note.id] for note in notes]
+            )
+            insert_vectors(
+                db, NOTE_VECTOR_TABLE,
+                [[note.id, note.user_id, note.list_id, note.archived, blob]
+                 for note, blob in zip(notes, blobs)],
+                settings.EMBEDDING_QUANTIZATION
+            )
+            ivf.assign(
+                db, [[note.id, note.user_id, note.list_id, note.archived, blob] for note, blob in zip(notes, blobs)]
+            )
+        # sync_matrix exports rows updated since its last run. Stamping them again once the vectors are committed
+        # keeps a sync that started between the row write and the vector write from skipping them for good
+        cls.objects.filter(note_id__in=[note.id for note in notes]).update(updated_at=timezone.now())
+
+    def is_significant_change(self, text):
+        """
+        Whether text is worth a new vector compared to what was last embedded.
+
+        Small token-set deltas such as typo fixes are skipped unless the
+        vector is older than EMBEDDING_MAX_STALENESS_SECONDS.
+        """
+        if timezone.now() - self.updated_at > timezone.timedelta(seconds=settings.EMBEDDING_MAX_STALENESS_SECONDS):
+            return True
+        return token_change_ratio(self.embedded_text, self.prepare_text(text)) >= settings.EMBEDDING_CHANGE_THRESHOLD
+
+    @classmethod
+    def freshness(cls, user_id=None, batch_size=1000):
+        """
+        Classify notes by the state of their embedding.
+
+        Returns a dict of note id lists: missing (no embedding), stale (text
+        changed since it was embedded), outdated (embedded with a model
+        other than the live index's, left to the re-index) and fresh, plus
+        orphaned embeddings whose note is gone and RTL notes, which are
+        never embedded. Only notes edited after their embedding
+        was written have their text hashed, and blank hashes of such
+        untouched notes are backfilled along the way.
+        """
+        index = EmbeddingIndex.active()
+        notes = LocalMessage.objects.all()
+        if user_id is not None:
+            notes = notes.filter(user_id=user_id)
+        note_ids = list(notes.order_by('id').values_list('id', flat=True))
+
+        report = {'missing': [], 'stale': [], 'outdated': [], 'fresh': [], 'orphaned': [], 'rtl': []}
+        backfill = []
+        for start in range(0, len(note_ids), batch_size):
+            batch = note_ids[start:start + batch_size]
+            embeddings = {embedding.note_id: embedding for embedding in cls.objects.filter(note_id__in=batch)}
+            updated = dict(LocalMessage.objects.filter(id__in=batch).values_list('id', 'updated_at'))
+
+            to_hash = [
+                note_id for note_id in batch
+                if note_id not in embeddings or updated[note_id] > embeddings[note_id].updated_at
+                or not embeddings[note_id].text_hash
+            ]
+            texts = dict(LocalMessage.objects.filter(id__in=to_hash).values_list('id', 'text'))
+
+            for note_id in batch:
+                embedding = embeddings.get(note_id)
+                if note_id in texts and cls.hasRTL(texts[note_id]):
+                    report['rtl'].append(note_id)
+                elif embedding is None:
+                    report['missing'].append(note_id)
+                elif (embedding.model_name, embedding.model_version) != (index.model_name, index.model_version):
+                    report['outdated'].append(note_id)
+                elif note_id in texts:
+                    text_hash = NoteChunk.hash_text(cls.prepare_text(texts[note_id]))
+                    if embedding.text_hash == text_hash:
+                        report['fresh'].append(note_id)
+                    elif not embedding.text_hash and updated[note_id] <= embedding.updated_at:
+                        embedding.text_hash = text_hash
+                        backfill.append(embedding)
+                        report['fresh'].append(note_id)
+                    else:
+                        report['stale'].append(note_id)
+                else:
+                    report['fresh'].append(note_id)
+
+        if user_id is None:
+            live_ids = set(note_ids)
+            report['orphaned'] = [
+                note_id for note_id in cls.objects.values_list('note_id', flat=True) if note_id not in live_ids
+            ]
+        cls.objects.bulk_update(backfill, ['text_hash'], batch_size=batch_size)
+        return report
+
+    @staticmethod
+    def freshness_summary(report):
+        """Counts and coverage/staleness percentages of a freshness() report; RTL notes are excluded from the totals"""
+        embedded = len(report['fresh']) + len(report['stale']) + len(report['outdated'])
+        total = embedded + len(report['missing'])
+        return {
+            'notes': total,
+            'embedded': embedded,
+            'missing': len(report['missing']),
+            'stale': len(report['stale']),
+            'outdated': len(report['outdated']),
+            'orphaned': len(report['orphaned']),
+            'skipped_rtl': len(report['rtl']),
+            'coverage_pct': round(100 * embedded / total, 2) if total else 100.0,
+            'stale_pct': round(100 * (len(report['stale']) + len(report['outdated'])) / embedded, 2) if embedded else 0.0,
+        }
+
+    @classmethod
+    def cache_freshness(cls, report):
+        """Split a freshness() report over all notes by owner and cache each user's freshness_summary()"""
+        owners = dict(LocalMessage.objects.values_list('id', 'user_id'))
+        reports = {
+            user_id: {key: [] for key in report}
+            for user_id in User.objects.values_list('id', flat=True)
+        }
+        for key in ('missing', 'stale', 'outdated', 'fresh', 'rtl'):
+            for note_id in report[key]:
+                if owners.get(note_id) in reports:
+                    reports[owners[note_id]][key].append(note_id)
+
+        computed_at = timezone.now().isoformat()
+        cache.set_many(
+            {
+                cls.FRESHNESS_CACHE_KEY.format(user_id=user_id): {
+                    **cls.freshness_summary(user_report), 'computed_at': computed_at
+                }
+                for user_id, user_report in reports.items()
+            },
+            settings.EMBEDDING_FRESHNESS_CACHE_SECONDS
         )
-        if response.status_code == 200:
-            return response.json()['embeddings'][0]
-        raise Exception(f"Failed to get embedding: {response.text}")
+
+    @classmethod
+    def cached_freshness(cls, user_id):
+        """The user's summary from the last sweep_stale_embeddings run, or None before the first one"""
+        return cache.get(cls.FRESHNESS_CACHE_KEY.format(user_id=user_id))
+
+    @classmethod
+    def sync_matrix(cls, full=False):
+        """
+        Bring the memory-mapped export in EMBEDDING_MATRIX_DIR up to date.
+
+        Only embeddings written since the last sync are read from the
+        vector table; a different live model or full=True re-exports all.
+        """
+        index = EmbeddingIndex.active()
+        model_key = f"{index.model_name}@{index.model_version}"
+        directory = settings.EMBEDDING_MATRIX_DIR
+        db = get_embedding_db().reader()
+        # Topic clustering, map builds and on-demand map requests all sync; the lock runs them one at a time
+        with matrix.locked(directory):
+            meta = matrix.read_meta(directory)
+            synced_at = timezone.now()
+            if full or not matrix.is_current(meta, index.dimensions, model_key):
+                return matrix.rebuild(directory, db, index.dimensions, model_key, synced_at.isoformat())
+
+            changed = cls.objects.filter(
+                updated_at__gte=timezone.datetime.fromisoformat(meta['synced_at'])
+            ).values_list('note_id', flat=True)
+            return matrix.update(
+                directory, db, changed, cls.objects.values_list('note_id', flat=True), synced_at.isoformat()
+            )
+
+    @classmethod
+    def delete_for_notes(cls, note_ids):
+        """
+        Remove the vectors, chunks, map points and neighbour entries of notes
+        that were deleted or are no longer embedded, in batched statements.
+
+        Returns the ids of remaining notes whose neighbour lists lost an entry.
+        """
+        note_ids = list(note_ids)
+        with get_embedding_db().writer() as db:
+            delete_vectors(db, NOTE_VECTOR_TABLE, note_ids)
+            ivf.remove(db, note_ids)
+        cls.objects.filter(note_id__in=note_ids).delete()
+        NoteChunk.delete_for_notes(note_ids)
+        NoteMapPoint.delete_for_notes(note_ids)
+        return NoteNeighbor.delete_for_notes(note_ids)
+
+    @staticmethod
+    def update_metadata(note):
+        """Keep the list/archived filter columns of a note's vectors in sync with the note"""
+        chunk_ids = list(NoteChunk.objects.filter(note_id=note.id).values_list('id', flat=True))
+        with get_embedding_db().writer() as db:
+            db.execute(
+                f"UPDATE {NOTE_VECTOR_TABLE} SET list_id = ?, archived = ? WHERE rowid = ?",
+                [note.list_id, note.archived, note.id]
+            )
+            ivf.update_metadata(db, note)
+            db.executemany(
+                f"UPDATE {CHUNK_VECTOR_TABLE} SET list_id = ?, archived = ? WHERE rowid = ?",
+                [[note.list_id, note.archived, chunk_id] for chunk_id in chunk_ids]
+            )
 
     @classmethod
     def create_for_note(cls, note):
         """Class method to create embedding for a note"""
         try:
-            # Check if note contains non-ASCII characters
             if cls.hasRTL(note.text):
                 return None
-                
-            # First delete any existing embedding for this note
-            cls.objects.filter(note_id=note.id).delete()
-            
-            # Create the embedding record
-            embedding = cls.objects.create(note_id=note.id)
-            
-            # Get embedding vector from ollama
-            vector = cls.get_embedding(note.text)
-            
-            # Get database path and create new connection
-            db_path = cls.get_embedding_db_path()
-            db = sqlite3.connect(db_path)
-            db.enable_load_extension(True)
-            sqlite_vec.load(db)
-            
-            # First delete any existing vector for this note
-            db.execute(
-                "DELETE FROM note_embeddings_vec WHERE rowid = ?",
-                [note.id]
-            )
 
-                
-            # Insert new vector
-            db.execute(
-                """
-                INSERT INTO note_embeddings_vec(rowid, embedding) 
-                VALUES (?, json(?))
-                """,
-                [note.id, json.dumps(vector)]
-            )
-            
-            db.commit()
-            db.close()
-            
-            return embedding
+            index = EmbeddingIndex.active()
+            vector = cls.get_embeddings([note.text], index.model_name)[0]
+            cls._write_vectors([note], [vector], index)
+            NoteMapBasis.place_notes([note], [vector])
+            NoteChunk.sync_for_notes([note], index)
+            NoteNeighbor.refresh_for_notes([note.id])
+            return cls.objects.get(note_id=note.id)
             
         except Exception as e:
-            # Log the error and re-raise
             import logging
             logger = logging.getLogger(__name__)
             logger.error(f"Failed to process embedding for note {note.id}: {str(e)}")
             raise
 
-    @staticmethod
-    def find_similar_notes(note_id, limit=4):
-        # Get database path and create new connection
-        db_path = NoteEmbedding.get_embedding_db_path()
-        db = sqlite3.connect(db_path)
-        db.enable_load_extension(True)
-        sqlite_vec.load(db)
-        
-        # First get the embedding for the target note
-        cursor = db.cursor()
-        cursor.execute(
-            """
-            SELECT embedding 
-            FROM note_embeddings_vec 
-            WHERE rowid = ?
-            """,
+    @classmethod
+    def create_for_notes(cls, notes):
+        """Embed several notes with one batched request and store all vectors in one transaction"""
+        notes = [note for note in notes if not cls.hasRTL(note.text)]
+        if not notes:
+            return []
+
+        index = EmbeddingIndex.active()
+        vectors = cls.get_embeddings([note.text for note in notes], index.model_name)
+        cls._write_vectors(notes, vectors, index)
+        NoteMapBasis.place_notes(notes, vectors)
+        NoteChunk.sync_for_notes(notes, index)
+        NoteNeighbor.refresh_for_notes([note.id for note in notes])
+        return [note.id for note in notes]
+
+    @classmethod
+    def find_similar_notes(cls, note_id, limit=4, user_id=None, list_ids=None, archived=None, exclude_note_ids=(),
+                           nprobe=None):
+        """
+        Find the nearest notes to a stored note inside the owner's partition.
+
+        list_ids/archived are applied by sqlite-vec during the scan, so the
+        result holds up to `limit` notes that already pass those filters.
+        With EMBEDDING_IVF_ENABLED the scan only covers the inverted list
+        partitions of the `nprobe` nearest centroids (default EMBEDDING_IVF_NPROBE).
+        """
+        db = get_embedding_db().reader()
+
+        result = db.execute(
+            f"SELECT embedding, user_id FROM {NOTE_VECTOR_TABLE} WHERE rowid = ?",
             [note_id]
-        )
-        result = cursor.fetchone()
+        ).fetchone()
         if not result:
-            db.close()
             return []
-        
-        target_embedding = result[0]
-        
-        # Find similar notes
-        cursor.execute(
-            """
-            SELECT 
-                rowid,
-                distance
-            FROM note_embeddings_vec
-            WHERE embedding MATCH ? 
-                AND rowid != ?
-                AND k = ?
-            """,
-            [target_embedding, note_id, limit]
+
+        embedding, owner_id = result
+        exclude_note_ids = set(exclude_note_ids) | {note_id}
+        return cls._knn(
+            embedding, limit, user_id if user_id is not None else owner_id,
+            list_ids, archived, exclude_note_ids, nprobe=nprobe
         )
-        
-        results = [{'note_id': row[0], 'distance': row[1]} 
-                  for row in cursor.fetchall()]
-        
-        db.close()
-        return results
 
     @classmethod
-    def find_similar_notes_by_embedding(cls, text_embedding, limit=5, exclude_note_id=None):
-        """Find similar notes based on a given text embedding."""
+    def find_similar_notes_by_embedding(cls, text_embedding, user_id, limit=5, exclude_note_id=None,
+                                        list_ids=None, archived=None, note_ids=None):
+        """
+        Find the user's notes similar to a given text embedding, optionally restricted to note_ids.
+
+        user_id is the vec0 partition key, so there is no search across users.
+        """
         if text_embedding is None:
             return []
 
-        db_path = cls.get_embedding_db_path()
-        db = sqlite3.connect(db_path)
-        db.enable_load_extension(True)
-        sqlite_vec.load(db)
-        cursor = db.cursor()
+        exclude_note_ids = {exclude_note_id} if exclude_note_id is not None else set()
+        return cls._knn(
+            serialize_vector(text_embedding), limit, user_id, list_ids, archived, exclude_note_ids,
+            note_ids=note_ids
+        )
 
-        query_params = [json.dumps(text_embedding)]
-        
-        base_query = """
-            SELECT rowid, distance
-            FROM note_embeddings_vec
-            WHERE embedding MATCH ?1
-        """
-        
-        if exclude_note_id is not None:
-            base_query += " AND rowid != ?2"
-            query_params.append(exclude_note_id)
-            base_query += " AND k = ?3" # k is limit
-            query_params.append(limit)
-        else:
-            base_query += " AND k = ?2" # k is limit
-            query_params.append(limit)
-            
-        cursor.execute(base_query, query_params)
-        
-        results = [{'note_id': row[0], 'distance': row[1]} 
-                   for row in cursor.fetchall()]
-        
-        db.close()
-        return results
+    @staticmethod
+    def _knn(embedding_blob, limit, user_id, list_ids, archived, exclude_note_ids, exact=False, nprobe=None,
+             note_ids=None):
+        if (list_ids is not None and not list_ids) or (note_ids is not None and not note_ids):
+            return []
+
+        # Excluded ids can only displace that many results, so over-fetching by their count keeps `limit` exact
+        k = limit + len(exclude_note_ids)
+        db = get_embedding_db().reader()
+        clause, params = filter_clause(user_id, list_ids, archived, rowids=note_ids)
+        quantization = 'none' if exact else settings.EMBEDDING_QUANTIZATION
+
+        rows = None
+        if not exact and settings.EMBEDDING_IVF_ENABLED and ivf.is_trained(db):
+            rows = ivf.probe(db, embedding_blob, k, clause, params, nprobe or settings.EMBEDDING_IVF_NPROBE)
+            # Probed lists too sparse for this user/filter: fall back to the full scan
+            if len(rows) < k:
+                rows = None
+        if rows is None:
+            rows = knn(
+                db, NOTE_VECTOR_TABLE, embedding_blob, k, clause, params,
+                quantization=quantization, rerank_factor=settings.EMBEDDING_RERANK_FACTOR,
+            )
+
+        return [{'note_id': row[0], 'distance': row[1]}
+                for row in rows if row[0] not in exclude_note_ids][:limit]
 
     @staticmethod
-    def find_similar_notes_by_text(text, limit=5, exclude_note_id=None):
+    def find_similar_notes_by_text(text, user_id, limit=5, exclude_note_id=None):
         """Find similar notes based on a given text."""
         try:
             # Generate embedding for the input text
@@ -402,7 +621,8 @@ class NoteEmbedding(models.Model):
             return NoteEmbedding.find_similar_notes_by_embedding(
                 text_embedding=text_embedding,
                 limit=limit,
-                exclude_note_id=exclude_note_id
+                exclude_note_id=exclude_note_id,
+                user_id=user_id
             )
         except Exception as e:
             # Log the error and return empty list
@@ -412,6 +632,795 @@ class NoteEmbedding(models.Model):
             return []
 
 
+class NoteChunk(models.Model):
+    """A markdown section of a note with its own vector in note_chunks_vec (rowid = chunk id)"""
+    MIN_CHUNK_CHARS = 20
+
+    note_id = models.IntegerField(db_index=True)
+    chunk_index = models.IntegerField()
+    start_offset = models.IntegerField()
+    end_offset = models.IntegerField()
+    text_hash = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'note_chunks'
+        ordering = ['note_id', 'chunk_index']
+
+    @staticmethod
+    def split_text(text):
+        """Split markdown along headers, then paragraphs, returning (start, end, text) tuples"""
+        splitter = RecursiveCharacterTextSplitter.from_language(
+            Language.MARKDOWN,
+            chunk_size=settings.EMBEDDING_CHUNK_SIZE,
+            chunk_overlap=settings.EMBEDDING_CHUNK_OVERLAP,
+            add_start_index=True,
+        )
+        documents = splitter.create_documents([text])
+        chunks = []
+        for document in documents:
+            # Skip stray header-only fragments unless they are all the note has
+            if len(documents) > 1 and len(document.page_content.strip()) < NoteChunk.MIN_CHUNK_CHARS:
+                continue
+            start = document.metadata['start_index']
+            chunks.append((start, start + len(document.page_content), document.page_content))
+        return chunks
+
+    @staticmethod
+    def hash_text(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def sync_for_notes(cls, notes, index):
+        """
+        Re-split notes and embed only the chunks whose text changed.
+
+        Unchanged chunks keep their row and vector and just get their
+        position refreshed; new chunk texts across all notes are embedded
+        with one batched request using the given index's model.
+        """
+        notes_by_id = {note.id: note for note in notes}
+        existing_by_note = {}
+        for chunk in cls.objects.filter(note_id__in=notes_by_id.keys()):
+            existing_by_note.setdefault(chunk.note_id, {}).setdefault(chunk.text_hash, []).append(chunk)
+
+        kept, created, new_texts, stale_ids = [], [], [], []
+        for note in notes:
+            existing = existing_by_note.get(note.id, {})
+            for position, (start, end, text) in enumerate(cls.split_text(note.text)):
+                text_hash = cls.hash_text(text)
+                if existing.get(text_hash):
+                    chunk = existing[text_hash].pop()
+                    chunk.chunk_index, chunk.start_offset, chunk.end_offset = position, start, end
+                    kept.append(chunk)
+                else:
+                    created.append(cls(
+                        note_id=note.id, chunk_index=position,
+                        start_offset=start, end_offset=end, text_hash=text_hash,
+                    ))
+                    new_texts.append(text)
+            stale_ids.extend(chunk.id for chunks in existing.values() for chunk in chunks)
+
+        vectors = NoteEmbedding.get_embeddings(new_texts, index.model_name)
+
+        with transaction.atomic(using='embeddings'):
+            cls.objects.filter(id__in=stale_ids).delete()
+            cls.objects.bulk_update(kept, ['chunk_index', 'start_offset', 'end_offset'])
+            created = cls.objects.bulk_create(created)
+
+        try:
+            with get_embedding_db().writer() as db:
+                EmbeddingIndex.check_active(db, index)
+                db.executemany(
+                    f"DELETE FROM {CHUNK_VECTOR_TABLE} WHERE rowid = ?",
+                    [[chunk_id] for chunk_id in stale_ids]
+                )
+                insert_vectors(
+                    db, CHUNK_VECTOR_TABLE,
+                    [[chunk.id, notes_by_id[chunk.note_id].user_id, notes_by_id[chunk.note_id].list_id,
+                      notes_by_id[chunk.note_id].archived, serialize_vector(vector)]
+                     for chunk, vector in zip(created, vectors)],
+                    settings.EMBEDDING_QUANTIZATION
+                )
+        except EmbeddingIndexChanged:
+            # Forget the new chunks so the retry embeds them with the new model
+            cls.objects.filter(id__in=[chunk.id for chunk in created]).delete()
+            raise
+        return len(created)
+
+    @classmethod
+    def vector_metadata(cls, chunk_ids):
+        note_ids = dict(cls.objects.filter(id__in=chunk_ids).values_list('id', 'note_id'))
+        note_metadata = LocalMessage.vector_metadata(set(note_ids.values()))
+        return {
+            chunk_id: note_metadata[note_id]
+            for chunk_id, note_id in note_ids.items() if note_id in note_metadata
+        }
+
+    @classmethod
+    def delete_for_notes(cls, note_ids):
+        chunk_ids = list(cls.objects.filter(note_id__in=note_ids).values_list('id', flat=True))
+        with get_embedding_db().writer() as db:
+            delete_vectors(db, CHUNK_VECTOR_TABLE, chunk_ids)
+        cls.objects.filter(id__in=chunk_ids).delete()
+
+    @classmethod
+    def find_similar_chunks(cls, text_embedding, user_id, limit=5, exclude_note_id=None, list_ids=None, archived=None):
+        """Return the best-matching chunk per note, nearest first, with its character offsets"""
+        if list_ids is not None and not list_ids:
+            return []
+
+        clause, params = filter_clause(user_id, list_ids, archived)
+        rows = knn(
+            get_embedding_db().reader(), CHUNK_VECTOR_TABLE, serialize_vector(text_embedding),
+            limit * settings.EMBEDDING_CHUNK_OVERFETCH, clause, params,
+            quantization=settings.EMBEDDING_QUANTIZATION,
+            rerank_factor=settings.EMBEDDING_RERANK_FACTOR,
+        )
+
+        chunks = cls.objects.in_bulk([row[0] for row in rows])
+        results = {}
+        for chunk_id, distance in rows:
+            chunk = chunks.get(chunk_id)
+            if chunk is None or chunk.note_id == exclude_note_id or chunk.note_id in results:
+                continue
+            results[chunk.note_id] = {
+                'note_id': chunk.note_id,
+                'distance': distance,
+                'start_offset': chunk.start_offset,
+                'end_offset': chunk.end_offset,
+            }
+            if len(results) >= limit:
+                break
+        return list(results.values())
+
+
+class NoteNeighbor(models.Model):
+    """Materialized top-k nearest notes of each note within its owner's partition"""
+    # How far past its own top-k a changed note looks for notes that may now list it
+    REVERSE_NEIGHBOR_FACTOR = 4
+
+    note_id = models.IntegerField()
+    neighbor_id = models.IntegerField(db_index=True)
+    distance = models.FloatField()
+    rank = models.IntegerField()
+
+    class Meta:
+        db_table = 'note_neighbors'
+        ordering = ['note_id', 'rank']
+        unique_together = ('note_id', 'neighbor_id')
+        indexes = [models.Index(fields=['note_id', 'rank'])]
+
+    @classmethod
+    def recompute(cls, note_ids):
+        """Replace the neighbour lists of the given notes with a fresh KNN result"""
+        note_ids = set(note_ids)
+        rows = []
+        for note_id in note_ids:
+            neighbors = NoteEmbedding.find_similar_notes(note_id, limit=settings.EMBEDDING_NEIGHBOR_COUNT)
+            rows.extend(
+                cls(note_id=note_id, neighbor_id=neighbor['note_id'], distance=neighbor['distance'], rank=rank)
+                for rank, neighbor in enumerate(neighbors)
+            )
+        with transaction.atomic(using='embeddings'):
+            cls.objects.filter(note_id__in=note_ids).delete()
+            cls.objects.bulk_create(rows)
+
+    @classmethod
+    def refresh_for_notes(cls, note_ids):
+        """
+        Recompute neighbour lists affected by new vectors for note_ids.
+
+        Besides the notes themselves this covers notes that already list
+        them (their stored distances are stale) and notes in their new
+        neighbourhood that they are now closer to than the current k-th
+        neighbour or whose list is not full yet.
+        """
+        note_ids = set(note_ids)
+        limit = settings.EMBEDDING_NEIGHBOR_COUNT
+        affected = set(note_ids)
+        affected.update(cls.objects.filter(neighbor_id__in=note_ids).values_list('note_id', flat=True))
+
+        candidates = {}
+        for note_id in note_ids:
+            for neighbor in NoteEmbedding.find_similar_notes(note_id, limit=limit * cls.REVERSE_NEIGHBOR_FACTOR):
+                if neighbor['note_id'] not in affected:
+                    distance = candidates.get(neighbor['note_id'], neighbor['distance'])
+                    candidates[neighbor['note_id']] = min(distance, neighbor['distance'])
+
+        worst = {
+            row['note_id']: (row['count'], row['worst'])
+            for row in cls.objects.filter(note_id__in=candidates.keys()).values('note_id').annotate(
+                count=models.Count('id'), worst=models.Max('distance')
+            )
+        }
+        for candidate_id, distance in candidates.items():
+            count, worst_distance = worst.get(candidate_id, (0, None))
+            if count < limit or distance < worst_distance:
+                affected.add(candidate_id)
+
+        cls.recompute(affected)
+
+    @classmethod
+    def delete_for_notes(cls, note_ids):
+        """Drop the notes' own lists and their entries in other lists, returning the ids of those other notes"""
+        holders = set(cls.objects.filter(neighbor_id__in=note_ids).values_list('note_id', flat=True)) - set(note_ids)
+        cls.objects.filter(Q(note_id__in=note_ids) | Q(neighbor_id__in=note_ids)).delete()
+        return holders
+
+
+class EmbeddingCacheEntry(models.Model):
+    """Embedding vectors keyed by model name and normalized text hash, evicted in LRU order"""
+    key = models.CharField(max_length=64, primary_key=True)
+    model_name = models.CharField(max_length=255)
+    embedding = models.BinaryField()
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'embedding_cache'
+
+    @staticmethod
+    def make_key(model_name, text):
+        normalized = ' '.join(text.split())
+        return hashlib.sha256(f"{model_name}\0{normalized}".encode('utf-8')).hexdigest()
+
+    @classmethod
+    def get_many(cls, model_name, texts):
+        """
+        Return a {text: vector} dict for the texts that are cached and mark them as recently used.
+
+        last_used only needs to be accurate enough to order evictions, so
+        entries are rewritten at most once per EMBEDDING_CACHE_TOUCH_SECONDS
+        instead of on every hit.
+        """
+        texts_by_key = {}
+        for text in texts:
+            texts_by_key.setdefault(cls.make_key(model_name, text), []).append(text)
+        rows = list(cls.objects.filter(key__in=texts_by_key.keys()).values_list('key', 'embedding', 'last_used'))
+        found = {}
+        for key, blob, _ in rows:
+            vector = deserialize_vector(bytes(blob))
+            for text in texts_by_key[key]:
+                found[text] = vector
+
+        now = timezone.now()
+        touch_before = now - timezone.timedelta(seconds=settings.EMBEDDING_CACHE_TOUCH_SECONDS)
+        stale_keys = [key for key, _, last_used in rows if last_used < touch_before]
+        if stale_keys:
+            cls.objects.filter(key__in=stale_keys).update(last_used=now)
+        return found
+
+    @classmethod
+    def set_many(cls, model_name, vectors_by_text):
+        now = timezone.now()
+        entries = {}
+        for text, vector in vectors_by_text.items():
+            key = cls.make_key(model_name, text)
+            entries[key] = cls(key=key, model_name=model_name, embedding=serialize_vector(vector), last_used=now)
+        cls.objects.bulk_create(
+            entries.values(),
+            update_conflicts=True,
+            unique_fields=['key'],
+            update_fields=['embedding', 'last_used'],
+        )
+        cls.evict()
+
+    @classmethod
+    def evict(cls):
+        """Trim the cache back under EMBEDDING_CACHE_MAX_ENTRIES, dropping the least recently used entries"""
+        max_entries = settings.EMBEDDING_CACHE_MAX_ENTRIES
+        excess = cls.objects.count() - max_entries
+        if excess <= 0:
+            return
+        # Evict down to 90% of capacity so we don't pay for a trim on every insert
+        excess += max_entries // 10
+        stale_keys = list(cls.objects.order_by('last_used').values_list('key', flat=True)[:excess])
+        cls.objects.filter(key__in=stale_keys).delete()
+
+
+class EmbeddingIndexChanged(Exception):
+    """Vectors were computed with a model that is no longer the live one"""
+
+
+class EmbeddingIndex(models.Model):
+    """
+    One embedding model generation.
+
+    The active index owns the live vector tables. When the configured
+    model, OLLAMA_EMBEDDING_SIZE or EMBEDDING_MODEL_VERSION change, a building
+    index fills shadow vec0 tables in the background while queries keep
+    using the live ones, then swap() replaces the live tables in a single
+    write transaction once every note and chunk has a shadow vector.
+    """
+    BUILDING = 'building'
+    ACTIVE = 'active'
+    RETIRED = 'retired'
+    STATUS_CHOICES = [
+        (BUILDING, 'Building'),
+        (ACTIVE, 'Active'),
+        (RETIRED, 'Retired'),
+    ]
+
+    model_name = models.CharField(max_length=255)
+    model_version = models.CharField(max_length=50)
+    dimensions = models.IntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'embedding_index'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.model_name}@{self.model_version} ({self.status})"
+
+    @classmethod
+    def active(cls):
+        """The live index, registering the configured model as live on first use"""
+        index = cls.objects.filter(status=cls.ACTIVE).first()
+        if index is None:
+            index = cls.objects.create(
+                model_name=configured_model_name(),
+                model_version=configured_model_version(),
+                dimensions=settings.OLLAMA_EMBEDDING_SIZE,
+                status=cls.ACTIVE,
+                activated_at=timezone.now(),
+            )
+        return index
+
+    @classmethod
+    def building(cls):
+        return cls.objects.filter(status=cls.BUILDING).first()
+
+    @classmethod
+    def check_active(cls, db, index):
+        """Raise EmbeddingIndexChanged unless index is still live, checked inside the caller's write transaction"""
+        row = db.execute("SELECT id FROM embedding_index WHERE status = ?", [cls.ACTIVE]).fetchone()
+        if row is None or row[0] != index.id:
+            raise EmbeddingIndexChanged(f"Embedding index {index} is no longer active")
+
+    def matches_settings(self):
+        return (
+            self.model_name == configured_model_name()
+            and self.model_version == configured_model_version()
+            and self.dimensions == settings.OLLAMA_EMBEDDING_SIZE
+        )
+
+    @classmethod
+    def start_build(cls):
+        """Return the index being built for the configured model, starting one if the live index is out of date"""
+        if cls.active().matches_settings():
+            return None
+        building = cls.building()
+        if building is not None and building.matches_settings():
+            return building
+
+        with get_embedding_db().writer() as db:
+            for table in (NOTE_VECTOR_TABLE, CHUNK_VECTOR_TABLE):
+                db.execute(f"DROP TABLE IF EXISTS {shadow_table_name(table)}")
+                db.execute(vector_table_sql(
+                    shadow_table_name(table), settings.OLLAMA_EMBEDDING_SIZE, settings.EMBEDDING_QUANTIZATION
+                ))
+        cls.objects.filter(status=cls.BUILDING).update(status=cls.RETIRED)
+        return cls.objects.create(
+            model_name=configured_model_name(),
+            model_version=configured_model_version(),
+            dimensions=settings.OLLAMA_EMBEDDING_SIZE,
+            status=cls.BUILDING,
+        )
+
+    # Embedded notes and chunks that have no shadow vector yet
+    MISSING_NOTES_SQL = (
+        f"FROM note_embeddings WHERE note_id NOT IN (SELECT rowid FROM {shadow_table_name(NOTE_VECTOR_TABLE)})"
+    )
+    MISSING_CHUNKS_SQL = (
+        f"FROM note_chunks WHERE id NOT IN (SELECT rowid FROM {shadow_table_name(CHUNK_VECTOR_TABLE)})"
+    )
+
+    def missing_counts(self, db):
+        """(notes, chunks) with a live vector but no shadow vector yet"""
+        notes = db.execute(f"SELECT COUNT(*) {self.MISSING_NOTES_SQL}").fetchone()[0]
+        chunks = db.execute(f"SELECT COUNT(*) {self.MISSING_CHUNKS_SQL}").fetchone()[0]
+        return notes, chunks
+
+    def build_batch(self, batch_size):
+        """Embed up to batch_size missing notes and chunks into the shadow tables, returning how many are left"""
+        db = get_embedding_db().reader()
+        note_ids = [
+            row[0] for row in db.execute(f"SELECT note_id {self.MISSING_NOTES_SQL} LIMIT ?", [batch_size])
+        ]
+        chunk_rows = db.execute(
+            f"SELECT id, note_id, start_offset, end_offset {self.MISSING_CHUNKS_SQL} LIMIT ?", [batch_size]
+        ).fetchall()
+
+        notes = LocalMessage.objects.in_bulk(set(note_ids) | {row[1] for row in chunk_rows})
+        orphans = (set(note_ids) | {row[1] for row in chunk_rows}) - set(notes)
+        if orphans:
+            NoteEmbedding.objects.filter(note_id__in=orphans).delete()
+            NoteChunk.delete_for_notes(orphans)
+
+        note_items = [(note_id, notes[note_id], notes[note_id].text) for note_id in note_ids if note_id in notes]
+        chunk_items = [
+            (chunk_id, notes[note_id], notes[note_id].text[start:end])
+            for chunk_id, note_id, start, end in chunk_rows if note_id in notes
+        ]
+        vectors = NoteEmbedding.get_embeddings(
+            [text for _, _, text in note_items + chunk_items], self.model_name
+        )
+
+        rows = [
+            [rowid, note.user_id, note.list_id, note.archived, serialize_vector(vector)]
+            for (rowid, note, _), vector in zip(note_items + chunk_items, vectors)
+        ]
+        with get_embedding_db().writer() as db:
+            insert_vectors(
+                db, shadow_table_name(NOTE_VECTOR_TABLE), rows[:len(note_items)], settings.EMBEDDING_QUANTIZATION
+            )
+            insert_vectors(
+                db, shadow_table_name(CHUNK_VECTOR_TABLE), rows[len(note_items):], settings.EMBEDDING_QUANTIZATION
+            )
+            return sum(self.missing_counts(db))
+
+    def swap(self):
+        """
+        Replace the live vector tables with the shadow tables if the shadow covers everything.
+
+        vec0 tables cannot be renamed, so the live tables are recreated at
+        the new dimensions and filled from the shadow tables inside one
+        write transaction; readers keep seeing the old tables until it
+        commits. Returns False if notes were re-embedded in the meantime.
+        """
+        with get_embedding_db().writer() as db:
+            if sum(self.missing_counts(db)):
+                return False
+
+            for table, metadata_for_rowids in (
+                (NOTE_VECTOR_TABLE, LocalMessage.vector_metadata),
+                (CHUNK_VECTOR_TABLE, NoteChunk.vector_metadata),
+            ):
+                db.execute(f"DROP TABLE {table}")
+                db.execute(vector_table_sql(table, self.dimensions, settings.EMBEDDING_QUANTIZATION))
+                copy_vectors(
+                    db, shadow_table_name(table), table, metadata_for_rowids, settings.EMBEDDING_QUANTIZATION
+                )
+                db.execute(f"DROP TABLE {shadow_table_name(table)}")
+
+            # Centroids are in the old model's space; the IVF index stays untrained until the next training run
+            db.execute(f"DROP TABLE IF EXISTS {ivf.CENTROID_TABLE}")
+            db.execute(f"DROP TABLE IF EXISTS {ivf.LIST_TABLE}")
+            ivf.ensure_ivf_tables(db, self.dimensions)
+
+            db.execute(
+                "UPDATE note_embeddings SET model_name = ?, model_version = ?",
+                [self.model_name, self.model_version]
+            )
+            db.execute("UPDATE embedding_index SET status = ? WHERE status = ?", [self.RETIRED, self.ACTIVE])
+            db.execute("UPDATE embedding_index SET status = ? WHERE id = ?", [self.ACTIVE, self.id])
+
+        EmbeddingIndex.objects.filter(id=self.id).update(activated_at=timezone.now())
+        self.status = self.ACTIVE
+        return True
+
+
+class NoteTopic(models.Model):
+    """A suggested topic: one k-means cluster of a user's note vectors"""
+    user_id = models.IntegerField(db_index=True)
+    label = models.CharField(max_length=255)
+    size = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'note_topics'
+        ordering = ['user_id', '-size']
+
+    @classmethod
+    def cluster_user(cls, user_id):
+        """
+        Re-cluster a user's notes from the exported embedding matrix, replacing their topics.
+
+        Users with fewer than EMBEDDING_TOPIC_MIN_NOTES embedded notes get
+        no topics. Returns the number of topics written.
+        """
+        note_ids, vectors = matrix.user_rows(settings.EMBEDDING_MATRIX_DIR, user_id)
+        if len(note_ids) < settings.EMBEDDING_TOPIC_MIN_NOTES:
+            cls.objects.filter(user_id=user_id).delete()
+            return 0
+
+        k = topics.cluster_count(len(note_ids), settings.EMBEDDING_TOPIC_MAX_CLUSTERS)
+        labels, distances = topics.assign_clusters(vectors, k, seed=user_id)
+        texts = dict(LocalMessage.objects.filter(id__in=note_ids.tolist()).values_list('id', 'text'))
+        names = topics.label_clusters([texts.get(note_id, '') for note_id in note_ids.tolist()], labels.tolist())
+
+        with transaction.atomic(using='embeddings'):
+            cls.objects.filter(user_id=user_id).delete()
+            created = {
+                label: cls.objects.create(user_id=user_id, label=names[label], size=int((labels == label).sum()))
+                for label in sorted(set(labels.tolist()))
+            }
+            NoteTopicMember.objects.bulk_create([
+                NoteTopicMember(topic=created[label], note_id=note_id, distance=float(distance))
+                for note_id, label, distance in zip(note_ids.tolist(), labels.tolist(), distances.tolist())
+            ])
+        return len(created)
+
+
+class NoteTopicMember(models.Model):
+    topic = models.ForeignKey(NoteTopic, on_delete=models.CASCADE, related_name='members')
+    note_id = models.IntegerField(db_index=True)
+    distance = models.FloatField()
+
+    class Meta:
+        db_table = 'note_topic_members'
+        ordering = ['topic', 'distance']
+
+
+class NoteMapBasis(models.Model):
+    """
+    Per-user PCA basis of the 2D semantic note map.
+
+    build_for_user() fits it offline over the exported embedding matrix;
+    notes embedded afterwards are projected onto the saved basis as they
+    are written, so the map only moves when the basis is rebuilt.
+    """
+    CACHE_KEY = 'note_map:{user_id}'
+
+    user_id = models.IntegerField(unique=True)
+    mean = models.BinaryField()
+    components = models.BinaryField()
+    note_count = models.IntegerField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'note_map_bases'
+
+    @classmethod
+    def build_for_user(cls, user_id):
+        """Fit a fresh basis to the user's exported vectors and re-project every note, returning the note count"""
+        note_ids, vectors = matrix.user_rows(settings.EMBEDDING_MATRIX_DIR, user_id)
+        if len(note_ids) < 2:
+            with transaction.atomic(using='embeddings'):
+                cls.objects.filter(user_id=user_id).delete()
+                NoteMapPoint.objects.filter(user_id=user_id).delete()
+            cls.invalidate(user_id)
+            return 0
+
+        mean, components = projection.pca_basis(vectors)
+        coordinates = projection.project(vectors, mean, components)
+        with transaction.atomic(using='embeddings'):
+            cls.objects.update_or_create(user_id=user_id, defaults={
+                'mean': projection.to_bytes(mean),
+                'components': projection.to_bytes(components),
+                'note_count': len(note_ids),
+                'created_at': timezone.now(),
+            })
+            NoteMapPoint.objects.filter(user_id=user_id).delete()
+            NoteMapPoint.objects.bulk_create([
+                NoteMapPoint(note_id=note_id, user_id=user_id, x=float(x), y=float(y))
+                for note_id, (x, y) in zip(note_ids.tolist(), coordinates.tolist())
+            ], batch_size=1000)
+        cls.invalidate(user_id)
+        return len(note_ids)
+
+    @classmethod
+    def place_notes(cls, notes, vectors):
+        """Project freshly embedded notes onto their owners' saved bases; users without one wait for the next build"""
+        bases = {basis.user_id: basis for basis in cls.objects.filter(user_id__in={note.user_id for note in notes})}
+        points = []
+        for basis in bases.values():
+            owned = [(note, vector) for note, vector in zip(notes, vectors) if note.user_id == basis.user_id]
+            coordinates = projection.project(
+                [vector for _, vector in owned],
+                projection.from_bytes(basis.mean),
+                projection.from_bytes(basis.components, (projection.MAP_DIMENSIONS, -1)),
+            )
+            points.extend(
+                NoteMapPoint(note_id=note.id, user_id=note.user_id, x=float(x), y=float(y))
+                for (note, _), (x, y) in zip(owned, coordinates.tolist())
+            )
+        if not points:
+            return
+        with transaction.atomic(using='embeddings'):
+            NoteMapPoint.objects.filter(note_id__in=[point.note_id for point in points]).delete()
+            NoteMapPoint.objects.bulk_create(points)
+        for user_id in bases:
+            cls.invalidate(user_id)
+
+    @classmethod
+    def invalidate(cls, user_id):
+        cache.delete(cls.CACHE_KEY.format(user_id=user_id))
+
+    @classmethod
+    def map_for_user(cls, user_id):
+        """The user's map points, served from the cache and rebuilt from NoteMapPoint rows on a miss"""
+        key = cls.CACHE_KEY.format(user_id=user_id)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        basis = cls.objects.filter(user_id=user_id).first()
+        result = {
+            'points': [
+                {'id': note_id, 'x': round(x, 4), 'y': round(y, 4)}
+                for note_id, x, y in NoteMapPoint.objects.filter(user_id=user_id).values_list('note_id', 'x', 'y')
+            ],
+            'built_at': basis.created_at if basis else None,
+        }
+        cache.set(key, result, settings.NOTE_MAP_CACHE_SECONDS)
+        return result
+
+
+class NoteMapPoint(models.Model):
+    note_id = models.IntegerField(unique=True)
+    user_id = models.IntegerField(db_index=True)
+    x = models.FloatField()
+    y = models.FloatField()
+
+    class Meta:
+        db_table = 'note_map_points'
+
+    @classmethod
+    def delete_for_notes(cls, note_ids):
+        user_ids = set(cls.objects.filter(note_id__in=note_ids).values_list('user_id', flat=True))
+        cls.objects.filter(note_id__in=note_ids).delete()
+        for user_id in user_ids:
+            NoteMapBasis.invalidate(user_id)
+
+
+class NoteSignature(models.Model):
+    """MinHash signature of a note's text, with its LSH band buckets in NoteSignatureBucket"""
+    note = models.OneToOneField(LocalMessage, on_delete=models.CASCADE, primary_key=True, related_name='signature')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    signature = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'note_signatures'
+
+    @classmethod
+    def index_notes(cls, notes):
+        """Store signatures and buckets for notes, returning {note_id: signature} for those with any words"""
+        signatures = {}
+        for note in notes:
+            sig = minhash.signature(note.text, settings.DUPLICATE_MINHASH_PERMUTATIONS)
+            if sig is not None:
+                signatures[note.id] = sig
+        note_ids = [note.id for note in notes]
+
+        with transaction.atomic():
+            NoteSignatureBucket.objects.filter(note_id__in=note_ids).delete()
+            cls.objects.filter(note_id__in=note_ids).delete()
+            cls.objects.bulk_create([
+                cls(note_id=note.id, user_id=note.user_id, signature=minhash.to_bytes(signatures[note.id]))
+                for note in notes if note.id in signatures
+            ])
+            NoteSignatureBucket.objects.bulk_create([
+                NoteSignatureBucket(note_id=note.id, user_id=note.user_id, bucket=bucket)
+                for note in notes if note.id in signatures
+                for bucket in minhash.band_buckets(signatures[note.id], settings.DUPLICATE_LSH_BANDS)
+            ])
+        return signatures
+
+    @classmethod
+    def update_for_note(cls, note):
+        """Re-index a saved note and return the ids of its likely duplicates, most similar first"""
+        sig = cls.index_notes([note]).get(note.id)
+        if sig is None:
+            return []
+
+        buckets = minhash.band_buckets(sig, settings.DUPLICATE_LSH_BANDS)
+        candidate_ids = set(NoteSignatureBucket.objects.filter(
+            user_id=note.user_id, bucket__in=buckets
+        ).exclude(note_id=note.id).values_list('note_id', flat=True))
+        scored = [
+            (minhash.similarity(sig, minhash.from_bytes(blob)), note_id)
+            for note_id, blob in cls.objects.filter(note_id__in=candidate_ids).values_list('note_id', 'signature')
+        ]
+        return [note_id for score, note_id in sorted(scored, reverse=True)
+                if score >= settings.DUPLICATE_SIMILARITY_THRESHOLD]
+
+    @classmethod
+    def duplicate_clusters(cls, user_id):
+        """Clusters of likely duplicate notes across a user's whole corpus, largest first"""
+        signatures = {
+            note_id: minhash.from_bytes(blob)
+            for note_id, blob in cls.objects.filter(user_id=user_id).values_list('note_id', 'signature')
+        }
+        buckets = NoteSignatureBucket.objects.filter(user_id=user_id).values_list('bucket', 'note_id')
+        return minhash.clusters(buckets.iterator(), signatures, settings.DUPLICATE_SIMILARITY_THRESHOLD)
+
+
+class NoteSignatureBucket(models.Model):
+    """One LSH band bucket of a note's MinHash signature"""
+    note = models.ForeignKey(LocalMessage, on_delete=models.CASCADE, related_name='signature_buckets')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        db_table = 'note_signature_buckets'
+        indexes = [models.Index(fields=['user', 'bucket'])]
+
+
+class SearchTerm(models.Model):
+    """
+    A user's search vocabulary: each word and #hashtag with the number of notes containing it.
+
+    Kept current on every note save and delete by the signals in
+    note.signals, which apply only the terms that changed; rebuild()
+    recounts from the notes. complete() serves search-as-you-type from an
+    index scan over the user's terms.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    term = models.CharField(max_length=vocabulary.MAX_TERM_LENGTH + 1)
+    note_count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'note_search_terms'
+        constraints = [models.UniqueConstraint(fields=['user', 'term'], name='note_search_term_unique')]
+
+    @classmethod
+    def apply_change(cls, user_id, old_text, new_text):
+        """Count the terms a note gained and uncount those it lost between two versions of its text"""
+        old_terms, new_terms = vocabulary.note_terms(old_text), vocabulary.note_terms(new_text)
+        added, removed = new_terms - old_terms, old_terms - new_terms
+        if not added and not removed:
+            return
+        # All or none of the counts change, so a failure part way cannot leave the vocabulary off by one
+        with transaction.atomic():
+            if added:
+                cls.objects.bulk_create(
+                    [cls(user_id=user_id, term=term, note_count=0) for term in added], ignore_conflicts=True
+                )
+                cls.objects.filter(user_id=user_id, term__in=added).update(note_count=models.F('note_count') + 1)
+            if removed:
+                terms = cls.objects.filter(user_id=user_id, term__in=removed)
+                terms.update(note_count=models.F('note_count') - 1)
+                terms.filter(note_count__lte=0).delete()
+
+    @classmethod
+    def rebuild(cls, user_id=None, batch_size=1000):
+        """Recount the vocabulary from the notes; returns the number of terms stored"""
+        notes = LocalMessage.objects.all()
+        if user_id is not None:
+            notes = notes.filter(user_id=user_id)
+        user_ids = notes.values_list('user_id', flat=True).distinct()
+
+        stored = 0
+        for user in user_ids:
+            counts = {}
+            for text in notes.filter(user_id=user).values_list('text', flat=True).iterator(chunk_size=batch_size):
+                for term in vocabulary.note_terms(text):
+                    counts[term] = counts.get(term, 0) + 1
+            with transaction.atomic():
+                cls.objects.filter(user_id=user).delete()
+                cls.objects.bulk_create(
+                    [cls(user_id=user, term=term, note_count=count) for term, count in counts.items()],
+                    batch_size=batch_size
+                )
+            stored += len(counts)
+        if user_id is not None and not user_ids:
+            cls.objects.filter(user_id=user_id).delete()
+        return stored
+
+    @classmethod
+    def complete(cls, user_id, prefix, limit=10):
+        """The user's terms starting with prefix, in the most notes first"""
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+        terms = cls.objects.filter(user_id=user_id)
+        if connections[router.db_for_read(cls)].vendor == 'sqlite':
+            # A range on the unique (user, term) index instead of LIKE, which SQLite cannot serve from it.
+            # SQLite compares bytes, so the range holds exactly the terms starting with prefix
+            terms = terms.filter(term__gte=prefix, term__lt=vocabulary.prefix_upper_bound(prefix))
+        else:
+            # Linguistic collations skip punctuation such as '#', so a range would mix words and hashtags;
+            # LIKE 'prefix%' is served by the text_pattern_ops index from migration 0042
+            terms = terms.filter(term__startswith=prefix)
+        return list(terms.order_by('-note_count', 'term').values_list('term', 'note_count')[:limit])
+
+
 class Reminder(models.Model):
     FREQUENCY_CHOICES = [
         ('once', 'Once'),
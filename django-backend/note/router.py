@@ -25,13 +25,20 @@ class EmbeddingRouter:
     """
     Router to send all embedding-related operations to a separate database
     """
+    embedding_tables = {'note_embeddings', 'note_chunks', 'embedding_cache', 'note_neighbors',
+                        'embedding_index', 'note_topics', 'note_topic_members',
+                        'note_map_bases', 'note_map_points'}
+    embedding_models = {'noteembedding', 'notechunk', 'embeddingcacheentry', 'noteneighbor',
+                        'embeddingindex', 'notetopic', 'notetopicmember',
+                        'notemapbasis', 'notemappoint'}
+
     def db_for_read(self, model, **hints):
-        if model._meta.db_table == 'note_embeddings' or model._meta.db_table == 'note_chunks':
+        if model._meta.db_table in self.embedding_tables:
             return 'embeddings'
         return None
 
     def db_for_write(self, model, **hints):
-        if model._meta.db_table == 'note_embeddings' or model._meta.db_table == 'note_chunks':
+        if model._meta.db_table in self.embedding_tables:
             return 'embeddings'
         return None
 
@@ -39,6 +46,6 @@ class EmbeddingRouter:
         return True
 
     def allow_migrate(self, db, app_label, model_name=None, **hints):
-        if model_name == 'noteembedding':
+        if model_name in self.embedding_models:
             return db == 'embeddings'
         return None
\ No newline at end of file
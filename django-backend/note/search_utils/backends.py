@@ -0,0 +1,316 @@
+import re
+import threading
+from datetime import datetime, time
+from functools import reduce
+from operator import and_, or_
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import BooleanField, Exists, OuterRef, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from ..models import LocalMessage
+from .query_parser import And, Filter, Not, Or, Tag, Text, combine, conjuncts, is_pure_text, positive_texts
+from .snippets import END_MARK, START_MARK
+
+FTS_TABLE = 'note_fts'
+ORDER_CREATED = 'created_at'
+ORDER_RANK = 'rank'
+# to_tsquery treats underscores as separators, so they are left out of the words it is given
+TSQUERY_WORD_RE = re.compile(r'[^\W_]+')
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def filter_condition(node):
+    """The Q for a field filter; every one maps to an indexed column or an indexed join"""
+    if node.field == 'list':
+        return Q(list__slug__in=node.value)
+    if node.field == 'has':
+        return Q(Exists(LocalMessage.files.through.objects.filter(localmessage_id=OuterRef('pk'))))
+    if node.field == 'is':
+        return Q(archived=True)
+    if node.field == 'before':
+        return Q(created_at__lt=_day_start(node.value))
+    return Q(created_at__gte=_day_start(node.value))
+
+
+class SearchBackend:
+    """
+    Text matching for note search.
+
+    search() takes a parse_query() tree and compiles it into a single
+    query on a LocalMessage queryset. Top-level ANDed text goes to
+    match(), which uses the backend's index and can rank; filters and any
+    text mixed into them under OR or NOT become WHERE conditions, with
+    the text parts still answered by the index through text_condition().
+    Results are newest first, or by relevance for ORDER_RANK where the
+    backend can rank. With snippets=True, backends whose index can
+    summarise a hit add a 'snippet' column with START_MARK/END_MARK
+    around each match.
+    """
+    supports_rank = False
+
+    def can_match(self, node):
+        """Whether text_condition()/match() can evaluate this pure-text tree through the index"""
+        return True
+
+    def text_condition(self, node):
+        raise NotImplementedError
+
+    def match(self, queryset, node, order, snippets=False):
+        raise NotImplementedError
+
+    def condition(self, node):
+        if is_pure_text(node) and self.can_match(node):
+            return self.text_condition(node)
+        if isinstance(node, Text):
+            return Q(text__icontains=node.raw)
+        if isinstance(node, Tag):
+            return self.tag_condition(node)
+        if isinstance(node, Filter):
+            return filter_condition(node)
+        if isinstance(node, Not):
+            return ~self.condition(node.child)
+        operator = and_ if isinstance(node, And) else or_
+        return reduce(operator, (self.condition(child) for child in node.children))
+
+    def tag_condition(self, node):
+        hashtag = Q(text__iregex=rf'(^|\s)#{node.name}(\W|$)')
+        word = Text(node.name, prefix=False)
+        # The index narrows to notes with the word; the regex then only runs on those
+        return self.condition(word) & hashtag if self.can_match(word) else hashtag
+
+    def search(self, queryset, node, order=ORDER_CREATED, snippets=False):
+        positive, negative, where = [], [], Q()
+        for conjunct in conjuncts(node):
+            if isinstance(conjunct, Not) and is_pure_text(conjunct.child) and self.can_match(conjunct.child):
+                negative.append(conjunct)
+            elif is_pure_text(conjunct) and self.can_match(conjunct):
+                positive.append(conjunct)
+            else:
+                where &= self.condition(conjunct)
+
+        if not positive:
+            for conjunct in negative:
+                where &= self.condition(conjunct)
+            return queryset.filter(where).order_by('-created_at')
+        return self.match(queryset.filter(where), combine(And, positive + negative), order, snippets)
+
+
+class SubstringBackend(SearchBackend):
+    """Case-insensitive substring matching; needs no index but scans every note"""
+
+    def text_condition(self, node):
+        if isinstance(node, Text):
+            return Q(text__icontains=node.raw)
+        if isinstance(node, Not):
+            return ~self.text_condition(node.child)
+        operator = and_ if isinstance(node, And) else or_
+        return reduce(operator, (self.text_condition(child) for child in node.children))
+
+    def match(self, queryset, node, order, snippets=False):
+        return queryset.filter(self.text_condition(node)).order_by('-created_at')
+
+
+class Fts5Backend(SearchBackend):
+    """
+    SQLite FTS5 index over LocalMessage.text, ranked with bm25.
+
+    note_fts is an external-content table kept in sync by triggers on
+    note_localmessage (migration 0038). Terms match words starting with
+    them, so 'meet' finds 'meeting', and quoted phrases match exactly;
+    unlike the substring backend nothing matches inside words.
+    """
+    supports_rank = True
+
+    def can_match(self, node):
+        # FTS5's NOT is binary ('a NOT b'), so a negation needs a positive term beside it in an AND
+        if isinstance(node, Text):
+            return bool(node.words)
+        if isinstance(node, Or):
+            return all(not isinstance(child, Not) and self.can_match(child) for child in node.children)
+        if isinstance(node, And):
+            return any(not isinstance(child, Not) for child in node.children) and all(
+                self.can_match(child.child if isinstance(child, Not) else child) for child in node.children
+            )
+        return False
+
+    def match_expression(self, node):
+        """The FTS5 MATCH string for a tree can_match() accepts"""
+        if isinstance(node, Text):
+            return '"' + ' '.join(node.words) + '"' + ('*' if node.prefix else '')
+        if isinstance(node, Or):
+            return ' OR '.join(f'({self.match_expression(child)})' for child in node.children)
+        positive = [child for child in node.children if not isinstance(child, Not)]
+        expression = ' AND '.join(f'({self.match_expression(child)})' for child in positive)
+        for child in node.children:
+            if isinstance(child, Not):
+                expression = f'({expression}) NOT ({self.match_expression(child.child)})'
+        return expression
+
+    def text_condition(self, node):
+        return Q(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [self.match_expression(node)]
+        ))
+
+    def match(self, queryset, node, order, snippets=False):
+        select = {'rank': f'bm25({FTS_TABLE})'}
+        if snippets:
+            select['snippet'] = (
+                f"snippet({FTS_TABLE}, 0, char({ord(START_MARK)}), char({ord(END_MARK)}), '…', "
+                f"{settings.SEARCH_SNIPPET_WORDS})"
+            )
+        queryset = queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = note_localmessage.id', f'{FTS_TABLE} MATCH %s'],
+            params=[self.match_expression(node)],
+            select=select,
+        )
+        if order == ORDER_RANK:
+            return queryset.order_by('rank', '-created_at')
+        return queryset.order_by('-created_at')
+
+
+class PostgresBackend(SearchBackend):
+    """
+    PostgreSQL full-text search with trigram fallback.
+
+    Migration 0039 adds note_localmessage.search_vector, a tsvector
+    column kept current by a trigger and GIN indexed, and a pg_trgm GIN
+    index on text.
+    A term matches notes whose words start with it, notes containing it
+    as a substring (both through the trigram index, as icontains did)
+    or, for terms of TRIGRAM_MIN_LENGTH or more, notes with a word close
+    to it so typos still match; negated terms skip that fuzzy match.
+    Quoted phrases only match exactly.
+    Relevance is ts_rank_cd plus the best word similarity.
+    """
+    supports_rank = True
+    TEXT_CONFIG = 'simple'
+    TRIGRAM_MIN_LENGTH = 3
+
+    @staticmethod
+    def tsquery_expression(node):
+        """A to_tsquery string matching the Text's words in order, or None without words"""
+        tokens = TSQUERY_WORD_RE.findall(node.raw.lower())
+        if not tokens:
+            return None
+        suffix = ':*' if node.prefix else ''
+        return ' <-> '.join(f"{token}{suffix}" for token in tokens)
+
+    @staticmethod
+    def _like_pattern(term):
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f'%{escaped}%'
+
+    def _text_clause(self, node, fuzzy=True):
+        clauses, params = [], []
+        tsquery = self.tsquery_expression(node)
+        if tsquery:
+            clauses.append(f"note_localmessage.search_vector @@ to_tsquery('{self.TEXT_CONFIG}', %s)")
+            params.append(tsquery)
+        clauses.append("note_localmessage.text ILIKE %s")
+        params.append(self._like_pattern(node.raw))
+        if fuzzy and node.prefix and len(node.raw) >= self.TRIGRAM_MIN_LENGTH:
+            clauses.append("%s <%% note_localmessage.text")
+            params.append(node.raw)
+        return '(' + ' OR '.join(clauses) + ')', params
+
+    def _sql(self, node, negated=False):
+        if isinstance(node, Text):
+            # A negated term only excludes notes that contain it, not every note with a similar word
+            return self._text_clause(node, fuzzy=not negated)
+        if isinstance(node, Not):
+            sql, params = self._sql(node.child, not negated)
+            return f'NOT {sql}', params
+        joiner = ' AND ' if isinstance(node, And) else ' OR '
+        parts = [self._sql(child, negated) for child in node.children]
+        return '(' + joiner.join(sql for sql, _ in parts) + ')', [param for _, params in parts for param in params]
+
+    def text_condition(self, node):
+        sql, params = self._sql(node)
+        return Q(RawSQL(sql, params, output_field=BooleanField()))
+
+    def _rank_expression(self, node):
+        parts, params = [], []
+        for item in positive_texts(node):
+            tsquery = self.tsquery_expression(item)
+            if tsquery:
+                parts.append(
+                    f"ts_rank_cd(note_localmessage.search_vector, to_tsquery('{self.TEXT_CONFIG}', %s))"
+                )
+                params.append(tsquery)
+            parts.append("word_similarity(%s, note_localmessage.text)")
+            params.append(item.raw)
+        return ' + '.join(parts), params
+
+    def _headline_expression(self, node):
+        tsqueries = [query for query in map(self.tsquery_expression, positive_texts(node)) if query]
+        if not tsqueries:
+            return None, []
+        options = (
+            f'StartSel={START_MARK}, StopSel={END_MARK}, MaxFragments=1, '
+            f'MaxWords={settings.SEARCH_SNIPPET_WORDS}, MinWords={settings.SEARCH_SNIPPET_WORDS // 2}'
+        )
+        expression = (
+            f"ts_headline('{self.TEXT_CONFIG}', note_localmessage.text, to_tsquery('{self.TEXT_CONFIG}', %s), %s)"
+        )
+        return expression, [' | '.join(f'({query})' for query in tsqueries), options]
+
+    def match(self, queryset, node, order, snippets=False):
+        queryset = queryset.filter(self.text_condition(node))
+        select, params = {}, []
+        if order == ORDER_RANK:
+            rank, rank_params = self._rank_expression(node)
+            select['rank'] = rank
+            params.extend(rank_params)
+        if snippets:
+            # ts_headline re-parses the text; PostgreSQL defers costly output columns past the LIMIT
+            headline, headline_params = self._headline_expression(node)
+            if headline:
+                select['snippet'] = headline
+                params.extend(headline_params)
+        if select:
+            queryset = queryset.extra(select=select, select_params=params)
+        if order != ORDER_RANK:
+            return queryset.order_by('-created_at')
+        return queryset.order_by('-rank', '-created_at')
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def fts5_available(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def postgres_search_available(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = 'note_localmessage' "
+            "AND column_name = 'search_vector'"
+        )
+        return cursor.fetchone() is not None
+
+
+def get_search_backend(using='default'):
+    """The indexed backend for the database's engine, falling back to substring matching"""
+    backend = _backends.get(using)
+    if backend is None:
+        with _backends_lock:
+            connection = connections[using]
+            if connection.vendor == 'sqlite' and fts5_available(connection):
+                backend = Fts5Backend()
+            elif connection.vendor == 'postgresql' and postgres_search_available(connection):
+                backend = PostgresBackend()
+            else:
+                backend = SubstringBackend()
+            _backends[using] = backend
+    return backend
@@ -0,0 +1,51 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from ..models import NoteEmbedding
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='hybrid-search')
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Merge ranked id lists, scoring each id by the sum of 1 / (k + rank) over the lists it appears in"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0) + 1 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def semantic_note_ids(query, user_id, list_ids=None, archived=None, note_ids=None, limit=100):
+    """Ids of the notes nearest to the query text, with the filters applied inside the vec0 scan"""
+    try:
+        embedding = NoteEmbedding.get_embedding(query)
+        results = NoteEmbedding.find_similar_notes_by_embedding(
+            embedding, limit=limit, user_id=user_id,
+            list_ids=list_ids, archived=archived, note_ids=note_ids
+        )
+        return [result['note_id'] for result in results if result['distance'] <= settings.SEARCH_HYBRID_MAX_DISTANCE]
+    except Exception as e:
+        logger.error(f"Semantic half of hybrid search failed, using lexical results only: {e}")
+        return []
+    finally:
+        # Runs on a pool thread, which would otherwise keep its own DB connections open
+        connections.close_all()
+
+
+def hybrid_search(lexical_queryset, query, user_id, list_ids=None, archived=None, note_ids=None):
+    """
+    Run a lexical and a KNN query in parallel and fuse them with reciprocal rank fusion.
+
+    lexical_queryset must already carry the text, list, archived and
+    has_files filters; the same filters are passed to the KNN query as
+    list_ids/archived/note_ids. Returns fused note ids, best first.
+    """
+    limit = settings.SEARCH_HYBRID_CANDIDATES
+    semantic = _executor.submit(semantic_note_ids, query, user_id, list_ids, archived, note_ids, limit)
+    lexical = list(lexical_queryset.values_list('id', flat=True)[:limit])
+    return reciprocal_rank_fusion([lexical, semantic.result()], k=settings.SEARCH_RRF_K)
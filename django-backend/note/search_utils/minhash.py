@@ -0,0 +1,104 @@
+import functools
+import hashlib
+
+import numpy as np
+
+from ..text_utils import TOKEN_RE
+
+MERSENNE_PRIME = (1 << 61) - 1
+SHINGLE_SIZE = 3
+
+
+def shingles(text):
+    """Lowercase word 3-grams of a text; shorter texts are a single shingle of all their words"""
+    tokens = TOKEN_RE.findall(text.lower())
+    if len(tokens) < SHINGLE_SIZE:
+        return {' '.join(tokens)} if tokens else set()
+    return {' '.join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+@functools.lru_cache(maxsize=4)
+def _permutations(num_perm, seed=1):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+    return a, b
+
+
+def signature(text, num_perm):
+    """
+    MinHash signature of a text's shingles as a uint32 array, or None for text without words.
+
+    Each of the num_perm universal hashes (a * x + b) mod p is applied to
+    32-bit shingle hashes at once; a, x and b are below 2**32, so the
+    products fit in uint64 without overflowing.
+    """
+    text_shingles = shingles(text)
+    if not text_shingles:
+        return None
+    hashes = np.array([
+        int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little')
+        for shingle in text_shingles
+    ], dtype=np.uint64)
+    a, b = _permutations(num_perm)
+    values = (np.outer(hashes, a) + b) % np.uint64(MERSENNE_PRIME)
+    return values.min(axis=0).astype(np.uint32)
+
+
+def band_buckets(sig, bands):
+    """One signed 64-bit bucket key per LSH band; notes sharing any bucket are duplicate candidates"""
+    rows = len(sig) // bands
+    return [
+        int.from_bytes(
+            hashlib.blake2b(bytes([band]) + sig[band * rows:(band + 1) * rows].tobytes(), digest_size=8).digest(),
+            'little', signed=True
+        )
+        for band in range(bands)
+    ]
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity: the share of positions where two signatures agree"""
+    return float(np.mean(sig_a == sig_b))
+
+
+def to_bytes(sig):
+    return sig.tobytes()
+
+
+def from_bytes(blob):
+    return np.frombuffer(bytes(blob), dtype=np.uint32)
+
+
+def clusters(buckets, signatures, threshold):
+    """
+    Group ids into duplicate clusters from (bucket, id) pairs and {id: signature}.
+
+    Within each bucket, members are checked against its first member
+    only, so a bucket costs linear time however many notes share it; the
+    other bands give missed pairs more chances. Clusters are joined with
+    union-find and returned largest first.
+    """
+    parent = {}
+
+    def find(item):
+        parent.setdefault(item, item)
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    members_by_bucket = {}
+    for bucket, item in buckets:
+        members_by_bucket.setdefault(bucket, []).append(item)
+
+    for members in members_by_bucket.values():
+        first = members[0]
+        for other in members[1:]:
+            if find(first) != find(other) and similarity(signatures[first], signatures[other]) >= threshold:
+                parent[find(other)] = find(first)
+
+    groups = {}
+    for item in parent:
+        groups.setdefault(find(item), []).append(item)
+    return sorted((sorted(group) for group in groups.values() if len(group) > 1), key=lambda group: (-len(group), group[0]))
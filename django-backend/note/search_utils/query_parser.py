@@ -0,0 +1,286 @@
+import re
+from datetime import date
+
+from ..text_utils import TOKEN_RE
+
+FIELDS = {
+    'list': None,
+    'has': {'file', 'files'},
+    'is': {'archived'},
+    'before': None,
+    'after': None,
+}
+OPERATORS = {'and', 'or', 'not'}
+TOKEN_PATTERN = re.compile(r'\s*(?:(?P<paren>[()])|"(?P<phrase>[^"]*)"?|(?P<word>[^\s()"]+))')
+FIELD_PATTERN = re.compile(r'^(?P<field>[a-z]+):(?P<value>.+)$', re.IGNORECASE)
+TAG_PATTERN = re.compile(r'^#(\w+)$')
+
+
+class QuerySyntaxError(ValueError):
+    """A query that cannot be searched, such as a field filter with an invalid value"""
+
+
+class Text:
+    """Words matched in order; a bare term also matches words starting with it, a quoted phrase does not"""
+
+    def __init__(self, raw, prefix=True):
+        self.raw = raw
+        self.words = TOKEN_RE.findall(raw.lower())
+        self.prefix = prefix
+
+    def __repr__(self):
+        return f"Text({self.raw!r}{'*' if self.prefix else ''})"
+
+
+class Tag:
+    def __init__(self, name):
+        self.name = name.lower()
+
+    def __repr__(self):
+        return f"Tag({self.name!r})"
+
+
+class Filter:
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def __repr__(self):
+        return f"Filter({self.field}:{self.value})"
+
+
+class Not:
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return f"Not({self.child!r})"
+
+
+class And:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return f"And({self.children!r})"
+
+
+class Or:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return f"Or({self.children!r})"
+
+
+def _parse_date(field, value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise QuerySyntaxError(f"{field}: expects a YYYY-MM-DD date, got '{value}'")
+
+
+def _leaf(word):
+    """A single unquoted word: a #tag, a field filter or a search term"""
+    tag = TAG_PATTERN.match(word)
+    if tag:
+        return Tag(tag.group(1))
+
+    match = FIELD_PATTERN.match(word)
+    if match and match.group('field').lower() in FIELDS:
+        field, value = match.group('field').lower(), match.group('value')
+        allowed = FIELDS[field]
+        if field in ('before', 'after'):
+            return Filter(field, _parse_date(field, value))
+        if field == 'list':
+            return Filter(field, [slug for slug in value.split(',') if slug])
+        if value.lower() not in allowed:
+            raise QuerySyntaxError(f"{field}: expects one of {', '.join(sorted(allowed))}, got '{value}'")
+        return Filter(field, value.lower())
+
+    return Text(word)
+
+
+def tokenize(query):
+    """Split a query into ('(' | ')' | 'op' | 'not' | 'phrase' | 'word', value) tokens"""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(query):
+        if match.group('paren'):
+            tokens.append((match.group('paren'), None))
+        elif match.group('phrase') is not None:
+            tokens.append(('phrase', match.group('phrase')))
+        elif match.group('word'):
+            word = match.group('word')
+            if word == '-':
+                # '-' negates a phrase or group written right after it; on its own it is ignored
+                if query[match.end():match.end() + 1] in ('"', '('):
+                    tokens.append(('not', '-'))
+                continue
+            if word.lower() in OPERATORS:
+                tokens.append(('not' if word.lower() == 'not' else 'op', word.lower()))
+            elif word.startswith('-') and len(word) > 1:
+                tokens.append(('not', '-'))
+                tokens.append(('word', word[1:]))
+            else:
+                tokens.append(('word', word))
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive descent over the tokens, loosest binding first:
+
+        or_expr  := and_expr ('or' and_expr)*
+        and_expr := unary (['and'] unary)*
+        unary    := ('not' | '-') unary | primary
+        primary  := '(' or_expr ')' | phrase | word
+
+    Unbalanced parentheses and quotes are closed at the end of the query
+    and stray operators are skipped, so a half-typed query still searches.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def advance(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        nodes = []
+        while self.position < len(self.tokens):
+            node = self.or_expr()
+            if node is not None:
+                nodes.append(node)
+            elif self.position < len(self.tokens):
+                self.advance()
+        return combine(And, nodes)
+
+    def or_expr(self):
+        children = [self.and_expr()]
+        while self.peek() == ('op', 'or'):
+            self.advance()
+            children.append(self.and_expr())
+        return combine(Or, [child for child in children if child is not None])
+
+    def and_expr(self):
+        children = []
+        while True:
+            kind, value = self.peek()
+            if kind is None or kind == ')' or (kind, value) == ('op', 'or'):
+                break
+            if (kind, value) == ('op', 'and'):
+                self.advance()
+                continue
+            node = self.unary()
+            if node is not None:
+                children.append(node)
+        return combine(And, children)
+
+    def unary(self):
+        kind, _ = self.peek()
+        if kind == 'not':
+            self.advance()
+            child = self.unary()
+            return Not(child) if child is not None else None
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.advance()
+        if kind == '(':
+            node = self.or_expr()
+            if self.peek()[0] == ')':
+                self.advance()
+            return node
+        if kind == 'phrase':
+            return Text(value, prefix=False) if value.strip() else None
+        if kind == 'word':
+            return _leaf(value)
+        return None
+
+
+def combine(node_class, children):
+    if not children:
+        return None
+    if len(children) == 1:
+        return children[0]
+    flattened = []
+    for child in children:
+        flattened.extend(child.children if isinstance(child, node_class) else [child])
+    return node_class(flattened)
+
+
+def parse_query(query):
+    """
+    Parse a search query into a tree of Text, Tag, Filter, Not, And and Or nodes.
+
+    Supports 'and'/'or'/'not' (any case) with the usual precedence,
+    parentheses, "quoted phrases", -term, #tag and the field filters
+    list:slug[,slug], has:file, is:archived, before:YYYY-MM-DD and
+    after:YYYY-MM-DD. Adjacent terms are ANDed. Returns None for an
+    empty query; raises QuerySyntaxError for an invalid filter value.
+    """
+    return _Parser(tokenize(query)).parse()
+
+
+def walk(node):
+    """Every node of the tree, parents before children"""
+    if node is None:
+        return
+    yield node
+    if isinstance(node, Not):
+        yield from walk(node.child)
+    elif isinstance(node, (And, Or)):
+        for child in node.children:
+            yield from walk(child)
+
+
+def has_filter(node, field, value=None):
+    return any(
+        isinstance(item, Filter) and item.field == field and (value is None or item.value == value)
+        for item in walk(node)
+    )
+
+
+def is_pure_text(node):
+    """True when the tree only combines Text leaves, so a text index can evaluate all of it"""
+    return all(isinstance(item, (Text, Not, And, Or)) for item in walk(node))
+
+
+def conjuncts(node):
+    if node is None:
+        return []
+    return list(node.children) if isinstance(node, And) else [node]
+
+
+def constraints(node):
+    """The top-level conjuncts other than plain text: filters, tags and negations, or None"""
+    return combine(And, [
+        conjunct for conjunct in conjuncts(node)
+        if not is_pure_text(conjunct) or isinstance(conjunct, Not)
+    ])
+
+
+def positive_texts(node):
+    """The Text leaves a matching note must or may contain, leaving out negated ones"""
+    if isinstance(node, Text):
+        return [node]
+    if isinstance(node, (And, Or)):
+        return [text for child in node.children for text in positive_texts(child)]
+    return []
+
+
+def plain_text(node):
+    """The words the query looks for, without operators, negated terms or filters"""
+    if node is None or isinstance(node, (Not, Filter)):
+        return ''
+    if isinstance(node, Text):
+        return node.raw
+    if isinstance(node, Tag):
+        return f'#{node.name}'
+    return ' '.join(part for part in (plain_text(child) for child in node.children) if part)
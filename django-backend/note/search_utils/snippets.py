@@ -0,0 +1,85 @@
+import re
+
+from .query_parser import Tag, positive_texts
+
+# The index wraps each hit in these; they never occur in typed text
+START_MARK = '\x02'
+END_MARK = '\x03'
+ELLIPSIS = '…'
+WORD_RE = re.compile(r'\w+')
+
+
+def utf16_length(text):
+    """Length in UTF-16 code units, the unit JavaScript string offsets count in"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def split_marks(marked):
+    """
+    Strip the hit markers from an index-made snippet; returns (snippet, [[start, end], ...])
+    with offsets in UTF-16 code units, so clients can slice the snippet directly.
+    """
+    parts, highlights, length, start = [], [], 0, None
+    for piece in re.split(f'([{START_MARK}{END_MARK}])', marked):
+        if piece == START_MARK:
+            start = length
+        elif piece == END_MARK:
+            if start is not None:
+                highlights.append([start, length])
+            start = None
+        else:
+            parts.append(piece)
+            length += utf16_length(piece)
+    return ''.join(parts), highlights
+
+
+def _tags(node):
+    if isinstance(node, Tag):
+        return [node]
+    return [tag for child in getattr(node, 'children', []) for tag in _tags(child)]
+
+
+def _matcher(node):
+    words = []
+    for item in positive_texts(node):
+        words.extend((word, item.prefix) for word in item.words)
+    tags = {item.name for item in _tags(node)}
+
+    def matches(word, text, start):
+        word = word.lower()
+        if word in tags and start > 0 and text[start - 1] == '#':
+            return True
+        return any(word.startswith(term) if prefix else word == term for term, prefix in words)
+    return matches
+
+
+def make_snippet(text, node, max_words):
+    """
+    Build a snippet in Python for hits the index did not summarise.
+
+    Takes max_words words around the first word the query's positive
+    terms or tags match and returns (snippet, highlights) in the same
+    shape as split_marks(); offsets count UTF-16 code units of the snippet.
+    """
+    tokens = list(WORD_RE.finditer(text))
+    if not tokens:
+        return text[:200], []
+    matches = _matcher(node) if node is not None else (lambda word, text, start: False)
+    hits = [i for i, token in enumerate(tokens) if matches(token.group(), text, token.start())]
+
+    first = max(0, hits[0] - max_words // 3) if hits else 0
+    last = min(len(tokens), first + max_words)
+    first = max(0, last - max_words)
+    start, end = tokens[first].start(), tokens[last - 1].end()
+    prefix = ELLIPSIS if first > 0 else ''
+    suffix = ELLIPSIS if last < len(tokens) else ''
+
+    highlights = []
+    for i in hits:
+        if first <= i < last:
+            hit_start = tokens[i].start()
+            if hit_start > start and text[hit_start - 1] == '#':
+                hit_start -= 1
+            offset = utf16_length(prefix + text[start:hit_start])
+            highlights.append([offset, offset + utf16_length(text[hit_start:tokens[i].end()])])
+    return prefix + text[start:end] + suffix, highlights
@@ -0,0 +1,24 @@
+import re
+
+from ..text_utils import TOKEN_RE
+
+# Same hashtag rule as the trending-hashtags view
+HASHTAG_RE = re.compile(r'(?:^|(?<=\s))#(\w+)', re.UNICODE | re.MULTILINE)
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+
+
+def note_terms(text):
+    """The distinct completable terms of a note: lowercased words and '#tag' hashtags"""
+    text = (text or '').lower()
+    terms = {
+        word for word in TOKEN_RE.findall(text)
+        if MIN_TERM_LENGTH <= len(word) <= MAX_TERM_LENGTH and not word.isdigit()
+    }
+    terms.update(f'#{tag}' for tag in HASHTAG_RE.findall(text) if len(tag) < MAX_TERM_LENGTH)
+    return terms
+
+
+def prefix_upper_bound(prefix):
+    """The smallest string greater than every string starting with prefix, for an indexed range scan"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
@@ -1,6 +1,8 @@
+from django.conf import settings
 from rest_framework import serializers
 
 from .models import LocalMessage, LocalMessageList, Link, NoteRevision, Reminder, Workspace, File, FileCollection
+from .search_utils.snippets import make_snippet, split_marks
 import re
 
 class FileSerializer(serializers.ModelSerializer):
@@ -72,8 +74,37 @@ class MessageSerializer(serializers.ModelSerializer):
 
 
 
+class SearchSnippetSerializer(serializers.ModelSerializer):
+    """
+    A search hit without its full text: a snippet around the match and the
+    [start, end) offsets of each highlighted word in it, counted in UTF-16
+    code units like JavaScript string indices.
+    """
+    list_name = serializers.CharField(source='list.name', read_only=True)
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        marked = getattr(instance, 'snippet', None)
+        if marked is not None:
+            snippet, highlights = split_marks(marked)
+        else:
+            snippet, highlights = make_snippet(
+                instance.text, self.context.get('search_query'), settings.SEARCH_SNIPPET_WORDS
+            )
+        representation['snippet'] = snippet
+        representation['highlights'] = highlights
+        return representation
+
+    class Meta:
+        model = LocalMessage
+        fields = ['id', 'list', 'list_name', 'importance', 'archived', 'created_at', 'updated_at']
+
+
 class SearchSerializer(serializers.Serializer):
-    q = serializers.CharField(required=True, help_text="Search query string")
+    q = serializers.CharField(
+        required=True,
+        help_text="Search query: terms, \"phrases\", and/or/not, -term, #tag, list:, has:file, is:archived, before:, after:"
+    )
     list_slug = serializers.CharField(
         required=False, 
         help_text="Single list slug or comma-separated list of slugs (e.g., 'list1,list2,list3')"
@@ -83,6 +114,20 @@ class SearchSerializer(serializers.Serializer):
         help_text="Workspace slug to filter search results"
     )
     has_files = serializers.BooleanField(required=False, help_text="Only return messages that contain files")
+    mode = serializers.ChoiceField(
+        choices=['text', 'hybrid'],
+        required=False,
+        help_text="'text' for full-text matching, 'hybrid' to fuse it with semantic search"
+    )
+    order = serializers.ChoiceField(
+        choices=['date', 'relevance'],
+        required=False,
+        help_text="'date' for newest first, 'relevance' for the search index's ranking"
+    )
+    snippets = serializers.BooleanField(
+        required=False,
+        help_text="Return a snippet with highlight offsets for each hit instead of the full note"
+    )
     page = serializers.IntegerField(required=False, help_text="Page number for pagination")
 
     def validate_list_slug(self, value):
@@ -204,6 +249,8 @@ class SimilarNoteSerializer(serializers.Serializer):
     similarity_score = serializers.FloatField()
     distance = serializers.FloatField()
     is_full_note = serializers.BooleanField(default=True)
+    chunk_start = serializers.IntegerField(required=False)
+    chunk_end = serializers.IntegerField(required=False)
     created_at = serializers.DateTimeField()
     updated_at = serializers.DateTimeField()
     category = serializers.DictField()
@@ -1,11 +1,15 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.db import transaction
 from django.dispatch import receiver
-from .models import LocalMessage, NoteEmbedding
+from .models import LocalMessage, NoteEmbedding, SearchTerm
 from .file_utils import FileManager
+from .tasks import enqueue_note_embedding, refresh_note_neighbors
 import threading
 import functools
 import traceback
-from django.conf import settings
+
+# Columns copied into the vec0 tables as filter metadata, under both their field and attribute names
+VECTOR_METADATA_FIELDS = {'list', 'list_id', 'archived'}
 
 def async_task(func):
     @functools.wraps(func)
@@ -15,38 +19,6 @@ def async_task(func):
         thread.start()
     return wrapper
 
-@async_task
-def create_or_update_embedding_async(note_id):
-    """
-    Asynchronously create or update embedding for a note
-    """
-    try:
-        # Get a fresh instance of the note to avoid any thread-related issues
-        note = LocalMessage.objects.get(id=note_id)
-        
-        # Check if note contains non-ASCII characters
-        if NoteEmbedding.hasRTL(note.text):
-            # If there's an existing embedding, delete it since the note now has non-ASCII
-            NoteEmbedding.objects.filter(note_id=note.id).delete()
-            return
-        
-        if settings.DEBUG:
-            return
-
-            
-        # Create or update the embedding
-        existing = NoteEmbedding.objects.filter(note_id=note.id).first()
-        if existing:
-            # If embedding exists, delete and recreate to update the vector
-            existing.delete()
-        
-        NoteEmbedding.create_for_note(note)
-            
-    except Exception as e:
-        
-        print(f"Failed to process embedding for note {note_id}: {str(e)}")
-        traceback.print_exc()
-
 @async_task
 def sync_note_files_async(note_id):
     """
@@ -63,11 +35,62 @@ def sync_note_files_async(note_id):
         traceback.print_exc()
 
 @receiver(post_save, sender=LocalMessage)
-def trigger_embedding_processing(sender, instance, created, **kwargs):
+def trigger_embedding_processing(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Signal to queue embedding creation/update for notes once the save commits
+    """
+    if update_fields is not None and 'text' not in update_fields:
+        return
+    previous = getattr(instance, '_previous_state', None)
+    if not created and previous is not None and previous['text'] == instance.text:
+        # Metadata-only saves such as archive toggles do not change what is embedded
+        return
+    note_id = instance.id
+    transaction.on_commit(lambda: enqueue_note_embedding(note_id), robust=True)
+
+@receiver(post_save, sender=LocalMessage)
+def sync_vector_metadata(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Signal to keep the list/archived filter columns of existing vectors current
+    """
+    if created or (update_fields is not None and not VECTOR_METADATA_FIELDS & set(update_fields)):
+        return
+    previous = getattr(instance, '_previous_state', None)
+    if previous is not None and (previous['list_id'], previous['archived']) == (instance.list_id, instance.archived):
+        # Text-only saves such as autosaves leave the vectors' metadata as it is
+        return
+    transaction.on_commit(lambda: NoteEmbedding.update_metadata(instance), robust=True)
+
+_deleted_notes = threading.local()
+
+
+def purge_deleted_note_vectors():
+    """
+    Remove the vectors of every note deleted in this thread's committed transactions in one batch
     """
-    Signal to trigger asynchronous embedding creation/update for notes
+    note_ids = getattr(_deleted_notes, 'ids', None)
+    if not note_ids:
+        return
+    _deleted_notes.ids = set()
+    # Ids collected by a delete that was rolled back belong to notes that still exist
+    note_ids -= set(LocalMessage.objects.filter(id__in=note_ids).values_list('id', flat=True))
+    if not note_ids:
+        return
+    holder_ids = NoteEmbedding.delete_for_notes(note_ids)
+    if holder_ids:
+        refresh_note_neighbors.delay(list(holder_ids))
+
+@receiver(post_delete, sender=LocalMessage)
+def collect_deleted_note(sender, instance, using, **kwargs):
+    """
+    Signal to drop a deleted note's vectors, also for queryset deletes and cascades from lists and users.
+    Ids are gathered per thread and purged together after the deleting transaction commits
     """
-    create_or_update_embedding_async(instance.id)
+    if not hasattr(_deleted_notes, 'ids'):
+        _deleted_notes.ids = set()
+    _deleted_notes.ids.add(instance.id)
+    # Every delete registers the purge; the first to run after commit empties the set for the rest
+    transaction.on_commit(purge_deleted_note_vectors, using=using, robust=True)
 
 @receiver(post_save, sender=LocalMessage)
 def trigger_file_sync(sender, instance, created, **kwargs):
@@ -75,4 +98,38 @@ def trigger_file_sync(sender, instance, created, **kwargs):
     Signal to trigger asynchronous file association sync for notes
     """
     if not created:
-        sync_note_files_async(instance.id)
\ No newline at end of file
+        sync_note_files_async(instance.id)
+
+@receiver(pre_save, sender=LocalMessage)
+def remember_previous_state(sender, instance, update_fields=None, **kwargs):
+    """
+    Signal to note the stored text, list and archived flag before an update, so the post_save signals
+    only act on what changed: the search vocabulary by the difference, the vector metadata when it moved
+    """
+    instance._previous_state = None
+    if update_fields is not None and not ({'text'} | VECTOR_METADATA_FIELDS) & set(update_fields):
+        # None of the tracked columns are written, so there is nothing to compare against
+        return
+    if instance.pk:
+        instance._previous_state = LocalMessage.objects.filter(pk=instance.pk).values(
+            'text', 'list_id', 'archived'
+        ).first()
+
+@receiver(post_save, sender=LocalMessage)
+def update_search_vocabulary(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Signal to count a saved note's new words and hashtags for autocomplete and uncount the ones it lost
+    """
+    if update_fields is not None and 'text' not in update_fields:
+        return
+    previous = getattr(instance, '_previous_state', None)
+    previous_text = previous['text'] if previous else ''
+    if previous_text != instance.text:
+        SearchTerm.apply_change(instance.user_id, previous_text, instance.text)
+
+@receiver(post_delete, sender=LocalMessage)
+def remove_search_vocabulary(sender, instance, **kwargs):
+    """
+    Signal to uncount a deleted note's words and hashtags
+    """
+    SearchTerm.apply_change(instance.user_id, instance.text, '')
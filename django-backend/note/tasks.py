@@ -0,0 +1,278 @@
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_JOB_KEY = 'embedding_job:{note_id}'
+# Sorted set of note ids scored by enqueue time; entries older than EMBEDDING_JOB_TTL are dropped when read
+EMBEDDING_PENDING_KEY = 'embedding_jobs:pending_since'
+EMBEDDING_JOB_TTL = 60 * 60 * 24
+EMBEDDING_REINDEX_LOCK_KEY = 'embedding_reindex:running'
+EMBEDDING_REINDEX_LOCK_TTL = 60 * 30
+NEIGHBOR_REBUILD_BATCH_SIZE = 200
+
+
+def enqueue_note_embedding(note_id, force=False, countdown=None):
+    """
+    Queue an embedding refresh for a note, coalescing repeated saves.
+
+    Each enqueue stores a fresh token for the note and schedules the task
+    after EMBEDDING_DEBOUNCE_SECONDS. Only the task carrying the latest
+    token does any work, so a burst of saves costs a single embedding.
+    force skips the change-significance check.
+    """
+    token = uuid.uuid4().hex
+    cache.set(EMBEDDING_JOB_KEY.format(note_id=note_id), token, EMBEDDING_JOB_TTL)
+    get_redis_connection('default').zadd(EMBEDDING_PENDING_KEY, {note_id: time.time()})
+    embed_note.apply_async(
+        args=[note_id, token, force],
+        countdown=settings.EMBEDDING_DEBOUNCE_SECONDS if countdown is None else countdown
+    )
+
+
+def _pending_jobs():
+    """The Redis connection, after forgetting jobs whose token expired before they finished"""
+    redis = get_redis_connection('default')
+    redis.zremrangebyscore(EMBEDDING_PENDING_KEY, '-inf', time.time() - EMBEDDING_JOB_TTL)
+    return redis
+
+
+def pending_embedding_note_ids():
+    return {int(note_id) for note_id in _pending_jobs().zrange(EMBEDDING_PENDING_KEY, 0, -1)}
+
+
+def pending_embedding_count():
+    return _pending_jobs().zcard(EMBEDDING_PENDING_KEY)
+
+
+def _is_current_job(note_id, token):
+    return cache.get(EMBEDDING_JOB_KEY.format(note_id=note_id)) == token
+
+
+def _finish_job(note_id, token):
+    if _is_current_job(note_id, token):
+        cache.delete(EMBEDDING_JOB_KEY.format(note_id=note_id))
+        get_redis_connection('default').zrem(EMBEDDING_PENDING_KEY, note_id)
+
+
+@shared_task(bind=True, max_retries=5)
+def embed_note(self, note_id, token, force=False):
+    from note.models import LocalMessage, NoteEmbedding
+
+    if not _is_current_job(note_id, token):
+        return f"Embedding job for note {note_id} superseded"
+
+    try:
+        note = LocalMessage.objects.get(id=note_id)
+    except LocalMessage.DoesNotExist:
+        _finish_job(note_id, token)
+        return f"Note {note_id} not found"
+
+    embedding = NoteEmbedding.objects.filter(note_id=note.id).first()
+    if not force and embedding is not None and not embedding.is_significant_change(note.text):
+        if embedding.embedded_text != NoteEmbedding.prepare_text(note.text):
+            # Any later save replaces this job's token, so the refresh only runs once the note has gone idle
+            enqueue_note_embedding(note.id, force=True, countdown=settings.EMBEDDING_IDLE_REFRESH_SECONDS)
+        else:
+            _finish_job(note_id, token)
+        return f"Skipped trivial edit of note {note_id}"
+
+    try:
+        if NoteEmbedding.hasRTL(note.text):
+            # RTL notes are not embedded: drop every trace of the old vector so KNN, neighbours and the map forget it
+            holder_ids = NoteEmbedding.delete_for_notes([note.id])
+            if holder_ids:
+                refresh_note_neighbors.delay(list(holder_ids))
+        else:
+            NoteEmbedding.create_for_note(note)
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            logger.error(f"Giving up on embedding for note {note_id}: {exc}")
+            _finish_job(note_id, token)
+            raise
+        countdown = settings.EMBEDDING_RETRY_BACKOFF_SECONDS * 2 ** self.request.retries
+        logger.warning(f"Embedding for note {note_id} failed, retrying in {countdown}s: {exc}")
+        raise self.retry(exc=exc, countdown=countdown)
+
+    _finish_job(note_id, token)
+    return f"Embedded note {note_id}"
+
+
+@shared_task
+def sweep_stale_embeddings():
+    """
+    Re-queue notes whose embedding is missing or stale, at a throttled rate.
+
+    Notes edited within EMBEDDING_IDLE_REFRESH_SECONDS or with a job
+    already pending are left to that job; at most
+    EMBEDDING_SWEEP_MAX_JOBS are queued per run, spaced
+    1 / EMBEDDING_SWEEP_RATE seconds apart. Notes embedded with an older
+    model are the re-index's work and are not queued here. Each user's
+    coverage summary is cached for the embedding stats endpoint.
+    """
+    from django.utils import timezone
+    from note.models import LocalMessage, NoteEmbedding
+
+    report = NoteEmbedding.freshness()
+    NoteEmbedding.cache_freshness(report)
+    pending = pending_embedding_note_ids()
+    idle_before = timezone.now() - timezone.timedelta(seconds=settings.EMBEDDING_IDLE_REFRESH_SECONDS)
+    idle_stale = set(LocalMessage.objects.filter(
+        id__in=report['stale'], updated_at__lt=idle_before
+    ).values_list('id', flat=True))
+
+    candidates = [note_id for note_id in report['missing'] + sorted(idle_stale) if note_id not in pending]
+    queued = candidates[:settings.EMBEDDING_SWEEP_MAX_JOBS]
+    for position, note_id in enumerate(queued):
+        enqueue_note_embedding(
+            note_id, force=True,
+            countdown=settings.EMBEDDING_DEBOUNCE_SECONDS + position / settings.EMBEDDING_SWEEP_RATE
+        )
+
+    if queued:
+        logger.info(
+            f"Embedding sweep queued {len(queued)} of {len(candidates)} notes "
+            f"({len(report['missing'])} missing, {len(report['stale'])} stale)"
+        )
+    return f"Queued {len(queued)} of {len(candidates)} missing or stale embeddings"
+
+
+@shared_task
+def train_ivf_index():
+    """Retrain the IVF centroids and inverted lists over all note vectors"""
+    from note.embedding_utils import ivf
+    from note.embedding_utils.connection import get_embedding_db
+    from note.embedding_utils.vector_tables import NOTE_VECTOR_TABLE
+    from note.models import EmbeddingIndex
+
+    if not settings.EMBEDDING_IVF_ENABLED:
+        return "IVF index disabled"
+
+    manager = get_embedding_db()
+    vector_count = manager.reader().execute(f"SELECT COUNT(*) FROM {NOTE_VECTOR_TABLE}").fetchone()[0]
+    if vector_count < settings.EMBEDDING_IVF_MIN_VECTORS:
+        ivf.clear(manager)
+        return f"Skipped IVF training, {vector_count} vectors is below EMBEDDING_IVF_MIN_VECTORS"
+
+    n_lists = ivf.train(
+        manager, EmbeddingIndex.active().dimensions,
+        n_lists=settings.EMBEDDING_IVF_LISTS,
+        sample_size=settings.EMBEDDING_IVF_TRAIN_SAMPLE,
+    )
+    logger.info(f"Trained IVF index with {n_lists} lists over {vector_count} vectors")
+    return f"Trained IVF index with {n_lists} lists"
+
+
+@shared_task
+def cluster_note_topics():
+    """Sync the exported embedding matrix, then re-cluster every user's notes into suggested topics"""
+    from note.models import LocalMessage, NoteEmbedding, NoteTopic
+
+    sync = NoteEmbedding.sync_matrix()
+    user_ids = list(LocalMessage.objects.order_by('user_id').values_list('user_id', flat=True).distinct())
+    topic_count = sum(NoteTopic.cluster_user(user_id) for user_id in user_ids)
+    return f"Synced {sync['updated']} vectors, wrote {topic_count} topics for {len(user_ids)} users"
+
+
+@shared_task
+def build_note_maps(user_ids=None):
+    """Sync the exported embedding matrix, then refit the 2D map basis of the given users, or of everyone"""
+    from note.models import LocalMessage, NoteEmbedding, NoteMapBasis
+
+    NoteEmbedding.sync_matrix()
+    if user_ids is None:
+        user_ids = list(LocalMessage.objects.order_by('user_id').values_list('user_id', flat=True).distinct())
+    note_count = sum(NoteMapBasis.build_for_user(user_id) for user_id in user_ids)
+    return f"Mapped {note_count} notes for {len(user_ids)} users"
+
+
+@shared_task
+def build_user_note_map(user_id):
+    """Fit one user's map basis from the current export without re-syncing it, for maps requested on demand"""
+    from note.embedding_utils import matrix
+    from note.models import NoteEmbedding, NoteMapBasis
+
+    # Only a fresh install has no export to read yet; everyone else waits for the nightly sync to pick up new notes
+    if matrix.read_meta(settings.EMBEDDING_MATRIX_DIR) is None:
+        NoteEmbedding.sync_matrix()
+    note_count = NoteMapBasis.build_for_user(user_id)
+    return f"Mapped {note_count} notes for user {user_id}"
+
+
+@shared_task
+def refresh_note_neighbors(note_ids):
+    """Rebuild the materialized neighbour lists of notes whose neighbours were deleted"""
+    from note.models import NoteNeighbor
+
+    NoteNeighbor.recompute(note_ids)
+    return f"Refreshed neighbours for {len(note_ids)} notes"
+
+
+@shared_task
+def rebuild_note_neighbors():
+    """Recompute every materialized neighbour list, e.g. after the embedding model changed"""
+    from note.models import NoteEmbedding, NoteNeighbor
+
+    note_ids = list(NoteEmbedding.objects.order_by('note_id').values_list('note_id', flat=True))
+    for start in range(0, len(note_ids), NEIGHBOR_REBUILD_BATCH_SIZE):
+        NoteNeighbor.recompute(note_ids[start:start + NEIGHBOR_REBUILD_BATCH_SIZE])
+    return f"Rebuilt neighbours for {len(note_ids)} notes"
+
+
+@shared_task
+def reindex_embeddings():
+    """Start or resume building a shadow index when the configured embedding model differs from the live one"""
+    from note.models import EmbeddingIndex
+
+    index = EmbeddingIndex.start_build()
+    if index is None:
+        return "Embedding index is up to date"
+    if not cache.add(EMBEDDING_REINDEX_LOCK_KEY, index.id, EMBEDDING_REINDEX_LOCK_TTL):
+        return f"Re-index for {index} already running"
+    build_shadow_index.delay(index.id)
+    return f"Started re-index for {index}"
+
+
+@shared_task(bind=True, max_retries=5)
+def build_shadow_index(self, index_id):
+    """
+    Embed one batch into the shadow tables, then reschedule itself.
+
+    Spacing batches by EMBEDDING_REINDEX_THROTTLE_SECONDS caps re-index
+    throughput so it does not starve live embedding jobs; the chain ends
+    with an atomic swap once the shadow tables cover every note.
+    """
+    from note.models import EmbeddingIndex
+
+    index = EmbeddingIndex.objects.filter(id=index_id, status=EmbeddingIndex.BUILDING).first()
+    if index is None:
+        cache.delete(EMBEDDING_REINDEX_LOCK_KEY)
+        return f"Embedding index {index_id} is no longer building"
+
+    try:
+        remaining = index.build_batch(settings.EMBEDDING_REINDEX_BATCH_SIZE)
+        swapped = remaining == 0 and index.swap()
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            logger.error(f"Giving up on re-index batch for {index}: {exc}")
+            cache.delete(EMBEDDING_REINDEX_LOCK_KEY)
+            raise
+        countdown = settings.EMBEDDING_RETRY_BACKOFF_SECONDS * 2 ** self.request.retries
+        logger.warning(f"Re-index batch for {index} failed, retrying in {countdown}s: {exc}")
+        raise self.retry(exc=exc, countdown=countdown)
+
+    if swapped:
+        cache.delete(EMBEDDING_REINDEX_LOCK_KEY)
+        logger.info(f"Swapped in embedding index {index}")
+        rebuild_note_neighbors.delay()
+        train_ivf_index.delay()
+        return f"Swapped in embedding index {index}"
+
+    cache.set(EMBEDDING_REINDEX_LOCK_KEY, index.id, EMBEDDING_REINDEX_LOCK_TTL)
+    build_shadow_index.apply_async(args=[index.id], countdown=settings.EMBEDDING_REINDEX_THROTTLE_SECONDS)
+    return f"{remaining} notes and chunks left to re-index for {index}"
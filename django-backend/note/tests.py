@@ -1,3 +1,1340 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+from datetime import date, datetime
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+import requests
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .embedding_utils import batching, ivf, matrix, projection, providers
+from .embedding_utils.connection import EmbeddingConnectionManager, get_embedding_db, serialize_vector
+from .embedding_utils.http_client import CircuitBreaker, EmbeddingServiceUnavailable, ResilientClient
+from .embedding_utils.preprocessing import preprocess, token_change_ratio
+from .embedding_utils.vector_tables import (
+    CHUNK_VECTOR_TABLE, NOTE_VECTOR_TABLE, ensure_vector_table, filter_clause, insert_vectors, knn,
+    shadow_table_name, table_columns, vector_table_sql
+)
+from .models import (
+    EmbeddingCacheEntry, EmbeddingIndex, EmbeddingIndexChanged, LocalMessage, LocalMessageList, NoteChunk,
+    NoteEmbedding, NoteNeighbor, NoteSignature, SearchTerm, Workspace
+)
+from .search_utils import minhash
+from .search_utils.backends import FTS_TABLE, ORDER_RANK, Fts5Backend, PostgresBackend, get_search_backend
+from .search_utils.hybrid import hybrid_search, reciprocal_rank_fusion
+from .search_utils.query_parser import And, Filter, Not, Or, QuerySyntaxError, Tag, Text, parse_query
+from .search_utils.snippets import END_MARK, START_MARK, make_snippet, split_marks
+from .tasks import EMBEDDING_JOB_TTL, EMBEDDING_PENDING_KEY, build_note_maps, embed_note, pending_embedding_count
+from .views.note_map_view import NoteMapView
+from .views.similar_note_view import SimilarNotesView
+from .views.stats_view import EmbeddingStatsView
+
+
+class NoteTestMixin:
+    def setUp(self):
+        self.user = User.objects.create_user('searcher', 'searcher@example.com', 'password')
+        self.note_list = LocalMessageList.objects.create(user=self.user, name='Work')
+
+    def make_note(self, text, **fields):
+        return LocalMessage.objects.create(user=self.user, list=self.note_list, text=text, **fields)
+
+
+class QueryParserTests(TestCase):
+    def test_dash_negates_phrase(self):
+        node = parse_query('-"draft copy" budget')
+        self.assertIsInstance(node, And)
+        negated, term = node.children
+        self.assertIsInstance(negated, Not)
+        self.assertEqual(negated.child.words, ['draft', 'copy'])
+        self.assertFalse(negated.child.prefix)
+        self.assertEqual(term.words, ['budget'])
+
+    def test_dash_negates_group(self):
+        node = parse_query('budget -(draft or final)')
+        negated = node.children[1]
+        self.assertIsInstance(negated, Not)
+        self.assertIsInstance(negated.child, Or)
+        self.assertEqual([child.raw for child in negated.child.children], ['draft', 'final'])
+
+    def test_lone_dash_is_ignored(self):
+        node = parse_query('budget - final')
+        self.assertEqual([child.raw for child in node.children], ['budget', 'final'])
+        self.assertTrue(all(isinstance(child, Text) for child in node.children))
+
+    def test_and_binds_tighter_than_or(self):
+        node = parse_query('draft or budget final')
+        self.assertIsInstance(node, Or)
+        first, second = node.children
+        self.assertEqual(first.raw, 'draft')
+        self.assertIsInstance(second, And)
+        self.assertEqual([child.raw for child in second.children], ['budget', 'final'])
+
+    def test_not_binds_tighter_than_and(self):
+        node = parse_query('draft OR budget AND NOT final')
+        self.assertIsInstance(node, Or)
+        negated = node.children[1].children[1]
+        self.assertIsInstance(negated, Not)
+        self.assertEqual(negated.child.raw, 'final')
+
+    def test_tags_and_filters(self):
+        node = parse_query('#Todo list:work,home has:file is:archived after:2024-01-01 before:2024-02-01')
+        tag, lists, has, is_, after, before = node.children
+        self.assertIsInstance(tag, Tag)
+        self.assertEqual(tag.name, 'todo')
+        self.assertTrue(all(isinstance(child, Filter) for child in node.children[1:]))
+        self.assertEqual(lists.value, ['work', 'home'])
+        self.assertEqual((has.field, has.value), ('has', 'file'))
+        self.assertEqual((is_.field, is_.value), ('is', 'archived'))
+        self.assertEqual(after.value, date(2024, 1, 1))
+        self.assertEqual(before.value, date(2024, 2, 1))
+
+    def test_invalid_filter_values(self):
+        with self.assertRaises(QuerySyntaxError):
+            parse_query('before:yesterday')
+        with self.assertRaises(QuerySyntaxError):
+            parse_query('is:pinned')
+
+    def test_unknown_field_is_a_term(self):
+        node = parse_query('http://example.com')
+        self.assertIsInstance(node, Text)
+
+    def test_unbalanced_query_still_parses(self):
+        node = parse_query('budget (draft or "final copy')
+        self.assertIsInstance(node, And)
+        self.assertEqual([child.raw for child in node.children[1].children], ['draft', 'final copy'])
+
+    def test_empty_query(self):
+        self.assertIsNone(parse_query('  and or '))
+
+
+class Fts5MatchExpressionTests(TestCase):
+    def setUp(self):
+        self.backend = Fts5Backend()
+
+    def test_terms_are_prefixes_and_phrases_are_exact(self):
+        node = parse_query('meet "exact phrase"')
+        self.assertEqual(self.backend.match_expression(node), '("meet"*) AND ("exact phrase")')
+
+    def test_precedence_and_negation(self):
+        node = parse_query('budget (draft or final) -old')
+        self.assertTrue(self.backend.can_match(node))
+        self.assertEqual(
+            self.backend.match_expression(node),
+            '(("budget"*) AND (("draft"*) OR ("final"*))) NOT ("old"*)'
+        )
+
+    def test_negation_without_positive_term(self):
+        # FTS5's NOT is binary, so these fall back to a NOT IN over the index
+        self.assertFalse(self.backend.can_match(parse_query('-old')))
+        self.assertFalse(self.backend.can_match(parse_query('not old or new')))
+
+
+class SnippetTests(TestCase):
+    def test_offsets_count_utf16_code_units(self):
+        # The emoji is one code point but two UTF-16 code units, as in JavaScript
+        snippet, highlights = split_marks(f'🎉 party {START_MARK}budget{END_MARK} review')
+        self.assertEqual(snippet, '🎉 party budget review')
+        self.assertEqual(highlights, [[9, 15]])
+
+        snippet, highlights = make_snippet('party 🎉 budget review #plans', parse_query('budget #plans'), 10)
+        self.assertEqual(highlights, [[9, 15], [23, 29]])
+
+    def test_window_around_first_hit(self):
+        text = ' '.join(f'word{i}' for i in range(30)) + ' budget'
+        snippet, highlights = make_snippet(text, parse_query('budget'), 6)
+        self.assertEqual(snippet, '…word25 word26 word27 word28 word29 budget')
+        start, end = highlights[0]
+        self.assertEqual(snippet[start:end], 'budget')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'FTS5 index is SQLite only')
+class Fts5SearchTests(NoteTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.backend = get_search_backend()
+        self.assertIsInstance(self.backend, Fts5Backend)
+
+    def search(self, query):
+        queryset = LocalMessage.objects.filter(user=self.user)
+        return set(self.backend.search(queryset, parse_query(query)).values_list('text', flat=True))
+
+    def test_negated_phrase(self):
+        self.make_note('budget draft copy')
+        self.make_note('budget final copy')
+        self.make_note('draft copy without the word')
+        self.assertEqual(self.search('-"draft copy" budget'), {'budget final copy'})
+
+    def test_negated_group(self):
+        self.make_note('budget draft')
+        self.make_note('budget final')
+        self.make_note('budget approved')
+        self.assertEqual(self.search('budget -(draft or final)'), {'budget approved'})
+
+    def test_prefix_matches_word_starts_only(self):
+        self.make_note('meeting notes')
+        self.make_note('unmeetable deadline')
+        self.assertEqual(self.search('meet'), {'meeting notes'})
+
+    def test_negation_alone(self):
+        self.make_note('budget draft')
+        self.make_note('budget final')
+        self.assertEqual(self.search('-draft'), {'budget final'})
+
+    def test_tag(self):
+        self.make_note('call the bank #todo')
+        self.make_note('todo list cleanup')
+        self.make_note('#todone already')
+        self.assertEqual(self.search('#todo'), {'call the bank #todo'})
+
+    def test_list_and_archived_filters(self):
+        home = LocalMessageList.objects.create(user=self.user, name='Home')
+        self.make_note('budget at work')
+        LocalMessage.objects.create(user=self.user, list=home, text='budget at home')
+        self.make_note('archived budget', archived=True)
+        self.assertEqual(self.search('budget list:home'), {'budget at home'})
+        self.assertEqual(self.search('budget is:archived'), {'archived budget'})
+
+    def test_date_filters(self):
+        for text, day in (('january budget', 15), ('february budget', 45)):
+            note = self.make_note(text)
+            created_at = timezone.make_aware(datetime(2024, 1, 1)) + timezone.timedelta(days=day - 1)
+            LocalMessage.objects.filter(id=note.id).update(created_at=created_at)
+        self.assertEqual(self.search('budget before:2024-02-01'), {'january budget'})
+        self.assertEqual(self.search('budget after:2024-02-01'), {'february budget'})
+        self.assertEqual(self.search('after:2024-01-15 before:2024-01-16'), {'january budget'})
+
+
+@skipUnless(connection.vendor == 'sqlite', 'FTS5 index is SQLite only')
+class Fts5TriggerTests(NoteTestMixin, TestCase):
+    def matching_ids(self, expression):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [expression])
+            return {row[0] for row in cursor.fetchall()}
+
+    def assertIndexConsistent(self):
+        with connection.cursor() as cursor:
+            # Raises if the index disagrees with note_localmessage
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('integrity-check', 1)")
+
+    def test_insert_is_indexed(self):
+        note = self.make_note('quarterly budget review')
+        self.assertEqual(self.matching_ids('budget'), {note.id})
+        self.assertIndexConsistent()
+
+    def test_text_update_replaces_terms(self):
+        note = self.make_note('quarterly budget review')
+        note.text = 'annual planning'
+        note.save()
+        self.assertEqual(self.matching_ids('budget'), set())
+        self.assertEqual(self.matching_ids('planning'), {note.id})
+        self.assertIndexConsistent()
+
+    def test_other_field_update_keeps_terms(self):
+        note = self.make_note('quarterly budget review')
+        LocalMessage.objects.filter(id=note.id).update(importance=3, archived=True)
+        self.assertEqual(self.matching_ids('budget'), {note.id})
+        self.assertIndexConsistent()
+
+    def test_delete_is_removed(self):
+        note = self.make_note('quarterly budget review')
+        kept = self.make_note('budget leftovers')
+        note.delete()
+        self.assertEqual(self.matching_ids('budget'), {kept.id})
+        self.assertIndexConsistent()
+
+
+class MinHashDuplicateTests(NoteTestMixin, TestCase):
+    BASE_TEXT = (
+        'Plan the quarterly budget review with the finance team, collect the department '
+        'forecasts, compare them with last year and send the summary to everyone on Friday'
+    )
+
+    def test_signature_similarity(self):
+        near = self.BASE_TEXT.replace('Friday', 'Monday')
+        base = minhash.signature(self.BASE_TEXT, 128)
+        self.assertEqual(minhash.similarity(base, minhash.signature(self.BASE_TEXT.upper(), 128)), 1.0)
+        self.assertGreater(minhash.similarity(base, minhash.signature(near, 128)), 0.8)
+        self.assertLess(minhash.similarity(base, minhash.signature('buy milk, eggs and bread', 128)), 0.2)
+        self.assertIsNone(minhash.signature('  ... ', 128))
+
+    def test_clusters_only_join_similar_bucket_members(self):
+        signatures = {
+            1: np.array([1, 2, 3, 4], dtype=np.uint32),
+            2: np.array([1, 2, 3, 5], dtype=np.uint32),
+            3: np.array([1, 9, 9, 9], dtype=np.uint32),
+            4: np.array([1, 2, 3, 4], dtype=np.uint32),
+        }
+        buckets = [(10, 1), (10, 2), (10, 3), (20, 2), (20, 4)]
+        self.assertEqual(minhash.clusters(buckets, signatures, 0.75), [[1, 2, 4]])
+
+    def test_duplicate_clusters_per_user(self):
+        original = self.make_note(self.BASE_TEXT)
+        copy = self.make_note(self.BASE_TEXT + '!')
+        edited = self.make_note(self.BASE_TEXT.replace('Friday', 'Monday'))
+        other = self.make_note('Buy milk, eggs and bread on the way home from the office tonight')
+        other_user = User.objects.create_user('other', 'other@example.com', 'password')
+        foreign = LocalMessage.objects.create(
+            user=other_user, list=LocalMessageList.objects.create(user=other_user, name='Work'), text=self.BASE_TEXT
+        )
+        NoteSignature.index_notes([original, copy, edited, other, foreign])
+
+        self.assertEqual(
+            NoteSignature.duplicate_clusters(self.user.id), [sorted([original.id, copy.id, edited.id])]
+        )
+        self.assertEqual(NoteSignature.duplicate_clusters(other_user.id), [])
+
+    def test_update_for_note_reindexes_changed_text(self):
+        original = self.make_note(self.BASE_TEXT)
+        copy = self.make_note(self.BASE_TEXT)
+        NoteSignature.index_notes([original, copy])
+        self.assertEqual(NoteSignature.update_for_note(copy), [original.id])
+
+        copy.text = 'Something else entirely, written from scratch for another purpose'
+        copy.save()
+        self.assertEqual(NoteSignature.update_for_note(copy), [])
+        self.assertEqual(NoteSignature.duplicate_clusters(self.user.id), [])
+
+
+class EmbeddingConnectionTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.manager = EmbeddingConnectionManager(f"{directory}/embeddings.sqlite3")
+        self.addCleanup(self.manager.close)
+        with self.manager.writer() as db:
+            db.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, thread TEXT)")
+
+    def count(self):
+        return self.manager.reader().execute("SELECT count(*) FROM items").fetchone()[0]
+
+    def test_each_thread_reuses_its_own_read_connection(self):
+        reader = self.manager.reader()
+        self.assertIs(self.manager.reader(), reader)
+        self.assertTrue(reader.execute("SELECT vec_version()").fetchone()[0])
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.manager.reader()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], reader)
+
+    def test_writer_commits_on_success_and_rolls_back_on_error(self):
+        with self.manager.writer() as db:
+            db.execute("INSERT INTO items (thread) VALUES ('main')")
+        with self.assertRaises(ValueError):
+            with self.manager.writer() as db:
+                db.execute("INSERT INTO items (thread) VALUES ('main')")
+                raise ValueError
+        self.assertEqual(self.count(), 1)
+
+    def test_concurrent_writers_queue_instead_of_failing(self):
+        errors = []
+
+        def write(name):
+            try:
+                for _ in range(20):
+                    with self.manager.writer() as db:
+                        db.execute("INSERT INTO items (thread) VALUES (?)", [name])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=[str(i)]) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.count(), 80)
+
+    def test_forked_process_opens_fresh_connections(self):
+        reader = self.manager.reader()
+        with mock.patch('note.embedding_utils.connection.os.getpid', return_value=self.manager._pid + 1):
+            self.assertIsNot(self.manager.reader(), reader)
+        reader.close()
+
+
+class QuantizedKnnTests(SimpleTestCase):
+    DIMENSIONS = 32
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.manager = EmbeddingConnectionManager(f"{directory}/embeddings.sqlite3")
+        self.addCleanup(self.manager.close)
+        generator = np.random.default_rng(7)
+        vectors = generator.normal(size=(120, self.DIMENSIONS)).astype(np.float32)
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.query = self.vectors[0] + np.float32(0.1) * self.vectors[1]
+        # (rowid, user_id, list_id, archived, blob); the last 20 rows belong to another user
+        self.rows = [
+            [rowid, 1 if rowid <= 100 else 2, rowid % 2, False, serialize_vector(vector)]
+            for rowid, vector in enumerate(self.vectors, start=1)
+        ]
+
+    def create_table(self, quantization):
+        with self.manager.writer() as db:
+            db.execute(vector_table_sql('vectors', self.DIMENSIONS, quantization))
+            insert_vectors(db, 'vectors', self.rows, quantization)
+
+    def search(self, quantization, k=5, rerank_factor=4, **filters):
+        clause, params = filter_clause(1, **filters)
+        return knn(
+            self.manager.reader(), 'vectors', serialize_vector(self.query), k, clause, params,
+            quantization=quantization, rerank_factor=rerank_factor
+        )
+
+    def exact(self, rowids, k=5):
+        distances = {rowid: float(np.linalg.norm(self.vectors[rowid - 1] - self.query)) for rowid in rowids}
+        return sorted(distances.items(), key=lambda item: item[1])[:k]
+
+    def test_rerank_over_every_candidate_matches_the_exact_scan(self):
+        for quantization in ('int8', 'binary'):
+            with self.subTest(quantization=quantization):
+                self.create_table(quantization)
+                results = self.search(quantization, rerank_factor=20)
+                expected = self.exact(range(1, 101))
+                self.assertEqual([rowid for rowid, _ in results], [rowid for rowid, _ in expected])
+                np.testing.assert_allclose([distance for _, distance in results], [d for _, d in expected], rtol=1e-5)
+                with self.manager.writer() as db:
+                    db.execute("DROP TABLE vectors")
+
+    def test_candidates_are_reranked_by_float_distance_within_the_filters(self):
+        self.create_table('int8')
+        results = self.search('int8', list_ids=[0])
+
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(rowid <= 100 and rowid % 2 == 0 for rowid, _ in results))
+        distances = [distance for _, distance in results]
+        self.assertEqual(distances, sorted(distances))
+        np.testing.assert_allclose(distances, [d for _, d in self.exact([rowid for rowid, _ in results])], rtol=1e-5)
+        # A unit-scaled int8 copy keeps the nearest neighbours among the candidates
+        self.assertEqual(results[0][0], self.exact(range(2, 101, 2))[0][0])
+
+    def test_rebuild_adds_the_quantized_column_and_keeps_the_rows(self):
+        self.create_table('none')
+        metadata = {row[0]: tuple(row[1:4]) for row in self.rows}
+        with self.manager.writer() as db:
+            ensure_vector_table(db, 'vectors', self.DIMENSIONS, lambda rowids: metadata, 'binary')
+
+        self.assertIn('embedding_bit', table_columns(self.manager.reader(), 'vectors'))
+        self.assertEqual(self.search('binary', rerank_factor=20), self.search('none'))
+
+
+class IvfIndexTests(SimpleTestCase):
+    DIMENSIONS = 16
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.manager = EmbeddingConnectionManager(f"{directory}/embeddings.sqlite3")
+        self.addCleanup(self.manager.close)
+        generator = np.random.default_rng(3)
+        centers = generator.normal(size=(4, self.DIMENSIONS)) * 10
+        self.vectors = np.concatenate([
+            center + generator.normal(size=(40, self.DIMENSIONS)) for center in centers
+        ]).astype(np.float32)
+        self.centers = centers.astype(np.float32)
+        with self.manager.writer() as db:
+            db.execute(vector_table_sql(NOTE_VECTOR_TABLE, self.DIMENSIONS))
+            insert_vectors(db, NOTE_VECTOR_TABLE, [
+                [rowid, 1, rowid % 2, False, serialize_vector(vector)]
+                for rowid, vector in enumerate(self.vectors, start=1)
+            ])
+            ivf.ensure_ivf_tables(db, self.DIMENSIONS)
+
+    def exact(self, query, k, **filters):
+        clause, params = filter_clause(1, **filters)
+        return knn(self.manager.reader(), NOTE_VECTOR_TABLE, serialize_vector(query), k, clause, params)
+
+    def probe(self, query, k, nprobe, **filters):
+        clause, params = filter_clause(1, **filters)
+        return ivf.probe(self.manager.reader(), serialize_vector(query), k, clause, params, nprobe)
+
+    def test_probing_the_nearest_list_finds_the_exact_neighbours(self):
+        self.assertEqual(ivf.train(self.manager, self.DIMENSIONS, n_lists=4), 4)
+
+        for center in self.centers:
+            with self.subTest(center=center[0]):
+                self.assertEqual(self.probe(center, 10, nprobe=1), self.exact(center, 10))
+                self.assertEqual(
+                    self.probe(center, 10, nprobe=4, list_ids=[1]), self.exact(center, 10, list_ids=[1])
+                )
+
+    def test_vectors_written_after_training_are_assigned_and_removed(self):
+        ivf.train(self.manager, self.DIMENSIONS, n_lists=4)
+        added = serialize_vector(self.centers[2])
+        with self.manager.writer() as db:
+            ivf.assign(db, [[1000, 1, 0, False, added]])
+        self.assertEqual(self.probe(self.centers[2], 1, nprobe=1)[0][0], 1000)
+
+        with self.manager.writer() as db:
+            ivf.remove(db, [1000])
+        self.assertNotIn(1000, [rowid for rowid, _ in self.probe(self.centers[2], 10, nprobe=4)])
+
+
+@override_settings(EMBEDDING_PROVIDER='hashing', EMBEDDING_QUANTIZATION='none', EMBEDDING_IVF_ENABLED=0)
+class NoteKnnTests(TransactionTestCase):
+    # The vec0 tables are written through their own sqlite-vec connection, which would wait on a TestCase transaction
+    databases = {'default', 'embeddings'}
+
+    def setUp(self):
+        # Vectors are written directly below; the save signal's job queue needs Redis
+        patcher = mock.patch('note.signals.enqueue_note_embedding')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(get_embedding_db().close)
+        NoteEmbedding.setup_vector_table()
+        with get_embedding_db().writer() as db:
+            for table in (NOTE_VECTOR_TABLE, CHUNK_VECTOR_TABLE):
+                db.execute(f"DELETE FROM {table}")
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.other_user = User.objects.create_user('other', 'other@example.com', 'password')
+        self.work = LocalMessageList.objects.create(user=self.user, name='Work')
+        self.home = LocalMessageList.objects.create(user=self.user, name='Home')
+        self.other_list = LocalMessageList.objects.create(user=self.other_user, name='Work')
+
+    def embed(self, note_list, text, **fields):
+        note = LocalMessage.objects.create(user=note_list.user, list=note_list, text=text, **fields)
+        index = EmbeddingIndex.active()
+        NoteEmbedding._write_vectors([note], NoteEmbedding.get_embeddings([note.text], index.model_name), index)
+        return note
+
+    def note_ids(self, results):
+        return [result['note_id'] for result in results]
+
+    def test_results_stay_in_the_owners_partition(self):
+        note = self.embed(self.work, 'quarterly budget review with finance')
+        near = self.embed(self.home, 'budget review for the quarter')
+        self.embed(self.other_list, 'quarterly budget review with finance')
+
+        results = NoteEmbedding.find_similar_notes(note.id, limit=5)
+        self.assertEqual(self.note_ids(results), [near.id])
+
+    def test_query_vector_is_searched_in_the_given_users_partition(self):
+        mine = self.embed(self.work, 'quarterly budget review')
+        theirs = self.embed(self.other_list, 'quarterly budget review')
+        vector = NoteEmbedding.get_embeddings(['quarterly budget review'])[0]
+
+        self.assertEqual(
+            self.note_ids(NoteEmbedding.find_similar_notes_by_embedding(vector, user_id=self.user.id)), [mine.id]
+        )
+        self.assertEqual(
+            self.note_ids(NoteEmbedding.find_similar_notes_by_embedding(vector, user_id=self.other_user.id)),
+            [theirs.id]
+        )
+
+    def test_list_and_archived_filters_apply_during_the_scan(self):
+        note = self.embed(self.work, 'budget review')
+        at_work = self.embed(self.work, 'budget review notes')
+        at_home = self.embed(self.home, 'budget review at home')
+        archived = self.embed(self.work, 'budget review archive', archived=True)
+
+        self.assertEqual(
+            self.note_ids(NoteEmbedding.find_similar_notes(note.id, limit=5, list_ids=[self.home.id])), [at_home.id]
+        )
+        self.assertEqual(
+            set(self.note_ids(NoteEmbedding.find_similar_notes(note.id, limit=5, archived=False))),
+            {at_work.id, at_home.id}
+        )
+        self.assertEqual(self.note_ids(NoteEmbedding.find_similar_notes(note.id, limit=5, list_ids=[])), [])
+        self.assertIn(archived.id, self.note_ids(NoteEmbedding.find_similar_notes(note.id, limit=5)))
+
+    def test_excluded_notes_do_not_shorten_the_result(self):
+        note = self.embed(self.work, 'budget review')
+        others = [self.embed(self.work, f'budget review {word}') for word in ('draft', 'final', 'notes')]
+
+        results = NoteEmbedding.find_similar_notes(note.id, limit=2, exclude_note_ids={others[0].id})
+        self.assertEqual(len(results), 2)
+        self.assertNotIn(others[0].id, self.note_ids(results))
+
+    def test_note_turned_rtl_drops_out_of_knn(self):
+        note = self.embed(self.work, 'budget review')
+        turned = self.embed(self.work, 'budget review draft')
+        self.assertIn(turned.id, self.note_ids(NoteEmbedding.find_similar_notes(note.id, limit=5)))
+
+        turned.text = 'مراجعة الميزانية'
+        turned.save()
+        with mock.patch('note.tasks._is_current_job', return_value=True), \
+                mock.patch('note.tasks._finish_job'), mock.patch('note.tasks.refresh_note_neighbors'):
+            embed_note(turned.id, 'token')
+
+        self.assertNotIn(turned.id, self.note_ids(NoteEmbedding.find_similar_notes(note.id, limit=5)))
+        self.assertEqual(NoteEmbedding.find_similar_notes(turned.id, limit=5), [])
+        self.assertFalse(NoteEmbedding.objects.filter(note_id=turned.id).exists())
+
+    def stored_neighbors(self, note):
+        return list(NoteNeighbor.objects.filter(note_id=note.id).values_list('neighbor_id', flat=True))
+
+    def test_neighbour_lists_follow_new_and_deleted_notes(self):
+        note = self.embed(self.work, 'budget review')
+        near = self.embed(self.work, 'budget review notes')
+        far = self.embed(self.home, 'holiday beach trip')
+        NoteNeighbor.refresh_for_notes([note.id, near.id, far.id])
+        self.assertEqual(self.stored_neighbors(note), [near.id, far.id])
+
+        copy = self.embed(self.work, 'budget review')
+        NoteNeighbor.refresh_for_notes([copy.id])
+        self.assertEqual(self.stored_neighbors(note)[0], copy.id)
+        self.assertIn(copy.id, self.stored_neighbors(far))
+
+        self.assertEqual(NoteNeighbor.delete_for_notes([copy.id]), {note.id, near.id, far.id})
+        self.assertFalse(NoteNeighbor.objects.filter(neighbor_id=copy.id).exists())
+        self.assertEqual(self.stored_neighbors(copy), [])
+
+    def test_similar_notes_view_reads_stored_neighbours_and_tops_up_the_workspace(self):
+        workspace = Workspace.objects.create(user=self.user, name='Office')
+        self.work.workspaces.add(workspace)
+        note = self.embed(self.work, 'budget review')
+        at_home = self.embed(self.home, 'budget review notes')
+        at_work = self.embed(self.work, 'budget review draft')
+        NoteNeighbor.refresh_for_notes([note.id, at_home.id, at_work.id])
+
+        def similar(limit):
+            request = APIRequestFactory().get(f'/api/note/message/{note.id}/similar/', {'limit': limit})
+            force_authenticate(request, self.user)
+            return [result['id'] for result in SimilarNotesView.as_view()(request, note_id=note.id).data]
+
+        with mock.patch.object(NoteEmbedding, 'find_similar_notes', wraps=NoteEmbedding.find_similar_notes) as knn:
+            self.assertEqual(similar(1), [at_work.id])
+        knn.assert_not_called()
+
+        # Only the out-of-workspace neighbour is stored, so the view searches the workspace's lists
+        NoteNeighbor.objects.filter(note_id=note.id, neighbor_id=at_work.id).delete()
+        self.assertEqual(similar(4), [at_work.id])
+
+    @override_settings(EMBEDDING_CHANGE_THRESHOLD=0.2, EMBEDDING_IDLE_REFRESH_SECONDS=300)
+    def test_trivial_edits_wait_for_an_idle_refresh(self):
+        original = 'one two three four five six seven eight nine ten'
+        note = self.embed(self.work, original)
+
+        def run_job(force=False):
+            with mock.patch('note.tasks._is_current_job', return_value=True), mock.patch('note.tasks._finish_job'), \
+                    mock.patch('note.tasks.enqueue_note_embedding') as enqueue:
+                embed_note(note.id, 'token', force)
+            return enqueue
+
+        note.text = original.replace('ten', 'tne')
+        note.save()
+        enqueue = run_job()
+        enqueue.assert_called_once_with(note.id, force=True, countdown=300)
+        self.assertEqual(NoteEmbedding.objects.get(note_id=note.id).embedded_text, original)
+
+        run_job(force=True).assert_not_called()
+        self.assertEqual(NoteEmbedding.objects.get(note_id=note.id).embedded_text, note.text)
+
+        note.text = 'holiday plans for the summer'
+        note.save()
+        run_job().assert_not_called()
+        self.assertEqual(NoteEmbedding.objects.get(note_id=note.id).embedded_text, note.text)
+
+    def test_cascade_and_queryset_deletes_purge_vectors_after_commit(self):
+        kept = self.embed(self.home, 'budget review')
+        deleted = [self.embed(self.work, 'budget review notes'), self.embed(self.work, 'budget review draft')]
+        NoteNeighbor.refresh_for_notes([kept.id] + [note.id for note in deleted])
+        deleted_ids = {note.id for note in deleted}
+
+        with mock.patch('note.signals.refresh_note_neighbors') as refresh:
+            self.work.delete()
+        refresh.delay.assert_called_once_with([kept.id])
+        self.assertEqual(NoteEmbedding.find_similar_notes(kept.id, limit=5), [])
+        self.assertFalse(NoteEmbedding.objects.filter(note_id__in=deleted_ids).exists())
+        self.assertFalse(NoteNeighbor.objects.filter(neighbor_id__in=deleted_ids).exists())
+
+        other = self.embed(self.home, 'budget review notes')
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            LocalMessage.objects.filter(id=kept.id).delete()
+            raise RuntimeError
+        with mock.patch('note.signals.refresh_note_neighbors'):
+            LocalMessage.objects.filter(id=other.id).delete()
+        # The rolled-back delete left kept's id behind; the next purge must not take its vector
+        self.assertTrue(NoteEmbedding.objects.filter(note_id=kept.id).exists())
+        self.assertFalse(NoteEmbedding.objects.filter(note_id=other.id).exists())
+        self.assertEqual(
+            get_embedding_db().reader().execute(f"SELECT rowid FROM {NOTE_VECTOR_TABLE}").fetchall(), [(kept.id,)]
+        )
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_note_map_is_fitted_offline_and_placed_incrementally(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache.clear()
+        notes = [self.embed(self.work, text) for text in ('budget review', 'budget draft', 'holiday beach trip')]
+
+        def note_map(user):
+            request = APIRequestFactory().get('/api/note/map/')
+            force_authenticate(request, user)
+            return NoteMapView.as_view()(request).data
+
+        with self.settings(EMBEDDING_MATRIX_DIR=directory), \
+                mock.patch('note.views.note_map_view.build_user_note_map') as build:
+            self.assertEqual(note_map(self.user), {'points': [], 'built_at': None})
+            note_map(self.user)
+            build.delay.assert_called_once_with(self.user.id)
+
+            build_note_maps([self.user.id])
+            points = {point['id']: point for point in note_map(self.user)['points']}
+            self.assertEqual(set(points), {note.id for note in notes})
+            budget, draft, holiday = (np.array([points[note.id]['x'], points[note.id]['y']]) for note in notes)
+            self.assertLess(np.linalg.norm(budget - draft), np.linalg.norm(budget - holiday))
+
+            # Embedded after the fit: projected onto the saved basis without a rebuild
+            added = LocalMessage.objects.create(user=self.user, list=self.work, text='budget review notes')
+            NoteEmbedding.create_for_note(added)
+            self.assertIn(added.id, [point['id'] for point in note_map(self.user)['points']])
+            self.assertEqual(note_map(self.other_user)['points'], [])
+            build.delay.assert_called_with(self.other_user.id)
+
+    def drop_vector_tables(self):
+        with get_embedding_db().writer() as db:
+            for table in (NOTE_VECTOR_TABLE, CHUNK_VECTOR_TABLE, ivf.CENTROID_TABLE, ivf.LIST_TABLE):
+                db.execute(f"DROP TABLE IF EXISTS {table}")
+                db.execute(f"DROP TABLE IF EXISTS {shadow_table_name(table)}")
+
+    def test_model_change_builds_a_shadow_index_and_swaps_it_in(self):
+        # The swap recreates the live tables at the new size; drop them so the next test starts from the default
+        self.addCleanup(self.drop_vector_tables)
+        note = self.embed(self.work, 'budget review')
+        near = self.embed(self.work, 'budget review notes')
+        live = EmbeddingIndex.active()
+
+        with self.settings(OLLAMA_EMBEDDING_SIZE=64):
+            building = EmbeddingIndex.start_build()
+            self.assertEqual(building.status, EmbeddingIndex.BUILDING)
+            self.assertEqual(EmbeddingIndex.start_build(), building)
+            self.assertEqual(self.note_ids(NoteEmbedding.find_similar_notes(note.id)), [near.id])
+
+            self.assertEqual(building.build_batch(10), 0)
+            self.assertTrue(building.swap())
+
+        self.assertEqual(EmbeddingIndex.active().id, building.id)
+        self.assertEqual(EmbeddingIndex.objects.get(id=live.id).status, EmbeddingIndex.RETIRED)
+        dimensions = get_embedding_db().reader().execute(
+            f"SELECT vec_length(embedding) FROM {NOTE_VECTOR_TABLE} WHERE rowid = ?", [note.id]
+        ).fetchone()[0]
+        self.assertEqual(dimensions, 64)
+        self.assertEqual(self.note_ids(NoteEmbedding.find_similar_notes(note.id)), [near.id])
+        self.assertEqual(set(NoteEmbedding.objects.values_list('model_name', flat=True)), {building.model_name})
+
+        # A job that embedded with the retired model fails instead of mixing vector spaces
+        with self.assertRaises(EmbeddingIndexChanged):
+            NoteEmbedding._write_vectors([note], NoteEmbedding.get_embeddings([note.text], live.model_name), live)
+
+    @override_settings(EMBEDDING_CHUNK_SIZE=60, EMBEDDING_CHUNK_OVERLAP=0)
+    def test_backfilled_chunks_find_a_section_and_keep_unchanged_vectors(self):
+        note = self.embed(
+            self.work, '# Budget\n\nquarterly budget review with finance\n\n# Holiday\n\nbeach trip packing list'
+        )
+        self.assertFalse(NoteChunk.objects.filter(note_id=note.id).exists())
+
+        call_command('generate_embeddings', chunks_only=True, stdout=StringIO())
+
+        chunks = list(NoteChunk.objects.filter(note_id=note.id))
+        self.assertEqual(len(chunks), 2)
+        query = NoteEmbedding.get_embeddings(['beach trip packing list'])[0]
+        best = NoteChunk.find_similar_chunks(query, self.user.id)[0]
+        self.assertEqual(best['note_id'], note.id)
+        self.assertIn('beach trip', note.text[best['start_offset']:best['end_offset']])
+
+        note.text = note.text.replace('beach trip', 'mountain hike')
+        self.assertEqual(NoteChunk.sync_for_notes([note], EmbeddingIndex.active()), 1)
+        self.assertIn(chunks[0].id, NoteChunk.objects.filter(note_id=note.id).values_list('id', flat=True))
+
+    def test_matrix_sync_during_a_vector_write_is_caught_up_by_the_next(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with self.settings(EMBEDDING_MATRIX_DIR=directory):
+            note = self.embed(self.work, 'budget review')
+            NoteEmbedding.sync_matrix()
+
+            note.text = 'holiday plans'
+            note.save()
+            def sync_then_insert(*args, **kwargs):
+                # A sync that runs after the NoteEmbedding row is written but before the vector is committed
+                NoteEmbedding.sync_matrix()
+                insert_vectors(*args, **kwargs)
+
+            index = EmbeddingIndex.active()
+            with mock.patch('note.models.insert_vectors', side_effect=sync_then_insert):
+                NoteEmbedding._write_vectors([note], NoteEmbedding.get_embeddings([note.text]), index)
+            NoteEmbedding.sync_matrix()
+
+            note_ids, vectors = matrix.user_rows(directory, self.user.id)
+            expected = np.array(NoteEmbedding.get_embeddings(['holiday plans'])[0], dtype=np.float32)
+            np.testing.assert_allclose(vectors[list(note_ids).index(note.id)], expected, rtol=1e-6)
+
+
+class VectorMetadataSignalTests(NoteTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('note.signals.enqueue_note_embedding')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.note = self.make_note('budget review')
+
+    def synced_after(self, **save_kwargs):
+        with mock.patch.object(NoteEmbedding, 'update_metadata') as update_metadata, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.note.save(**save_kwargs)
+        return update_metadata.called
+
+    def test_only_list_and_archived_changes_reach_the_vectors(self):
+        self.note.text = 'budget review draft'
+        self.assertFalse(self.synced_after())
+        self.note.importance = 2
+        self.assertFalse(self.synced_after(update_fields=['importance']))
+
+        self.note.archived = True
+        self.assertTrue(self.synced_after(update_fields=['archived']))
+        self.note.list = LocalMessageList.objects.create(user=self.user, name='Home')
+        self.assertTrue(self.synced_after())
+        self.assertFalse(self.synced_after())
+
+
+class EmbeddingJobSignalTests(NoteTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(NoteEmbedding, 'update_metadata')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def queued_after(self, save):
+        with mock.patch('note.signals.enqueue_note_embedding') as enqueue, \
+                self.captureOnCommitCallbacks(execute=True):
+            save()
+        return enqueue.called
+
+    def test_only_text_changes_queue_a_job(self):
+        self.assertTrue(self.queued_after(lambda: self.make_note('budget review')))
+        note = LocalMessage.objects.get()
+
+        note.importance = 2
+        self.assertFalse(self.queued_after(lambda: note.save(update_fields=['importance'])))
+        note.archived = True
+        self.assertFalse(self.queued_after(note.save))
+
+        note.text = 'budget review draft'
+        self.assertTrue(self.queued_after(note.save))
+        note.text = 'budget review final'
+        self.assertTrue(self.queued_after(lambda: note.save(update_fields=['text'])))
+
+
+class EmbeddingStatsViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('member', 'member@example.com', 'password')
+        self.staff = User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        for target, value in (('note.views.stats_view.pending_embedding_count', 7),
+                              ('note.models.NoteEmbedding.cached_freshness', None)):
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def stats(self, user):
+        request = APIRequestFactory().get('/api/note/stats/embeddings/')
+        force_authenticate(request, user)
+        return EmbeddingStatsView.as_view()(request).data
+
+    @override_settings(EMBEDDING_PROVIDER='ollama')
+    def test_shared_queue_and_service_state_is_staff_only(self):
+        member = self.stats(self.user)
+        self.assertIsNone(member['pending_jobs'])
+        self.assertIsNone(member['embedding_service'])
+
+        staff = self.stats(self.staff)
+        self.assertEqual(staff['pending_jobs'], 7)
+        self.assertIn('circuit', staff['embedding_service'])
+
+    def test_pending_count_forgets_jobs_older_than_the_token(self):
+        redis = mock.Mock()
+        redis.zcard.return_value = 1
+        with mock.patch('note.tasks.get_redis_connection', return_value=redis), \
+                mock.patch('note.tasks.time.time', return_value=100000.0):
+            self.assertEqual(pending_embedding_count(), 1)
+        redis.zremrangebyscore.assert_called_once_with(
+            EMBEDDING_PENDING_KEY, '-inf', 100000.0 - EMBEDDING_JOB_TTL
+        )
+
+
+class EmbeddingProviderTests(SimpleTestCase):
+    def test_model_names_identify_their_provider(self):
+        cases = [
+            ('ollama', 'granite-embedding:30m', providers.OllamaProvider),
+            ('hashing', 'hashing:384', providers.HashingProvider),
+        ]
+        for provider, model_name, provider_class in cases:
+            with self.subTest(provider=provider), self.settings(
+                EMBEDDING_PROVIDER=provider, OLLAMA_MODEL='granite-embedding:30m', OLLAMA_EMBEDDING_SIZE=384
+            ):
+                self.assertEqual(providers.configured_model_name(), model_name)
+                self.assertIsInstance(providers.get_provider(model_name), provider_class)
+                self.assertIs(providers.get_provider(model_name), providers.get_provider(model_name))
+
+        with self.settings(EMBEDDING_PROVIDER='onnx', EMBEDDING_ONNX_MODEL='all-MiniLM-L6-v2'):
+            self.assertEqual(providers.configured_model_name(), 'onnx:all-MiniLM-L6-v2')
+        with self.settings(EMBEDDING_PROVIDER='openai'), self.assertRaises(ImproperlyConfigured):
+            providers.configured_model_name()
+
+    def test_ollama_sends_every_text_in_one_request(self):
+        with mock.patch.object(providers, 'get_ollama_client') as get_client:
+            get_client.return_value.post_json.return_value = {'embeddings': [[0.1], [0.2]]}
+            vectors = providers.OllamaProvider('granite-embedding:30m').embed(('budget', 'plans'), read_timeout=3)
+
+        self.assertEqual(vectors, [[0.1], [0.2]])
+        get_client.return_value.post_json.assert_called_once_with(
+            '/api/embed', {'model': 'granite-embedding:30m', 'input': ['budget', 'plans']}, read_timeout=3
+        )
+
+    def test_hashing_vectors_are_stable_unit_vectors_that_group_shared_words(self):
+        provider = providers.HashingProvider(64)
+        budget, review, holiday = np.array(provider.embed(['Budget review', 'budget REVIEW draft', 'holiday trip']))
+
+        np.testing.assert_allclose(provider.embed(['Budget review'])[0], budget)
+        self.assertEqual(budget.shape, (64,))
+        self.assertAlmostEqual(float(np.linalg.norm(budget)), 1.0, places=5)
+        self.assertLess(np.linalg.norm(budget - review), np.linalg.norm(budget - holiday))
+
+    def test_onnx_needs_its_optional_packages(self):
+        with mock.patch.dict('sys.modules', {'onnxruntime': None}), self.assertRaises(ImproperlyConfigured):
+            providers.OnnxProvider('/nonexistent')
+
+    def test_onnx_mean_pools_over_the_attention_mask_in_batches(self):
+        provider = providers.OnnxProvider.__new__(providers.OnnxProvider)
+        provider.batch_size = 1
+        provider.input_names = {'input_ids', 'attention_mask', 'token_type_ids'}
+        provider.tokenizer = mock.Mock()
+        provider.tokenizer.encode_batch.side_effect = [
+            [mock.Mock(ids=[1, 2, 0], attention_mask=[1, 1, 0])],
+            [mock.Mock(ids=[5, 6, 7], attention_mask=[1, 1, 1])],
+        ]
+        provider.session = mock.Mock()
+        provider.session.run.side_effect = [
+            [np.array([[[3.0, 0.0], [1.0, 0.0], [100.0, 100.0]]], dtype=np.float32)],
+            [np.array([[[0.0, 1.0], [0.0, 2.0], [0.0, 3.0]]], dtype=np.float32)],
+        ]
+
+        vectors = provider.embed(['budget', 'plans'])
+
+        # The padded position is left out of the mean, then each vector is L2-normalized
+        np.testing.assert_allclose(vectors, [[1.0, 0.0], [0.0, 1.0]])
+        self.assertEqual(provider.session.run.call_count, 2)
+        feeds = provider.session.run.call_args.args[1]
+        self.assertEqual(set(feeds), provider.input_names)
+
+
+class ResilientClientTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('note.embedding_utils.http_client.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = ResilientClient('http://embedder', connect_timeout=2, read_timeout=30,
+                                      failure_threshold=3, reset_seconds=10)
+        self.session = mock.Mock()
+        self.client._get_session = lambda: self.session
+
+    def respond(self, status=200, payload=None):
+        self.session.post.side_effect = None
+        self.session.post.return_value = mock.Mock(status_code=status, text='', json=lambda: payload or {})
+
+    def fail(self):
+        self.session.post.side_effect = requests.ConnectionError('refused')
+
+    def call(self):
+        return self.client.post_json('/api/embed', {})
+
+    def test_failure_threshold_opens_the_circuit_and_it_fails_fast(self):
+        self.fail()
+        for _ in range(3):
+            self.assertEqual(self.client.breaker.state, CircuitBreaker.CLOSED)
+            with self.assertRaises(requests.ConnectionError):
+                self.call()
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.OPEN)
+
+        self.session.post.reset_mock()
+        with self.assertRaises(EmbeddingServiceUnavailable):
+            self.call()
+        self.session.post.assert_not_called()
+        self.assertEqual(self.client.metrics()['rejected'], 1)
+
+    def test_half_open_lets_one_trial_through_and_recovers(self):
+        self.fail()
+        for _ in range(3):
+            with self.assertRaises(requests.ConnectionError):
+                self.call()
+
+        self.now += 10
+        rejected = []
+
+        def trial(*args, **kwargs):
+            # While the trial is in flight every other caller is still turned away
+            self.assertEqual(self.client.breaker.state, CircuitBreaker.HALF_OPEN)
+            with self.assertRaises(EmbeddingServiceUnavailable):
+                self.call()
+            rejected.append(True)
+            return mock.Mock(status_code=200, text='', json=lambda: {'embeddings': [[0.1]]})
+
+        self.session.post.side_effect = trial
+        self.assertEqual(self.call(), {'embeddings': [[0.1]]})
+        self.assertEqual(rejected, [True])
+        self.assertEqual(self.session.post.call_count, 4)
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.client.breaker.failures, 0)
+
+    def test_failed_trial_reopens_the_circuit(self):
+        self.fail()
+        for _ in range(3):
+            with self.assertRaises(requests.ConnectionError):
+                self.call()
+        self.now += 10
+        with self.assertRaises(requests.ConnectionError):
+            self.call()
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.OPEN)
+        self.now += 5
+        with self.assertRaises(EmbeddingServiceUnavailable):
+            self.call()
+
+    def test_client_errors_do_not_count_against_the_breaker(self):
+        self.respond(status=400)
+        for _ in range(5):
+            with self.assertRaises(requests.HTTPError):
+                self.call()
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_read_timeout_can_be_shortened_per_call(self):
+        self.respond()
+        self.call()
+        self.assertEqual(self.session.post.call_args.kwargs['timeout'], (2, 30))
+        self.client.post_json('/api/embed', {}, read_timeout=5)
+        self.assertEqual(self.session.post.call_args.kwargs['timeout'], (2, 5))
+
+    @override_settings(OLLAMA_REQUEST_READ_TIMEOUT=5)
+    def test_batcher_embeds_with_the_request_read_timeout(self):
+        with mock.patch('note.embedding_utils.batching._batcher', None), \
+                mock.patch.object(NoteEmbedding, 'get_embeddings', return_value=[[0.1]]) as get_embeddings:
+            self.assertEqual(batching.get_batcher().embed('budget', timeout=5), [0.1])
+        get_embeddings.assert_called_once_with(['budget'], read_timeout=5)
+
+
+class EmbeddingBatcherTests(SimpleTestCase):
+    def embed_concurrently(self, batcher, texts):
+        results, errors = {}, {}
+
+        def embed(position, text):
+            try:
+                results[position] = batcher.embed(text, timeout=5)
+            except Exception as e:
+                errors[position] = e
+
+        threads = [threading.Thread(target=embed, args=[position, text]) for position, text in enumerate(texts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_requests_share_one_call_without_duplicates(self):
+        embed_batch = mock.Mock(side_effect=lambda texts: [[float(len(text))] for text in texts])
+        # The batch closes as soon as it is full, so the long wait only guards against a slow thread start
+        batcher = batching.EmbeddingBatcher(embed_batch, max_batch_size=3, max_wait_ms=5000)
+
+        results, errors = self.embed_concurrently(batcher, ['budget', 'plans', 'budget'])
+
+        self.assertEqual(errors, {})
+        self.assertEqual(results, {0: [6.0], 1: [5.0], 2: [6.0]})
+        embed_batch.assert_called_once()
+        self.assertCountEqual(embed_batch.call_args.args[0], ['budget', 'plans'])
+
+    def test_a_failed_call_fails_every_caller_in_the_batch(self):
+        batcher = batching.EmbeddingBatcher(
+            mock.Mock(side_effect=EmbeddingServiceUnavailable('down')), max_batch_size=2, max_wait_ms=5000
+        )
+
+        with self.assertLogs('note.embedding_utils.batching', 'ERROR'):
+            results, errors = self.embed_concurrently(batcher, ['budget', 'plans'])
+
+        self.assertEqual(results, {})
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(all(isinstance(error, EmbeddingServiceUnavailable) for error in errors.values()))
+
+
+class MapProjectionTests(SimpleTestCase):
+    def test_principal_axes_follow_the_spread_and_keep_their_sign(self):
+        generator = np.random.default_rng(5)
+        vectors = generator.normal(size=(200, 4)) * [10.0, 3.0, 0.1, 0.1] + [1.0, 2.0, 3.0, 4.0]
+
+        mean, components = projection.pca_basis(vectors)
+        np.testing.assert_allclose(mean, vectors.mean(axis=0), rtol=1e-5)
+        np.testing.assert_allclose(np.abs(components), [[1, 0, 0, 0], [0, 1, 0, 0]], atol=0.05)
+        self.assertTrue(np.all(components.max(axis=1) > 0))
+
+        _, flipped = projection.pca_basis(-vectors)
+        np.testing.assert_allclose(flipped, components, atol=1e-4)
+
+        coordinates = projection.project(vectors, mean, components)
+        self.assertEqual(coordinates.shape, (200, 2))
+        self.assertGreater(coordinates[:, 0].std(), coordinates[:, 1].std())
+
+
+class PreprocessingTests(SimpleTestCase):
+    def test_markdown_is_reduced_to_its_words(self):
+        cases = [
+            ('# Title\n\nSome **bold** and _italic_ text', 'Title\n\nSome bold and italic text'),
+            ('- [ ] buy milk\n- [x] eggs\n1. first', 'buy milk\neggs\nfirst'),
+            ('> quoted\n>> deeper', 'quoted\ndeeper'),
+            ('See [docs](https://x.io) and ![chart](/api/note/files/a.png)', 'See docs and chart'),
+            ('visit https://example.com now', 'visit now'),
+            ('```python\nprint(1)\n```\nafter', '[python code]\nafter'),
+            ('```\nraw\n```', '[code]'),
+            ('use `pip install`', 'use pip install'),
+            ('~~gone~~ snake_case 2*3*4', 'gone snake_case 2*3*4'),
+            ('https://only.example.com', 'https://only.example.com'),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(preprocess(text, 2000), expected)
+
+    def test_whitespace_is_normalized_and_long_text_cut_at_a_word(self):
+        cases = [
+            ('a  \t b\u00a0c\n\n\n\nd', 2000, 'a b c\n\nd'),
+            ('  padded line  \n  next  ', 2000, 'padded line\nnext'),
+            ('alpha beta gamma delta', 12, 'alpha beta'),
+            ('abcdefghijklmnop', 10, 'abcdefghij'),
+        ]
+        for text, max_chars, expected in cases:
+            with self.subTest(text=text, max_chars=max_chars):
+                self.assertEqual(preprocess(text, max_chars), expected)
+
+    def test_token_change_ratio_folds_case_and_ignores_punctuation(self):
+        cases = [
+            ('Buy Milk', 'buy milk!', 0.0),
+            ('one two', 'one, two two', 0.0),
+            ('', '', 0.0),
+            ('a', 'b', 1.0),
+            ('a b c d e', 'a b c d f', 2 / 6),
+        ]
+        for old_text, new_text, expected in cases:
+            with self.subTest(old_text=old_text, new_text=new_text):
+                self.assertAlmostEqual(token_change_ratio(old_text, new_text), expected)
+
+    @override_settings(EMBEDDING_CHANGE_THRESHOLD=0.2, EMBEDDING_MAX_STALENESS_SECONDS=3600)
+    def test_trivial_edits_keep_the_existing_vector(self):
+        embedded = 'one two three four five six seven eight nine ten'
+        cases = [
+            ('**one** two three four five six seven eight nine ten', False),
+            ('ONE two three four five six seven eight nine ten.', False),
+            ('one two three four five six seven eight nine tne', False),
+            ('one two three four five six seven eight eleven twelve', True),
+            ('something else entirely', True),
+        ]
+        for text, significant in cases:
+            with self.subTest(text=text):
+                embedding = NoteEmbedding(embedded_text=NoteEmbedding.prepare_text(embedded), updated_at=timezone.now())
+                self.assertIs(embedding.is_significant_change(text), significant)
+
+    @override_settings(EMBEDDING_CHANGE_THRESHOLD=0.2, EMBEDDING_MAX_STALENESS_SECONDS=3600)
+    def test_stale_vectors_are_refreshed_on_any_edit(self):
+        embedding = NoteEmbedding(embedded_text='buy milk', updated_at=timezone.now() - timezone.timedelta(hours=2))
+        self.assertIs(embedding.is_significant_change('buy milk'), True)
+
+
+@override_settings(EMBEDDING_CACHE_TOUCH_SECONDS=3600)
+class EmbeddingCacheTests(TestCase):
+    databases = {'default', 'embeddings'}
+
+    def last_used(self, text):
+        return EmbeddingCacheEntry.objects.get(key=EmbeddingCacheEntry.make_key('model', text)).last_used
+
+    def test_hits_only_touch_entries_used_before_the_interval(self):
+        EmbeddingCacheEntry.set_many('model', {'recent': [0.1, 0.2], 'old': [0.3, 0.4]})
+        long_ago = timezone.now() - timezone.timedelta(hours=2)
+        EmbeddingCacheEntry.objects.filter(key=EmbeddingCacheEntry.make_key('model', 'old')).update(last_used=long_ago)
+        recent = self.last_used('recent')
+
+        found = EmbeddingCacheEntry.get_many('model', ['recent', 'old', 'missing'])
+
+        self.assertEqual(set(found), {'recent', 'old'})
+        self.assertAlmostEqual(found['old'][0], 0.3, places=5)
+        self.assertEqual(self.last_used('recent'), recent)
+        self.assertGreater(self.last_used('old'), long_ago + timezone.timedelta(hours=1))
+
+    def test_only_cache_misses_are_requested_in_one_batch(self):
+        EmbeddingCacheEntry.set_many('model', {'cached': [0.5]})
+        with mock.patch.object(
+            NoteEmbedding, '_request_embeddings', side_effect=lambda texts, *args: [[float(len(text))] for text in texts]
+        ) as request_embeddings:
+            vectors = NoteEmbedding.get_embeddings(['budget', 'cached', 'plans', 'budget'], model_name='model')
+            NoteEmbedding.get_embeddings(['plans'], model_name='model')
+
+        self.assertEqual([vector[0] for vector in vectors], [6.0, 0.5, 5.0, 6.0])
+        request_embeddings.assert_called_once_with(['budget', 'plans'], 'model', None)
+
+
+class SearchTermTests(NoteTestMixin, TestCase):
+    def counts(self, user=None):
+        return dict(SearchTerm.objects.filter(user=user or self.user).values_list('term', 'note_count'))
+
+    def test_apply_change_counts_only_the_difference(self):
+        SearchTerm.apply_change(self.user.id, '', 'budget review #todo')
+        SearchTerm.apply_change(self.user.id, '', 'budget draft')
+        self.assertEqual(self.counts(), {'budget': 2, 'review': 1, 'todo': 1, '#todo': 1, 'draft': 1})
+
+        SearchTerm.apply_change(self.user.id, 'budget draft', 'budget final final')
+        self.assertEqual(self.counts(), {'budget': 2, 'review': 1, 'todo': 1, '#todo': 1, 'final': 1})
+
+        SearchTerm.apply_change(self.user.id, 'budget review #todo', '')
+        self.assertEqual(self.counts(), {'budget': 1, 'final': 1})
+
+    def test_short_and_numeric_words_are_not_terms(self):
+        SearchTerm.apply_change(self.user.id, '', 'a 2024 budget x1')
+        self.assertEqual(self.counts(), {'budget': 1, 'x1': 1})
+
+    def test_note_signals_keep_counts_current(self):
+        note = self.make_note('Budget meeting #todo')
+        self.make_note('budget draft')
+        other_user = User.objects.create_user('other', 'other@example.com', 'password')
+        LocalMessage.objects.create(
+            user=other_user, list=LocalMessageList.objects.create(user=other_user, name='Work'), text='budget secret'
+        )
+        self.assertEqual(self.counts()['budget'], 2)
+        self.assertEqual(self.counts(other_user), {'budget': 1, 'secret': 1})
+
+        note.text = 'meeting notes'
+        note.save()
+        self.assertEqual(self.counts(), {'budget': 1, 'draft': 1, 'meeting': 1, 'notes': 1})
+
+        note.importance = 2
+        note.save(update_fields=['importance'])
+        note.delete()
+        self.assertEqual(self.counts(), {'budget': 1, 'draft': 1})
+
+    def test_saves_that_leave_the_text_alone_skip_the_vocabulary(self):
+        note = self.make_note('budget meeting')
+        note.importance = 2
+        with CaptureQueriesContext(connection) as queries:
+            note.save(update_fields=['importance'])
+        self.assertFalse([query for query in queries if 'note_searchterm' in query['sql']])
+        self.assertFalse([
+            query for query in queries if query['sql'].startswith('SELECT') and '"text"' in query['sql']
+        ])
+        self.assertEqual(self.counts(), {'budget': 1, 'meeting': 1})
+
+    def test_rebuild_matches_incremental_counts(self):
+        for text in ('budget review #todo', 'budget draft', 'review notes'):
+            self.make_note(text)
+        incremental = self.counts()
+        SearchTerm.objects.all().delete()
+        self.assertEqual(SearchTerm.rebuild(self.user.id), len(incremental))
+        self.assertEqual(self.counts(), incremental)
+
+    def test_complete_orders_by_note_count(self):
+        for text in ('budget review', 'budget draft', 'budgeting', 'review'):
+            self.make_note(text)
+        self.assertEqual(SearchTerm.complete(self.user.id, 'BUD'), [('budget', 2), ('budgeting', 1)])
+        self.assertEqual(SearchTerm.complete(self.user.id, 'bud', limit=1), [('budget', 2)])
+        self.assertEqual(SearchTerm.complete(self.user.id, ''), [])
+
+    def test_complete_keeps_words_and_hashtags_apart(self):
+        self.make_note('#tag tagx')
+        self.make_note('tagx')
+        self.assertEqual(SearchTerm.complete(self.user.id, 'tag'), [('tagx', 2), ('tag', 1)])
+        self.assertEqual(SearchTerm.complete(self.user.id, '#ta'), [('#tag', 1)])
+        self.assertEqual(SearchTerm.complete(self.user.id, '#'), [('#tag', 1)])
+
+
+class HybridSearchTests(NoteTestMixin, TestCase):
+    def test_fusion_favours_ids_ranked_well_in_both_lists(self):
+        self.assertEqual(reciprocal_rank_fusion([['a', 'b', 'c'], ['c']], k=1), ['c', 'a', 'b'])
+        self.assertEqual(reciprocal_rank_fusion([[5, 6, 7], [8, 7, 6]], k=60), [6, 7, 5, 8])
+
+    def test_ties_keep_first_seen_order_and_duplicates_appear_once(self):
+        # 1 and 3 swap ranks between the lists, as do 2 and 4, so each pair scores the same
+        self.assertEqual(reciprocal_rank_fusion([[1, 2, 3], [3, 4, 1]], k=60), [1, 3, 2, 4])
+        self.assertEqual(reciprocal_rank_fusion([[1, 2], []]), [1, 2])
+
+    @override_settings(SEARCH_HYBRID_MAX_DISTANCE=1.0)
+    def test_semantic_matches_beyond_the_distance_cut_are_dropped(self):
+        matches = [{'note_id': 4, 'distance': 0.5}, {'note_id': 9, 'distance': 1.5}]
+        with mock.patch.object(NoteEmbedding, 'get_embedding', return_value=[0.1]), \
+                mock.patch.object(NoteEmbedding, 'find_similar_notes_by_embedding', return_value=matches):
+            self.assertEqual(hybrid_search(LocalMessage.objects.none(), 'budget', self.user.id), [4])
+
+    def test_lexical_results_alone_when_the_vector_side_fails(self):
+        first, second = self.make_note('budget review'), self.make_note('budget draft')
+        lexical = LocalMessage.objects.filter(id__in=[first.id, second.id]).order_by('-id')
+        with mock.patch.object(NoteEmbedding, 'get_embedding', side_effect=RuntimeError('embedding service down')), \
+                self.assertLogs('note.search_utils.hybrid', 'ERROR'):
+            self.assertEqual(hybrid_search(lexical, 'budget', self.user.id), [second.id, first.id])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'tsvector and pg_trgm search is PostgreSQL only')
+class PostgresSearchTests(NoteTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.backend = get_search_backend()
+        self.assertIsInstance(self.backend, PostgresBackend)
+
+    def search(self, query, **options):
+        queryset = LocalMessage.objects.filter(user=self.user)
+        return self.backend.search(queryset, parse_query(query), **options)
+
+    def texts(self, query):
+        return set(self.search(query).values_list('text', flat=True))
+
+    def search_vector(self, note):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT search_vector::text FROM note_localmessage WHERE id = %s", [note.id])
+            return cursor.fetchone()[0]
+
+    def test_trigger_keeps_search_vector_current(self):
+        note = self.make_note('Quarterly budget')
+        self.assertEqual(self.search_vector(note), "'budget':2 'quarterly':1")
+        note.text = 'annual planning'
+        note.save()
+        self.assertEqual(self.search_vector(note), "'annual':1 'planning':2")
+        LocalMessage.objects.filter(id=note.id).update(importance=2)
+        self.assertEqual(self.search_vector(note), "'annual':1 'planning':2")
+
+    def test_prefix_phrase_and_negation(self):
+        self.make_note('meeting about the draft copy')
+        self.make_note('meeting about the final copy')
+        self.make_note('draft of the copy')
+        self.assertEqual(self.texts('meet'), {'meeting about the draft copy', 'meeting about the final copy'})
+        self.assertEqual(self.texts('"draft copy"'), {'meeting about the draft copy'})
+        self.assertEqual(self.texts('copy -"draft copy"'), {'meeting about the final copy', 'draft of the copy'})
+        self.assertEqual(self.texts('meeting -(draft or final)'), set())
+
+    def test_typos_match_through_trigrams(self):
+        self.make_note('quarterly budget review')
+        self.make_note('holiday plans')
+        self.assertEqual(self.texts('quartely'), {'quarterly budget review'})
+
+    def test_negated_terms_do_not_match_typos(self):
+        self.make_note('quarterly budget review')
+        self.make_note('annual budget review')
+        self.assertEqual(self.texts('budget -quartely'), {'quarterly budget review', 'annual budget review'})
+        self.assertEqual(self.texts('budget -quarterly'), {'annual budget review'})
+
+    def test_rank_and_snippets(self):
+        self.make_note('budget')
+        best = self.make_note('budget budget review of the budget')
+        results = list(self.search('budget', order=ORDER_RANK, snippets=True))
+        self.assertEqual(results[0].id, best.id)
+        self.assertIn('\x02budget\x03', results[0].snippet)
+
+    def test_tags_and_filters(self):
+        home = LocalMessageList.objects.create(user=self.user, name='Home')
+        self.make_note('call the bank #todo')
+        LocalMessage.objects.create(user=self.user, list=home, text='fix the sink #todo')
+        self.make_note('#todone already')
+        self.assertEqual(self.texts('#todo'), {'call the bank #todo', 'fix the sink #todo'})
+        self.assertEqual(self.texts('#todo list:home'), {'fix the sink #todo'})
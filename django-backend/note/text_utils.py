@@ -0,0 +1,5 @@
+import re
+
+# Word tokens shared by search parsing, the search vocabulary, near-duplicate shingles, topic labels and
+# embedding change detection, so they all agree on what a word is
+TOKEN_RE = re.compile(r'\w+')
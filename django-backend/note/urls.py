@@ -3,14 +3,18 @@ from django.urls import path, re_path
 from .views.file_view import FileUploadView, serve_minio_file, NoteFilesView, FileDetailView, FileListView
 from .views.list_view import NoteListView, DeleteMessageListView
 from .views.search_view import SearchResultsView
+from .views.autocomplete_view import SearchAutocompleteView
 from .views.note_view import NoteView, SingleNoteView, MoveMessageView, IncreaseImportanceView, DecreaseImportanceView, ArchiveMessageView, UnArchiveMessageView, NoteRevisionView, ImportantNotesView, NotePageView
 from .views.public_note_view import PublicNoteView
-from .views.stats_view import RevisionStatsView, NoteStatsView, FileAccessStatsView
+from .views.stats_view import RevisionStatsView, NoteStatsView, FileAccessStatsView, EmbeddingStatsView
 from .views.similar_note_view import SimilarNotesView
 from .views.reminder_view import ReminderView, SingleReminderView
 from .views.workspace_view import WorkspaceListView, WorkspaceDetailView, WorkspaceCategoriesView, DefaultWorkspaceView
 from .views.collection_view import FileCollectionView, CollectionFilesView, UnifiedFeedView
 from .views.hashtag_view import TrendingHashtagsView
+from .views.duplicate_view import DuplicateNotesView
+from .views.topic_view import NoteTopicsView
+from .views.note_map_view import NoteMapView
 
 
 urlpatterns = [
@@ -44,6 +48,10 @@ urlpatterns = [
     path('list/<int:pk>/', NoteListView.as_view(), name='note-list-detail'),
     path('list/', NoteListView.as_view(), name='note-list'),
     path('search/', SearchResultsView.as_view()),
+    path('search/autocomplete/', SearchAutocompleteView.as_view(), name='search-autocomplete'),
+    path('duplicates/', DuplicateNotesView.as_view(), name='duplicate-notes'),
+    path('topics/', NoteTopicsView.as_view(), name='note-topics'),
+    path('map/', NoteMapView.as_view(), name='note-map'),
     
     # Important notes endpoints (must be before the slug catch-all)
     path('important/', ImportantNotesView.as_view(), name='important-notes'),
@@ -66,6 +74,7 @@ urlpatterns = [
     path('stats/revisions/', RevisionStatsView.as_view(), name='revision-stats'),
     path('stats/notes/', NoteStatsView.as_view(), name='note-stats'),
     path('stats/access/', FileAccessStatsView.as_view(), name='file-access'),
+    path('stats/embeddings/', EmbeddingStatsView.as_view(), name='embedding-stats'),
 
     # Revisions
     path('revisions/<int:note_id>/', NoteRevisionView.as_view(), name='note-revisions'),
@@ -0,0 +1,46 @@
+import re
+
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..models import LocalMessageList, SearchTerm
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+# The token being typed: the text after the last space, without a leading '-' or '('
+LAST_TOKEN_RE = re.compile(r'[-(]*(?P<token>[^\s()"]*)$')
+
+
+class SearchAutocompleteView(APIView):
+    """
+    Completions for the word being typed in the search box.
+
+    GET /api/note/search/autocomplete/?q=weekly%20bud returns the user's
+    words starting with the last token ('bud'), in the most notes first.
+    '#to' completes hashtags and 'list:wo' completes list slugs. Answered
+    from the SearchTerm vocabulary by one index range scan, so it is
+    cheap enough to call on every keystroke.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = request.GET.get('q', '')
+        try:
+            limit = min(max(int(request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        except ValueError:
+            limit = DEFAULT_LIMIT
+
+        token = LAST_TOKEN_RE.search(query).group('token')
+        if token.lower().startswith('list:'):
+            prefix = token[len('list:'):]
+            slugs = LocalMessageList.objects.filter(
+                user=request.user, slug__startswith=prefix.lower()
+            ).order_by('slug').values_list('slug', flat=True).distinct()[:limit]
+            completions = [{'term': f'list:{slug}', 'count': None} for slug in slugs]
+        else:
+            completions = [
+                {'term': term, 'count': count}
+                for term, count in SearchTerm.complete(request.user.id, token, limit)
+            ]
+        return Response({'prefix': token, 'completions': completions})
@@ -0,0 +1,43 @@
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..models import LocalMessage, NoteSignature
+
+PREVIEW_CHARS = 120
+
+
+class DuplicateNotesView(APIView):
+    """
+    Clusters of near-duplicate notes in the user's whole corpus.
+
+    GET /api/note/duplicates/ returns the clusters found through the
+    MinHash LSH buckets, largest first, with a short preview of each note.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        clusters = NoteSignature.duplicate_clusters(request.user.id)
+        note_ids = [note_id for cluster in clusters for note_id in cluster]
+        notes = {
+            note['id']: note
+            for note in LocalMessage.objects.filter(id__in=note_ids, user=request.user).values(
+                'id', 'text', 'list_id', 'archived', 'created_at'
+            )
+        }
+
+        result = []
+        for cluster in clusters:
+            members = [
+                {
+                    'id': notes[note_id]['id'],
+                    'preview': notes[note_id]['text'][:PREVIEW_CHARS],
+                    'list_id': notes[note_id]['list_id'],
+                    'archived': notes[note_id]['archived'],
+                    'created_at': notes[note_id]['created_at'],
+                }
+                for note_id in cluster if note_id in notes
+            ]
+            if len(members) > 1:
+                result.append({'notes': members})
+        return Response({'clusters': result, 'total_clusters': len(result)})
@@ -0,0 +1,27 @@
+from django.core.cache import cache
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..models import NoteMapBasis
+from ..tasks import build_user_note_map
+
+BUILD_LOCK_KEY = 'note_map_build:{user_id}'
+BUILD_LOCK_TTL = 60 * 10
+
+
+class NoteMapView(APIView):
+    """
+    x/y coordinates of the user's notes on a 2D semantic map.
+
+    GET /api/note/map/ reads points precomputed by note.tasks.build_note_maps.
+    A user without a map yet gets an empty list while their basis is fitted
+    in the background from the current export.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        result = NoteMapBasis.map_for_user(request.user.id)
+        if result['built_at'] is None and cache.add(BUILD_LOCK_KEY.format(user_id=request.user.id), 1, BUILD_LOCK_TTL):
+            build_user_note_map.delay(request.user.id)
+        return Response(result)
@@ -5,12 +5,11 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.generics import GenericAPIView
 from rest_framework.mixins import ListModelMixin
 from .pagination import DateBasedPagination
-from ..models import LocalMessage, LocalMessageList, Link, NoteRevision, NoteEmbedding, Workspace
+from ..models import LocalMessage, LocalMessageList, Link, NoteRevision, NoteSignature, Workspace
 from ..serializers import MessageSerializer, MoveMessageSerializer, NoteRevisionSerializer
 import re 
 from django.utils import timezone
 from typing import Optional
-import concurrent.futures
 import logging
 
 from ..file_utils import FileManager
@@ -18,23 +17,6 @@ from ..file_utils import FileManager
 # Set up logging
 logger = logging.getLogger(__name__)
 
-# Thread pool executor for async tasks
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
-
-# Function to create embeddings asynchronously
-def create_embeddings_async(note_id, note_text=None):
-    try:
-        note = LocalMessage.objects.get(pk=note_id)
-        if note_text is None:
-            note_text = note.text
-            
-        # Create embedding for the note if it's not RTL
-        if not NoteEmbedding.hasRTL(note_text):
-            NoteEmbedding.create_for_note(note)
-                    
-        logger.info(f"Successfully created embeddings for note {note_id}")
-    except Exception as e:
-        logger.error(f"Error creating embeddings for note {note_id}: {str(e)}", exc_info=True)
 
 class RevisionService:
     MIN_TIME_BETWEEN_REVISIONS = 900  # minimum seconds between revisions
@@ -188,11 +170,10 @@ class SingleNoteView(APIView):
                     status=status.HTTP_409_CONFLICT
                 )
             RevisionService.update_note_with_revision(item, new_text)
-            insert_links(item)
-            executor.submit(create_embeddings_async, item.id, new_text)
+            duplicate_ids = index_note_text(item)
             item.refresh_from_db()
             serialized = self.serializer_class(item)
-            return Response(serialized.data, status=status.HTTP_200_OK)
+            return Response({**serialized.data, "possible_duplicates": duplicate_ids}, status=status.HTTP_200_OK)
         except LocalMessage.DoesNotExist:
             return Response({"error": "Note not found"}, status=status.HTTP_404_NOT_FOUND)
 
@@ -328,6 +309,11 @@ def insert_links(note: LocalMessage):
             print(f"dest_note is {dest_note}")
             Link.objects.create(source_message=note, dest_message=dest_note)
 
+def index_note_text(note: LocalMessage):
+    """ extract links and refresh the near-duplicate signature of a saved note, returning likely duplicate ids """
+    insert_links(note)
+    return NoteSignature.update_for_note(note)
+
 from django.shortcuts import get_object_or_404
 
 def get_shown_list_ids(user, workspace=None):
@@ -440,10 +426,9 @@ class NoteView(GenericAPIView, ListModelMixin):
             
             note = serializer.save(list=lst, user=request.user)
             RevisionService.update_or_create_revision(note.id, note.text)
-            insert_links(note)
-            executor.submit(create_embeddings_async, note.id, note.text)
+            duplicate_ids = index_note_text(note)
             
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response({**serializer.data, "possible_duplicates": duplicate_ids}, status=status.HTTP_201_CREATED)
             
         except Exception as e:
             logger.error(f"Error creating note: {str(e)}", exc_info=True)
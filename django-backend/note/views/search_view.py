@@ -1,11 +1,14 @@
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import GenericAPIView
 from rest_framework.mixins import ListModelMixin
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from drf_spectacular.utils import extend_schema
-from django.db.models import Q
 from ..models import LocalMessage, LocalMessageList
-from ..serializers import MessageSerializer, SearchSerializer
+from ..serializers import MessageSerializer, SearchSerializer, SearchSnippetSerializer
+from ..search_utils.backends import ORDER_CREATED, ORDER_RANK, get_search_backend
+from ..search_utils.hybrid import hybrid_search
+from ..search_utils.query_parser import QuerySyntaxError, constraints, has_filter, parse_query, plain_text
 from .pagination import DateBasedPagination
 
 class SearchResultsView(GenericAPIView, ListModelMixin):
@@ -13,14 +16,37 @@ class SearchResultsView(GenericAPIView, ListModelMixin):
     pagination_class = DateBasedPagination
     serializer_class = MessageSerializer
 
+    def snippets_requested(self):
+        return self.request.GET.get('snippets', 'false').lower() == 'true'
+
+    def get_serializer_class(self):
+        return SearchSnippetSerializer if self.snippets_requested() else MessageSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['search_query'] = getattr(self, 'parsed_query', None)
+        return context
+
     def get_queryset(self):
         query = self.request.GET.get("q", "")
         list_slugs = self.request.GET.get("list_slug", "")
         show_hidden = self.request.GET.get('show_hidden', 'false').lower() == 'true'
         has_files = self.request.GET.get('has_files', 'false').lower() == 'true'
+        mode = self.request.GET.get('mode', 'text')
+        order = ORDER_RANK if self.request.GET.get('order') == 'relevance' else ORDER_CREATED
 
         print(f"list_slugs {list_slugs} query is {query}")
         
+        try:
+            parsed = parse_query(query)
+        except QuerySyntaxError as e:
+            raise ValidationError({'q': str(e)})
+        self.parsed_query = parsed
+        snippets = self.snippets_requested()
+        # An explicit is:archived in the query decides archived notes itself
+        if has_filter(parsed, 'is', 'archived'):
+            show_hidden = True
+
         queryset = LocalMessage.objects.filter(user=self.request.user)
         if not show_hidden:
             queryset = queryset.filter(archived=False)
@@ -28,33 +54,44 @@ class SearchResultsView(GenericAPIView, ListModelMixin):
         if has_files:
             queryset = queryset.filter(files__isnull=False).distinct()
         
-        if query:
-            if ' and ' in query:
-                search_terms = query.split(' and ')
-                text_filter = Q()
-                for term in search_terms:
-                    text_filter &= Q(text__icontains=term.strip())
-            elif ' or ' in query:
-                search_terms = query.split(' or ')
-                text_filter = Q()
-                for term in search_terms:
-                    text_filter |= Q(text__icontains=term.strip())
-            else:
-                text_filter = Q(text__icontains=query.strip())
-            
-            queryset = queryset.filter(text_filter)
-        
+        list_ids = None
         if list_slugs:
             slug_list = [slug.strip() for slug in list_slugs.split(',')]
             lists = LocalMessageList.objects.filter(slug__in=slug_list, user=self.request.user)
             
             if lists.exists():
-                list_filter = Q()
-                for lst in lists:
-                    list_filter |= Q(list=lst.id)
-                queryset = queryset.filter(list_filter)
+                list_ids = set(lists.values_list('id', flat=True))
+                queryset = queryset.filter(list__in=list_ids)
         
-        return queryset.order_by('-created_at')
+        if snippets:
+            queryset = queryset.select_related('list')
+
+        if parsed is None:
+            return queryset.order_by('-created_at')
+
+        backend = get_search_backend()
+        # Fusion works on ranks, so hybrid mode feeds it the best lexical matches first when the backend can rank
+        lexical_order = ORDER_RANK if mode == 'hybrid' else order
+        lexical_queryset = backend.search(queryset, parsed, lexical_order, snippets=snippets)
+        semantic_query = plain_text(parsed)
+        if mode != 'hybrid' or not semantic_query:
+            return lexical_queryset
+
+        note_ids = None
+        if has_files:
+            note_ids = set(queryset.values_list('id', flat=True))
+        fused_ids = hybrid_search(
+            lexical_queryset, semantic_query, self.request.user.id,
+            list_ids=list_ids,
+            archived=None if show_hidden else False,
+            note_ids=note_ids,
+        )
+        # Semantic hits only saw the view's filters, so they are checked against the query's own filters and negations
+        query_constraints = constraints(parsed)
+        if query_constraints is not None:
+            queryset = backend.search(queryset, query_constraints)
+        notes = queryset.in_bulk(fused_ids)
+        return [notes[note_id] for note_id in fused_ids if note_id in notes]
 
     @extend_schema(
         parameters=[SearchSerializer],
@@ -62,11 +99,20 @@ class SearchResultsView(GenericAPIView, ListModelMixin):
         Search messages across multiple lists.
         
         Parameters:
-        - q: Search query string (supports 'and'/'or' operators, e.g., 'term1 and term2' or 'term1 or term2')
+        - q: Search query. Terms are ANDed; supports 'and'/'or'/'not' with parentheses,
+             "exact phrases", -term, #tag, list:slug[,slug], has:file, is:archived,
+             before:YYYY-MM-DD and after:YYYY-MM-DD (e.g. '(budget or invoice) -draft after:2024-01-01')
         - list_slug: Optional - Single list slug or comma-separated list of slugs (e.g., 'list1,list2,list3')
                     If omitted, searches all lists
         - show_hidden: Include archived notes (true/false)
         - has_files: Only return messages that contain files (true/false)
+        - mode: 'text' (default) runs the full-text match; 'hybrid' runs it and a semantic
+                search in parallel and fuses them by reciprocal rank
+        - snippets: 'true' to return, per hit, the note id, list, timestamps and a short snippet
+                    with [start, end) offsets of the highlighted words, in UTF-16 code units like
+                    JavaScript string indices, instead of the full note and its links
+        - order: 'date' (default, newest first) or 'relevance' (the search index's ranking: bm25 on
+                 SQLite, ts_rank_cd plus trigram similarity on PostgreSQL)
         """
     )
     def get(self, request, **kwargs):
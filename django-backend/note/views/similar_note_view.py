@@ -2,8 +2,13 @@ from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from ..models import LocalMessage, NoteEmbedding, Link # Added Link
+from django.conf import settings
+from django.core.cache import cache
+from ..embedding_utils.http_client import EmbeddingServiceUnavailable
+from ..models import LocalMessage, NoteEmbedding, NoteChunk, NoteNeighbor, Link # Added Link
 from ..serializers import SimilarNoteSerializer
+from ..tasks import enqueue_note_embedding
+import hashlib
 import logging
 from urllib.parse import urlparse, parse_qs
 
@@ -37,61 +42,37 @@ class SimilarNotesView(APIView):
                 workspace_category_ids.update(ws.categories.values_list('id', flat=True))
         
         try:
-            results = []
-            
-            # Ensure embedding exists for this note
-            embedding_exists = NoteEmbedding.objects.filter(note_id=note.id).exists()
-            
-            if not embedding_exists:
-                # Create embedding if it doesn't exist
-                try:
-                    NoteEmbedding.create_for_note(note)
-                except Exception as e:
-                    logger.error(f"Error creating embedding for note {note_id}: {str(e)}")
+            # Neighbours are materialized when the note is embedded, so this is a single indexed lookup
+            neighbors = list(NoteNeighbor.objects.filter(note_id=note.id).values_list('neighbor_id', 'distance'))
+            embedded = bool(neighbors) or NoteEmbedding.objects.filter(note_id=note.id).exists()
+            if not neighbors:
+                if embedded:
+                    neighbors = [
+                        (result['note_id'], result['distance'])
+                        for result in NoteEmbedding.find_similar_notes(note.id, limit=settings.EMBEDDING_NEIGHBOR_COUNT)
+                    ]
+                elif not NoteEmbedding.hasRTL(note.text):
+                    # RTL notes are never embedded, so queueing them would only repeat on every request
+                    enqueue_note_embedding(note.id)
 
             # Get IDs of linked notes (both directions)
             backlink_ids = set(Link.objects.filter(dest_message_id=note_id).values_list('source_message_id', flat=True))
             forward_link_ids = set(Link.objects.filter(source_message_id=note_id).values_list('dest_message_id', flat=True))
             linked_note_ids = backlink_ids | forward_link_ids
 
-            # Fetch more items to account for filtering out linked notes and workspace categories
-            effective_limit = (limit + len(linked_note_ids)) * 2 
-
-            # Get similar notes based on embeddings
-            similar_notes_results = NoteEmbedding.find_similar_notes(note_id, limit=effective_limit)
-            
-            # Process and format results
-            for result in similar_notes_results:
-                try:
-                    similar_note_id = result['note_id']
-                    # Exclude if the similar note is the note itself or if it's linked (either direction)
-                    if similar_note_id == note.id or similar_note_id in linked_note_ids:
-                        continue
+            results = self._filter_neighbors(neighbors, linked_note_ids, workspace_category_ids)
 
-                    similar_note = LocalMessage.objects.get(id=similar_note_id)
-                    # Only include notes from categories in the same workspaces
-                    if similar_note.list_id not in workspace_category_ids:
-                        continue
-                    distance = float(result['distance'])
-                    sim_score = self._calculate_similarity_score(distance)
-                    # Only include notes with reasonable similarity
-                    if sim_score >= 0.65:
-                        results.append({
-                            'id': similar_note.id,
-                            'text': similar_note.text,
-                            'similarity_score': sim_score,
-                            'distance': distance,
-                            'is_full_note': True,
-                            'created_at': similar_note.created_at,
-                            'updated_at': similar_note.updated_at,
-                            'category': {
-                                'id': similar_note.list.id,
-                                'name': similar_note.list.name,
-                                'slug': similar_note.list.slug
-                            }
-                        })
-                except LocalMessage.DoesNotExist:
-                    continue
+            # Stored neighbours ignore the workspace; when too few fall inside it, search its lists directly
+            if len(results) < limit and embedded and workspace_category_ids:
+                found_ids = {result['id'] for result in results}
+                neighbors = [
+                    (result['note_id'], result['distance'])
+                    for result in NoteEmbedding.find_similar_notes(
+                        note.id, limit=limit, list_ids=workspace_category_ids,
+                        exclude_note_ids=linked_note_ids | found_ids
+                    )
+                ]
+                results.extend(self._filter_neighbors(neighbors, linked_note_ids, workspace_category_ids))
             
             # Sort by distance (lower score is better)
             results.sort(key=lambda x: x['distance'])
@@ -133,23 +114,35 @@ class SimilarNotesView(APIView):
         
         if exclude_note_id:
             exclude_note_id = int(exclude_note_id)
+
+        cache_key = self._results_cache_key(request.user.id, text, limit, exclude_note_id, list_slugs, has_files)
         
         try:
-            all_found_items = self._find_similars_by_text(
-                text=text,
-                limit_per_type=limit,
-                exclude_note_id=exclude_note_id,
-                list_slugs=list_slugs,
-                user=request.user
-            )
+            try:
+                all_found_items = self._find_similars_by_text(
+                    text=text,
+                    limit_per_type=limit,
+                    exclude_note_id=exclude_note_id,
+                    list_slugs=list_slugs,
+                    user=request.user
+                )
+            except EmbeddingServiceUnavailable:
+                # Fail fast with the last good answer for this text, or nothing, while the model server is down
+                response = Response(cache.get(cache_key, []))
+                response['X-Embedding-Service'] = 'unavailable'
+                return response
             
             if has_files:
-                all_found_items = [item for item in all_found_items if LocalMessage.objects.filter(id=item['id'], files__isnull=False).exists()]
+                ids_with_files = set(LocalMessage.objects.filter(
+                    id__in=[item['id'] for item in all_found_items], files__isnull=False
+                ).values_list('id', flat=True))
+                all_found_items = [item for item in all_found_items if item['id'] in ids_with_files]
             
             all_found_items.sort(key=lambda x: x['distance'])
             results = all_found_items[:limit]
             
             serializer = SimilarNoteSerializer(results, many=True)
+            cache.set(cache_key, serializer.data, settings.SIMILAR_RESULTS_CACHE_SECONDS)
             return Response(serializer.data)
             
         except Exception as e:
@@ -159,6 +152,42 @@ class SimilarNotesView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    def _results_cache_key(self, user_id, text, *params):
+        digest = hashlib.sha256(repr((text, params)).encode('utf-8')).hexdigest()
+        return f"similar_text:{user_id}:{digest}"
+
+    def _filter_neighbors(self, neighbors, linked_note_ids, workspace_category_ids):
+        """Format the (note id, distance) neighbours in the workspace that are similar enough and not linked"""
+        results = []
+        similar_notes = LocalMessage.objects.select_related('list').in_bulk(
+            [neighbor_id for neighbor_id, _ in neighbors if neighbor_id not in linked_note_ids]
+        )
+        for neighbor_id, distance in neighbors:
+            similar_note = similar_notes.get(neighbor_id)
+            if similar_note is None or similar_note.list_id not in workspace_category_ids:
+                continue
+            sim_score = self._calculate_similarity_score(distance)
+            # Only include notes with reasonable similarity
+            if sim_score >= 0.65:
+                results.append(self._format_result(similar_note, distance, sim_score))
+        return results
+
+    def _format_result(self, note, distance, sim_score):
+        return {
+            'id': note.id,
+            'text': note.text,
+            'similarity_score': sim_score,
+            'distance': distance,
+            'is_full_note': True,
+            'created_at': note.created_at,
+            'updated_at': note.updated_at,
+            'category': {
+                'id': note.list.id,
+                'name': note.list.name,
+                'slug': note.list.slug
+            }
+        }
+
     def _calculate_similarity_score(self, distance):
         """Convert distance to similarity score"""
         max_distance = 4.0
@@ -185,47 +214,59 @@ class SimilarNotesView(APIView):
         try:
             text_embedding = NoteEmbedding.get_embedding(text)
             if text_embedding:
-                similar_notes_data = NoteEmbedding.find_similar_notes_by_embedding(
+                similar_chunks = NoteChunk.find_similar_chunks(
                     text_embedding,
+                    user_id=user.id,
                     limit=limit_per_type, 
-                    exclude_note_id=exclude_note_id
+                    exclude_note_id=exclude_note_id,
+                    list_ids=allowed_category_ids
+                )
+                similar_notes = LocalMessage.objects.select_related('list').in_bulk(
+                    [chunk_data['note_id'] for chunk_data in similar_chunks]
                 )
 
-                notes_count = 0
-                for note_data in similar_notes_data:
-                    note_id = note_data['note_id']
-                    distance = float(note_data['distance'])
+                for chunk_data in similar_chunks:
+                    note_id = chunk_data['note_id']
+                    similar_note = similar_notes.get(note_id)
+                    distance = float(chunk_data['distance'])
                     sim_score = self._calculate_similarity_score(distance)
 
-                    if sim_score >= 0.65 and note_id not in added_note_ids:
-                        try:
-                            similar_note = LocalMessage.objects.get(id=note_id)
-                            if allowed_category_ids is not None and similar_note.list_id not in allowed_category_ids:
-                                continue
-                            all_results.append({
-                                'id': similar_note.id,
-                                'text': similar_note.text,
-                                'similarity_score': sim_score,
-                                'distance': distance,
-                                'is_full_note': True,
-                                'created_at': similar_note.created_at,
-                                'updated_at': similar_note.updated_at,
-                                'category': {
-                                    'id': similar_note.list.id,
-                                    'name': similar_note.list.name,
-                                    'slug': similar_note.list.slug
-                                }
-                            })
-                            added_note_ids.add(note_id)
-                            notes_count += 1
+                    if similar_note is not None and sim_score >= 0.65 and note_id not in added_note_ids:
+                        result = self._format_result(similar_note, distance, sim_score)
+                        result['is_full_note'] = chunk_data['start_offset'] == 0 and chunk_data['end_offset'] >= len(similar_note.text)
+                        result['chunk_start'] = chunk_data['start_offset']
+                        result['chunk_end'] = chunk_data['end_offset']
+                        all_results.append(result)
+                        added_note_ids.add(note_id)
 
-                            
-                            if notes_count >= limit_per_type:
-                                break
-                        except LocalMessage.DoesNotExist:
-                            continue
+                # Notes embedded before chunking existed have no chunks until backfilled; match them on the note vector
+                note_matches = [
+                    match for match in NoteEmbedding.find_similar_notes_by_embedding(
+                        text_embedding,
+                        limit=limit_per_type,
+                        exclude_note_id=exclude_note_id,
+                        user_id=user.id,
+                        list_ids=allowed_category_ids
+                    )
+                    if match['note_id'] not in added_note_ids
+                ]
+                chunked_note_ids = set(NoteChunk.objects.filter(
+                    note_id__in=[match['note_id'] for match in note_matches]
+                ).values_list('note_id', flat=True).distinct())
+                similar_notes = LocalMessage.objects.select_related('list').in_bulk(
+                    [match['note_id'] for match in note_matches if match['note_id'] not in chunked_note_ids]
+                )
+                for match in note_matches:
+                    similar_note = similar_notes.get(match['note_id'])
+                    distance = float(match['distance'])
+                    sim_score = self._calculate_similarity_score(distance)
+                    if similar_note is not None and sim_score >= 0.65:
+                        all_results.append(self._format_result(similar_note, distance, sim_score))
+                        added_note_ids.add(similar_note.id)
             else:
                 logger.info(f"Could not get embedding for text '{text[:50]}...', skipping note-level similarity search.")
+        except EmbeddingServiceUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error finding similar notes for text '{text[:50]}...': {str(e)}")
             
@@ -5,7 +5,7 @@ from rest_framework.response import Response
 from django.db.models import Count
 from django.db.models.functions import TruncDate
 
-from ..models import NoteRevision, LocalMessage
+from ..models import NoteRevision, LocalMessage, NoteEmbedding
 
 from rest_framework.permissions import IsAuthenticated
 
@@ -13,6 +13,8 @@ from rest_framework.permissions import IsAuthenticated
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_control
 from ..file_utils import file_access_tracker
+from ..tasks import pending_embedding_count
+from ..embedding_utils.http_client import get_ollama_client
 
 from django.conf import settings
 
@@ -86,6 +88,26 @@ class NoteStatsView(APIView):
                 'created_at'
             )
         )
+
+
+class EmbeddingStatsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @method_decorator(cache_control(no_cache=True, no_store=True, must_revalidate=True))
+    def get(self, request):
+        # Classifying every note is the sweep's job; until its first run there is no summary yet
+        summary = NoteEmbedding.cached_freshness(request.user.id) or {'computed_at': None}
+        summary.pop('orphaned', None)
+        # The job queue and the embedding service are shared by all users, so only staff see their state
+        staff = request.user.is_staff
+        return Response({
+            'pending_jobs': pending_embedding_count() if staff else None,
+            **summary,
+            # Counters of this web worker process only
+            'embedding_service': (
+                get_ollama_client().metrics() if staff and settings.EMBEDDING_PROVIDER == 'ollama' else None
+            ),
+        })
     
 
 
@@ -0,0 +1,43 @@
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..models import LocalMessage, NoteTopic
+
+PREVIEW_CHARS = 120
+PREVIEW_NOTES = 3
+
+
+class NoteTopicsView(APIView):
+    """
+    Suggested topic clusters of the user's notes, computed nightly by note.tasks.cluster_note_topics.
+
+    GET /api/note/topics/ returns each topic's label, size and member note
+    ids nearest to the centroid first, with previews of the closest notes.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        note_topics = list(NoteTopic.objects.filter(user_id=request.user.id).prefetch_related('members'))
+        member_ids = {topic.id: [member.note_id for member in topic.members.all()] for topic in note_topics}
+        preview_ids = [note_id for note_ids in member_ids.values() for note_id in note_ids[:PREVIEW_NOTES]]
+        previews = dict(
+            LocalMessage.objects.filter(id__in=preview_ids, user=request.user).values_list('id', 'text')
+        )
+
+        return Response({
+            'topics': [
+                {
+                    'id': topic.id,
+                    'label': topic.label,
+                    'size': topic.size,
+                    'note_ids': member_ids[topic.id],
+                    'previews': [
+                        {'id': note_id, 'preview': previews[note_id][:PREVIEW_CHARS]}
+                        for note_id in member_ids[topic.id][:PREVIEW_NOTES] if note_id in previews
+                    ],
+                    'created_at': topic.created_at,
+                }
+                for topic in note_topics
+            ]
+        })